@@ -38,6 +38,8 @@ newqml += Tree("C:\\Qt\\5.5\\mingw492_32\\qml\\Qt", prefix = 'Qt')
 tools = []
 tools += Tree("tools", prefix = 'tools')
 
+catalog = [('liveusb\\releases.catalog', 'liveusb\\releases.catalog', 'DATA')]
+
 stripQml(a.binaries)
 stripDebug(a.binaries)
 stripDebug(newqml)
@@ -55,6 +57,7 @@ coll = COLLECT(exe,
                a.binaries,
                newqml,
                tools,
+               catalog,
                strip=False,
                upx=True,
                name='liveusb-creator')
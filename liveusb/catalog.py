@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Release catalogs: the one we ship, and the last one we crawled.
+
+Crawling the Fedora sites takes a while, so we start from the catalog of the
+last crawl, kept in the user's cache directory, and bring it up to date in
+the background.  Along with the releases, the catalog remembers the ETag and
+Last-Modified of every page the crawl fetched, so the next refresh can ask
+the servers whether any of them changed before crawling them all again.
+Until there is such a catalog, we start from the one shipped with us.
+
+Both are in the same format, made to be cheap to load: a header line, a line
+of compact JSON with everything about the releases but their descriptions,
+and then the descriptions themselves.  Those are only needed by the GUI, for
+the releases it shows, so each one is read from the file the first time it
+is asked for.  Before CatalogStore.save replaces a catalog, the releases
+still loaded from it read their descriptions, and the header has a random
+generation, so a release from a catalog replaced some other way doesn't read
+a description from the wrong place.
+"""
+
+import binascii
+import logging
+import weakref
+import json
+import time
+import sys
+import os
+
+from liveusb.hashcache import get_cache_dir
+
+log = logging.getLogger(__name__)
+
+MAGIC = 'liveusb-catalog'
+CATALOG_VERSION = 2
+
+# The CatalogReleases still in use, which need their descriptions read
+# before the file they come from is replaced
+_loaded = weakref.WeakValueDictionary()   # {id(release): release}
+
+
+def get_builtin_catalog():
+    """ Return the path of the catalog we ship """
+    if getattr(sys, 'frozen', False):
+        base = os.path.join(os.path.dirname(sys.executable), 'liveusb')
+    else:
+        base = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(base, 'releases.catalog')
+
+
+class CatalogRelease(dict):
+    """ A release loaded from a catalog file, which reads its description
+    from the file when it is first asked for.
+    """
+
+    def __init__(self, data, filename, generation, span):
+        dict.__init__(self, data)
+        self._filename = filename
+        self._generation = generation
+        self._span = span
+
+    def _read_description(self):
+        offset, length = self._span
+        try:
+            with open(self._filename, 'rb') as catalog:
+                if catalog.readline().split() != \
+                        [MAGIC, str(CATALOG_VERSION), self._generation]:
+                    log.debug('%s was replaced, the description of %s is '
+                              'gone' % (self._filename, self.get('name')))
+                    return u''
+                catalog.seek(offset)
+                return catalog.read(length).decode('utf-8')
+        except (IOError, UnicodeDecodeError), e:
+            log.warning('Unable to read the description of %s: %r' %
+                        (self.get('name'), e))
+            return u''
+
+    def __missing__(self, key):
+        if key != 'description':
+            raise KeyError(key)
+        description = self['description'] = self._read_description()
+        return description
+
+    def load(self):
+        """ Read everything we haven't yet """
+        self['description']
+
+    def __eq__(self, other):
+        self.load()
+        if isinstance(other, CatalogRelease):
+            other.load()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+
+def write_catalog(out, releases, pages=None, updated=None):
+    """ Write out a catalog.
+
+    @param out: A file open for writing, in binary mode.
+    @param releases: The releases, as returned by get_fedora_flavors().
+    @param pages: The {url: {'etag': ..., 'modified': ...}} of the pages
+                  they were crawled from.
+    @param updated: When they were crawled.
+    """
+    if updated is None:
+        updated = time.time()
+    index = []
+    spans = []
+    descriptions = []
+    offset = 0
+    for release in releases:
+        try:
+            description = release['description'] or u''
+        except KeyError:
+            description = u''
+        if isinstance(description, unicode):
+            description = description.encode('utf-8')
+        index.append(dict([(key, value) for key, value in release.items()
+                           if key != 'description']))
+        spans.append([offset, len(description)])
+        descriptions.append(description)
+        offset += len(description)
+    generation = binascii.hexlify(os.urandom(8))
+    out.write('%s %d %s\n' % (MAGIC, CATALOG_VERSION, generation))
+    json.dump({'updated': updated, 'pages': pages or {}, 'releases': index,
+               'descriptions': spans}, out, separators=(',', ':'),
+              sort_keys=True)
+    out.write('\n')
+    for description in descriptions:
+        out.write(description)
+
+
+def read_catalog(filename):
+    """ Load a catalog, all but the descriptions of its releases.
+
+    @return: {'updated': ..., 'pages': {...}, 'releases': [...]}
+    @raise ValueError: If this isn't a catalog we can read.
+    """
+    with open(filename, 'rb') as catalog:
+        header = catalog.readline().split()
+        if len(header) != 3 or header[0] != MAGIC:
+            raise ValueError('not a release catalog')
+        if header[1] != str(CATALOG_VERSION):
+            raise ValueError('catalog version %s' % header[1])
+        index = json.loads(catalog.readline())
+        base = catalog.tell()
+    releases = [CatalogRelease(data, filename, header[2],
+                               (base + offset, length))
+                for data, (offset, length)
+                in zip(index['releases'], index['descriptions'])]
+    _loaded.update([(id(release), release) for release in releases])
+    return {'updated': index['updated'], 'pages': index['pages'],
+            'releases': releases}
+
+
+class CatalogStore(object):
+    """ The saved release catalog, in the user's cache directory """
+
+    def __init__(self, filename=None):
+        self.filename = filename or os.path.join(get_cache_dir(),
+                                                 'releases.catalog')
+
+    def load(self):
+        """ Return the saved catalog, or None if there is no usable one """
+        if not os.path.exists(self.filename):
+            return None
+        try:
+            catalog = read_catalog(self.filename)
+        except (IOError, ValueError, KeyError), e:
+            log.warning('Ignoring unusable release catalog %s: %r' %
+                        (self.filename, e))
+            return None
+        if not catalog['releases']:
+            return None
+        return catalog
+
+    def save(self, releases, pages):
+        """ Write out the releases and the validators of the pages they
+        were crawled from.
+        """
+        dirname = os.path.dirname(self.filename)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'wb') as out:
+                write_catalog(out, releases, pages)
+            # whoever still has releases from the old file keeps their
+            # descriptions
+            for release in _loaded.values():
+                if release._filename == self.filename:
+                    release.load()
+            if os.path.exists(self.filename) and os.name == 'nt':
+                os.unlink(self.filename)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError), e:
+            log.warning('Unable to save release catalog %s: %r' %
+                        (self.filename, e))
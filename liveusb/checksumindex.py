@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+An index of the published SHA256 sums of the release images, by directory.
+
+The images of a release sit next to each other with a single CHECKSUM file,
+so instead of fetching the listing and the CHECKSUM file again for every
+image, each directory is looked up once per crawl and parsed into a
+{filename: sha256} dict.
+
+Saved to disk, the index also remembers the ETag and Last-Modified of every
+CHECKSUM file, so the next crawl only asks the server whether it changed,
+and skips the directory listing altogether.
+"""
+
+import threading
+import urlparse
+import logging
+import json
+import re
+import os
+
+from liveusb.fetcher import Fetcher, FetchError
+
+log = logging.getLogger(__name__)
+
+CHECKSUM_LINK = re.compile(r'href="([^"]*CHECKSUM[^"]*)"')
+SHA256_LINE = re.compile(r'^SHA256 \(([^)]+)\) = ([a-f0-9]+)$')
+
+
+def parse_checksums(text):
+    """ Return the {filename: sha256} of a CHECKSUM file """
+    hashes = {}
+    for line in text.split('\n'):
+        match = SHA256_LINE.match(line.strip())
+        if match:
+            hashes[match.group(1)] = match.group(2)
+    return hashes
+
+
+class ChecksumIndex(object):
+    """ The SHA256 sums of the images in each release directory.
+
+    Saved entries look like::
+
+        {'https://.../iso': {'url': 'https://.../iso/...-CHECKSUM',
+                             'etag': '"5630e-2f7"', 'modified': '...',
+                             'hashes': {'Fedora-...iso': '...'}}}
+
+    @param fetcher: The Fetcher of the crawl, or None for our own.
+    @param filename: Where to keep the index between crawls, if anywhere.
+    """
+
+    def __init__(self, fetcher=None, filename=None):
+        self.fetcher = fetcher or Fetcher()
+        self.filename = filename
+        self.dirs = {}          # {directory: {filename: sha256}} this crawl
+        self._entries = None
+        self._lock = threading.Lock()
+        self._dir_locks = {}
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = {}
+            if self.filename and os.path.exists(self.filename):
+                try:
+                    with open(self.filename) as index:
+                        self._entries = json.load(index)
+                except (IOError, ValueError), e:
+                    log.warning('Ignoring unreadable checksum index %s: %r' %
+                                (self.filename, e))
+        return self._entries
+
+    def lookup(self, url):
+        """ Return the published SHA256 of the image at url, or '' """
+        directory, filename = url.rsplit('/', 1)
+        return self.get_directory(directory).get(filename, '')
+
+    def get_directory(self, directory):
+        """ Return the {filename: sha256} of a directory, indexing it the
+        first time it is asked for.
+        """
+        with self._lock:
+            lock = self._dir_locks.setdefault(directory, threading.Lock())
+        with lock:
+            if directory not in self.dirs:
+                self.dirs[directory] = self._index(directory)
+            return self.dirs[directory]
+
+    def _find_checksum(self, directory):
+        """ Return the URL of the CHECKSUM file in a directory listing """
+        listing = self.fetcher.fetch(directory)
+        match = CHECKSUM_LINK.search(listing)
+        if match:
+            return urlparse.urljoin(directory + '/', match.group(1))
+
+    def _index(self, directory):
+        entry = self.entries.get(directory)
+        if entry:
+            try:
+                response = self.fetcher.request(entry['url'],
+                                                entry.get('etag'),
+                                                entry.get('modified'))
+            except FetchError, e:
+                if e.status != 404:
+                    log.debug('Using the saved checksums of %s: %s' %
+                              (directory, e))
+                    return entry['hashes']
+                # the CHECKSUM file was renamed, look it up again
+                entry = None
+            else:
+                if response.status == 304:
+                    return entry['hashes']
+        if not entry:
+            try:
+                url = self._find_checksum(directory)
+                if not url:
+                    return {}
+                response = self.fetcher.request(url)
+            except FetchError, e:
+                log.debug('Unable to index %s: %s' % (directory, e))
+                return {}
+        entry = {'url': response.url,
+                 'etag': response.headers.get('etag'),
+                 'modified': response.headers.get('last-modified'),
+                 'hashes': parse_checksums(response.body)}
+        with self._lock:
+            self.entries[directory] = entry
+        return entry['hashes']
+
+    def save(self):
+        """ Write the index out, if we have somewhere to keep it """
+        if not self.filename:
+            return
+        dirname = os.path.dirname(self.filename)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w') as index:
+                json.dump(self.entries, index)
+            if os.path.exists(self.filename) and os.name == 'nt':
+                os.unlink(self.filename)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError), e:
+            log.warning('Unable to save checksum index %s: %r' %
+                        (self.filename, e))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Bounded capture of the output of the commands we run.
+
+Each command gets a Job, which reads its stdout and stderr as they are
+produced into ring buffers holding only the last few kilobytes.  A
+CommandLog remembers the last few jobs, so however many commands a creator
+runs, the memory it keeps for their output stays the same, and the error
+log only gets the tail of the command that failed.
+"""
+
+import threading
+import time
+import os
+
+from collections import deque
+
+OUTPUT_LIMIT = 64 * 1024    # bytes of each job's output to keep
+ERROR_LIMIT = 4 * 1024      # bytes of each job's stderr to keep
+JOB_HISTORY = 8             # jobs to keep
+READ_SIZE = 4096
+
+
+class RingBuffer(object):
+    """ A file-like object keeping the last `limit` bytes written to it """
+
+    def __init__(self, limit=OUTPUT_LIMIT):
+        self.limit = limit
+        self.chunks = deque()
+        self.size = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def write(self, data):
+        if not data:
+            return
+        with self.lock:
+            if len(data) > self.limit:
+                self.dropped += len(data) - self.limit
+                data = data[-self.limit:]
+            self.chunks.append(data)
+            self.size += len(data)
+            while self.size > self.limit:
+                extra = self.size - self.limit
+                first = self.chunks[0]
+                if len(first) <= extra:
+                    self.chunks.popleft()
+                    trimmed = len(first)
+                else:
+                    self.chunks[0] = first[extra:]
+                    trimmed = extra
+                self.size -= trimmed
+                self.dropped += trimmed
+
+    def getvalue(self):
+        with self.lock:
+            return ''.join(self.chunks)
+
+
+class Job(object):
+    """ The output of one command, captured while it runs """
+
+    def __init__(self, cmd, limit=OUTPUT_LIMIT, error_limit=ERROR_LIMIT):
+        self.cmd = cmd
+        self.started = time.time()
+        self.output = RingBuffer(limit)     # stdout and stderr, interleaved
+        self.errors = RingBuffer(error_limit)
+        self.returncode = None
+
+    def _read(self, pipe, buffers):
+        fd = pipe.fileno()
+        while True:
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                break
+            for buf in buffers:
+                buf.write(data)
+        pipe.close()
+
+    def capture(self, proc):
+        """ Read the output of a subprocess.Popen until it exits, and
+        return its exit code.
+        """
+        if proc.stdin:
+            proc.stdin.close()
+        readers = []
+        for pipe, buffers in ((proc.stdout, [self.output]),
+                              (proc.stderr, [self.output, self.errors])):
+            if pipe:
+                reader = threading.Thread(target=self._read,
+                                          args=(pipe, buffers))
+                reader.daemon = True
+                reader.start()
+                readers.append(reader)
+        for reader in readers:
+            reader.join()
+        self.returncode = proc.wait()
+        return self.returncode
+
+    @property
+    def error(self):
+        return self.errors.getvalue()
+
+    def tail(self):
+        """ Return what we have of the job's output, as a log entry """
+        lines = ['$ %s' % self.cmd]
+        if self.output.dropped:
+            lines.append('[%d bytes of output dropped]' % self.output.dropped)
+        lines.append(self.output.getvalue())
+        if self.returncode is not None:
+            lines.append('[exit code %d]' % self.returncode)
+        return '\n'.join(lines) + '\n'
+
+
+class CommandLog(object):
+    """ The last `history` jobs run by a creator """
+
+    def __init__(self, history=JOB_HISTORY, limit=OUTPUT_LIMIT):
+        self.limit = limit
+        self.jobs = deque(maxlen=history)
+
+    def start(self, cmd):
+        job = Job(cmd, self.limit)
+        self.jobs.append(job)
+        return job
+
+    @property
+    def last(self):
+        return self.jobs and self.jobs[-1] or None
+
+    def getvalue(self):
+        return ''.join([job.tail() for job in self.jobs])
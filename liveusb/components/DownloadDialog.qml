@@ -166,7 +166,12 @@ Dialog {
                                                      (leftSize < (1024 * 1024)) ? ((leftSize / 1024).toFixed(1) + " KB") :
                                                      (leftSize < (1024 * 1024 * 1024)) ? ((leftSize / 1024 / 1024).toFixed(1) + " MB") :
                                                      ((leftSize / 1024 / 1024 / 1024).toFixed(1) + " GB")
-                            text: liveUSBData.currentImage.status + (liveUSBData.currentImage.download.maxProgress > 0 ? " (" + leftStr + " left)" : "")
+                            property real eta: liveUSBData.currentImage.writer.eta
+                            property string etaStr: eta < 0 ? "" :
+                                                    (eta < 60) ? (Math.ceil(eta) + " s") :
+                                                    (Math.ceil(eta / 60) + " min")
+                            text: liveUSBData.currentImage.status + (liveUSBData.currentImage.writer.running ? (etaStr ? " (" + etaStr + " left)" : "") :
+                                                                     liveUSBData.currentImage.download.maxProgress > 0 ? " (" + leftStr + " left)" : "")
                         }
                         Item {
                             Layout.fillWidth: true
@@ -231,16 +236,20 @@ Dialog {
                         }
                         AdwaitaComboBox {
                             Layout.preferredWidth: implicitWidth * 2.5
-                            model: liveUSBData.usbDriveNames
+                            model: liveUSBData.usbDriveModel
+                            textRole: "text"
                             currentIndex: liveUSBData.currentDrive
                             onCurrentIndexChanged: {
                                 acceptButton.pressedOnce = false
                                 liveUSBData.currentImage.writer.finished = false
                                 liveUSBData.currentDrive = currentIndex
                             }
-                            onModelChanged: {
-                                if (liveUSBData.usbDriveNames.length <= 0)
-                                    currentIndex = -1
+                            Connections {
+                                target: liveUSBData.usbDriveModel
+                                onCountChanged: {
+                                    if (liveUSBData.usbDriveModel.count <= 0)
+                                        currentIndex = -1
+                                }
                             }
 
                             enabled: !liveUSBData.currentImage.writer.running
@@ -248,7 +257,7 @@ Dialog {
                                 spacing: $(8)
                                 anchors.fill: parent
                                 anchors.leftMargin: $(8)
-                                visible: liveUSBData.usbDriveNames.length <= 0
+                                visible: liveUSBData.usbDriveModel.count <= 0
                                 BusyIndicator {
                                     anchors.verticalCenter: parent.verticalCenter
                                     height: parent.height * 0.6
@@ -341,7 +350,7 @@ Dialog {
                                 color: liveUSBData.currentImage.writer.finished ? "#628fcf" : "red"
                                 textColor: enabled ? "white" : palette.text
                                 transformOrigin: Item.Center
-                                enabled: pressedOnce || (liveUSBData.currentImage.readyToWrite && !liveUSBData.currentImage.writer.running && liveUSBData.usbDrives.length > 0)
+                                enabled: pressedOnce || (liveUSBData.currentImage.readyToWrite && !liveUSBData.currentImage.writer.running && liveUSBData.usbDriveModel.count > 0)
                                 text: liveUSBData.currentImage.writer.finished ? qsTranslate("", "Close") : pressedOnce ? qsTranslate("", "Are you sure?") : qsTranslate("", "Write to disk")
                                 onClicked: {
                                     if (liveUSBData.currentImage.writer.finished) {
@@ -25,22 +25,37 @@ include the LinuxLiveUSBCreator and the WindowsLiveUSBCreator.
 """
 
 import subprocess
+import threading
 import tempfile
 import logging
 import hashlib
+import copy
+import random
 import shutil
 import signal
+import socket
 import time
 import os
 import re
 import sys
 
-from StringIO import StringIO
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 from pprint import pformat
 from stat import ST_SIZE
 
 from liveusb.releases import releases
+from liveusb.transfer import ImageWriter, StreamCopier, tree_size
+from liveusb.transfer import FanOutWriter, invalidate_image
+from liveusb.isomd5 import ImplantedMD5
+from liveusb.hashcache import ChecksumCache, file_identity
+from liveusb.manifest import Manifest, SegmentHasher, hash_file, make_manifest
+from liveusb.manifest import read_checksum_file, write_checksum_file
+from liveusb.sysfs import SysfsDevices, UeventMonitor, get_device_port
+from liveusb.scheduler import WriteScheduler
+from liveusb.mbr import MBR, get_partition_number
+from liveusb.fslabel import LabelError, set_label
+from liveusb.cmdlog import CommandLog
 from liveusb import _
 
 
@@ -60,16 +75,19 @@ class LiveUSBCreator(object):
     iso = None          # the path to our live image
     label = "LIVE"      # if one doesn't already exist
     fstype = None       # the format of our usb stick
-    drives = {}         # {device: {'label': label, 'mount': mountpoint}}
+    drives = None       # {device: {'label': label, 'mount': mountpoint}}
     overlay = 0         # size in mb of our persisten overlay
     dest = None         # the mount point of of our selected drive
     uuid = None         # the uuid of our selected drive
-    pids = []           # a list of pids of all of our subprocesses
-    output = StringIO() # log subprocess output in case of errors
+    pids = None         # a list of pids of our running subprocesses
+    output = None       # a CommandLog of our last subprocesses' output
     totalsize = 0       # the total size of our overlay + iso
     isosize = 0         # the size of the selected iso
     _drive = None       # mountpoint of the currently selected drive
     mb_per_sec = 0      # how many megabytes per second we can write
+    copier = None       # the StreamCopier of the transfer in progress
+    free_space_ttl = 5  # seconds to trust a drive's free space for
+    _verified = False   # whether we've read our ISO for checksums this run
     log = None
     ext_fstypes = set(['ext2', 'ext3', 'ext4'])
     valid_fstypes = set(['vfat', 'msdos']) | ext_fstypes
@@ -80,6 +98,104 @@ class LiveUSBCreator(object):
     def __init__(self, opts):
         self.opts = opts
         self._setup_logger()
+        self.checksum_cache = ChecksumCache()
+        self.drives = {}
+        # held while self.drives is changed, as backends may do it from
+        # their own threads, and while it is looked through
+        self.drives_lock = threading.RLock()
+        self._free_space = {}
+        self._mbrs = {}
+        self._reset_job()
+
+    def _reset_job(self):
+        """ Start afresh with the state of a single write: the selected
+        drive, our subprocesses, their output and the copy in progress.
+        """
+        self._drive = None
+        self.dest = None
+        self.uuid = None
+        self.fstype = None
+        self.totalsize = 0
+        self.mb_per_sec = 0
+        self.copier = None
+        self.copied_checksums = {}
+        self.pids = []
+        self.output = CommandLog()
+        self.scheduler = None
+        self.jobs = []
+
+    def new_job(self, drive=None):
+        """ Return a creator for writing to one of our drives on its own.
+
+        The job shares our options, image, drive inventory and caches, but
+        has its own selected drive, subprocesses, output log and copier, so
+        several jobs can write at once, and terminating one of them leaves
+        the others alone.
+
+        @param drive: The drive for the job to write to, if we know it yet.
+        """
+        job = copy.copy(self)
+        job._reset_job()
+        if drive:
+            job.drive = drive
+        return job
+
+    def schedule(self, drives, write, whole_disk=True):
+        """ Write to each of the drives with its own job, as many at once
+        as the USB hubs and controllers they are on can take.
+
+        The writes start with up to --hub-writes at once behind each hub
+        and --controller-writes on each controller, and the limits follow
+        the throughput we get.  A queued write starts as soon as there's
+        room for it.
+
+        @param drives: The keys or devices of the drives in self.drives.
+        @param write: Called with the job for each drive to do its writing,
+                      like lambda job: job.dd_image().
+        @param whole_disk: Whether write overwrites the disk the drive is on,
+                           so that a disk is only written once, whichever
+                           of its partitions are given.
+        @return: A {drive: exception} of the drives that failed, with None
+                 for the ones that didn't.
+        """
+        self.scheduler = WriteScheduler(
+                hub_cap=getattr(self.opts, 'hub_writes', None) or 2,
+                controller_cap=getattr(self.opts, 'controller_writes',
+                                       None) or 4)
+        self.jobs = []
+        devices, shared = {}, {}
+        for drive in drives:
+            job = self.new_job(drive)
+            device = job.drive['device']
+            if whole_disk:
+                device = job.drive['parent'] or device
+            if device in devices:
+                # another partition of a disk we're already writing
+                shared[devices[device]].append(drive)
+                continue
+            devices[device] = drive
+            shared[drive] = []
+            self.jobs.append(job)
+            def run(job=job):
+                write(job)
+                # for the scheduler to measure the throughput by
+                return job.copier and job.copier.copied or self.isosize
+            self.scheduler.submit(drive, job.drive.get('port'), run)
+        results = self.scheduler.run()
+        for drive, error in results.items():
+            if error:
+                self.log.error(_("Unable to write to %s: %s") % (
+                               drive, unicode(error)))
+            for other in shared[drive]:
+                results[other] = error
+        return results
+
+    def terminate_jobs(self):
+        """ Stop the writes started by schedule, and the queued ones """
+        if self.scheduler:
+            self.scheduler.cancel()
+        for job in self.jobs:
+            job.terminate()
 
     def _setup_logger(self):
         self.log = logging.getLogger(__name__)
@@ -87,6 +203,11 @@ class LiveUSBCreator(object):
         if self.opts.verbose:
             level = logging.DEBUG
         self.log.setLevel(level)
+        if self.log.handlers:
+            # another creator in this process has already set it up
+            self.handler = self.log.handlers[0]
+            self.handler.setLevel(level)
+            return
         self.handler = logging.StreamHandler()
         self.handler.setLevel(level)
         formatter = logging.Formatter("[%(module)s:%(lineno)s] %(message)s")
@@ -94,7 +215,12 @@ class LiveUSBCreator(object):
         self.log.addHandler(self.handler)
 
     def detect_removable_drives(self, callback=None):
-        """ This method should populate self.drives with removable devices """
+        """ This method should populate self.drives with removable devices
+
+        @param callback: Called when the drives change, with a list of the
+                         keys of self.drives that were added, removed or
+                         updated, or with nothing if any of them may have.
+        """
         raise NotImplementedError
 
     def verify_filesystem(self):
@@ -112,12 +238,35 @@ class LiveUSBCreator(object):
         """
         raise NotImplementedError
 
-    def extract_iso(self):
-        """ Extract the LiveCD ISO to the USB drive """
-        raise NotImplementedError
+    def get_free_space(self, drive=None):
+        """ Return the free megabytes on a drive, or None if it isn't mounted.
 
-    def verify_iso_md5(self):
-        """ Verify the MD5 checksum of the ISO """
+        statvfs can stall for seconds on a slow or flaky stick, so we only
+        ask when somebody wants to know, like check_free_space, and remember
+        the answer for free_space_ttl seconds, or until the drive is
+        mounted, unmounted or written to.
+
+        @param drive: One of self.drives, or the selected drive if None.
+        """
+        drive = drive or self.drive
+        if not drive or not drive['mount']:
+            return None
+        mount = drive['mount']
+        checked, free = self._free_space.get(mount, (None, None))
+        if checked is None or time.time() - checked > self.free_space_ttl:
+            free = self.get_free_bytes(mount) / 1024**2
+            self._free_space[mount] = (time.time(), free)
+        return free
+
+    def invalidate_free_space(self, mount=None):
+        """ Forget the free space of a mount point, or of every drive """
+        if mount:
+            self._free_space.pop(mount, None)
+        else:
+            self._free_space.clear()
+
+    def extract_iso(self, progress=None):
+        """ Extract the LiveCD ISO to the USB drive """
         raise NotImplementedError
 
     def install_bootloader(self):
@@ -190,89 +339,194 @@ class LiveUSBCreator(object):
         self.log.debug(cmd)
         if isinstance(cmd, unicode):
             cmd = cmd.encode(sys.getfilesystemencoding(), 'replace')
-        self.output.write(cmd)
+        job = self.output.start(cmd)
         proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                                 stderr=subprocess.PIPE, stdin=subprocess.PIPE,
                                 shell=True, **kwargs)
         self.pids.append(proc.pid)
-        out, err = proc.communicate()
-        if isinstance(out, unicode):
-            out = out.encode('utf-8', 'replace')
-        if isinstance(err, unicode):
-            err = err.encode('utf-8', 'replace')
-        self.output.write(out + '\n' + err + '\n')
+        try:
+            job.capture(proc)
+        finally:
+            self.pids.remove(proc.pid)
         if proc.returncode:
-            filename = self.write_log()
+            filename = self.write_log(job)
             if not passive:
                 raise LiveUSBError(_("There was a problem executing the "
                                      "following command: %r\n%r\nA more detailed "
                                      "error log has been written to "
-                                     "'%r'" % (cmd, err, filename)))
+                                     "'%r'" % (cmd, job.error, filename)))
         return proc
 
-    def verify_iso_sha1(self, progress=None):
-        """ Verify the SHA1 checksum of our ISO if it is in our release list """
+    def verify_iso(self, progress=None):
+        """ Verify the implanted MD5 and the release checksum of our ISO.
+
+        Returns False if either of them does not match.
+        """
+        md5, sha = self._verify_iso_checksums(progress)
+        return md5 is not False and sha is not False
+
+    def _verify_iso_checksums(self, progress=None):
+        """ Check the implanted MD5 and the release checksum of our ISO.
+
+        Both checksums are calculated in the same pass over the image, and
+        remembered in our checksum cache until the image changes, unless
+        --reverify was given.  Returns an (md5, release) tuple of verdicts,
+        where each is None if the ISO does not have that checksum.
+        """
         if not progress:
             class DummyProgress:
                 def set_max_progress(self, value): pass
                 def update_progress(self, value): pass
             progress = DummyProgress()
-        release = self.get_release_from_iso()
-        if release:
+        release = self.get_release_checksum()
+        cache = self.checksum_cache
+        # We need a full pass if a block manifest was asked for and is missing
+        segmented = getattr(self.opts, 'segmented', False) and \
+                not Manifest.load(self.iso)
+        if not segmented and (self._verified or
+                              not getattr(self.opts, 'reverify', False)):
+            md5 = cache.get(self.iso, 'implanted-md5')
+            sha = release and cache.get(self.iso, release[0])
+            if md5 and md5['verified'] is False:
+                self.log.info(_('%s has already failed verification') %
+                              self.iso)
+                return False, (False if release else None)
+            if md5 and (sha or not release):
+                self.log.info(_('Using cached checksums of %s') % self.iso)
+                cache.touch(self.iso)
+                cache.save()
+                return md5['verified'], sha and sha['digest'] == release[1]
+        checksum = whole = segments = None
+        if segmented:
+            self.log.info(_('Hashing %s in segments') % self.iso)
+            segments = SegmentHasher(self.iso)
+        isofile = file(self.iso, 'rb')
+        try:
+            implanted = ImplantedMD5.from_file(isofile)
+            if implanted:
+                self.log.info(_('Verifying ISO MD5 checksum'))
+            else:
+                self.log.debug('No MD5 checksum implanted in %s' % self.iso)
+            if release:
+                self.log.info(_("Verifying %s checksum of LiveCD image...") %
+                              release[0].upper())
+                checksum = hashlib.new(release[0])
+            else:
+                self.log.debug(_('Unknown ISO, skipping checksum verification'))
+            if segments:
+                # The manifest needs the whole digest too, so share ours
+                if checksum and release[0] == segments.algorithm:
+                    whole = checksum
+                else:
+                    whole = hashlib.new(segments.algorithm)
             progress.set_max_progress(self.isosize / 1024)
-            if 'sha1' in release:
-                self.log.info(_("Verifying SHA1 checksum of LiveCD image..."))
-                hash = 'sha1'
-                checksum = hashlib.sha1()
-            elif 'sha256' in release:
-                self.log.info(_("Verifying SHA256 checksum of LiveCD image..."))
-                hash = 'sha256'
-                checksum = hashlib.sha256()
-            isofile = file(self.iso, 'rb')
             bytes = 1024**2
             total = 0
             while bytes:
                 data = isofile.read(bytes)
-                checksum.update(data)
+                if implanted:
+                    implanted.update(data)
+                    if implanted.failed:
+                        break
+                if checksum:
+                    checksum.update(data)
+                if whole and whole is not checksum:
+                    whole.update(data)
+                if segments:
+                    segments.update(data)
                 bytes = len(data)
                 total += bytes
                 progress.update_progress(total / 1024)
+        finally:
             isofile.close()
-            if checksum.hexdigest() == release[hash]:
-                return True
-            else:
-                self.log.info(_("Error: The SHA1 of your Live CD is "
-                                "invalid.  You can run this program with "
-                                "the --noverify argument to bypass this "
-                                "verification check."))
-                return False
-        else:
-            self.log.debug(_('Unknown ISO, skipping checksum verification'))
+        # a manifest of a bad image would vouch for it later
+        if segments and not (implanted and implanted.failed) and \
+                not (release and checksum.hexdigest() != release[1]):
+            manifest = segments.manifest(whole.hexdigest())
+            self.log.info('%s root(%s) = %s' % (manifest.algorithm,
+                          self.iso, manifest.root))
+            manifest.save(self.iso)
+        md5 = implanted and implanted.verify()
+        cache.set(self.iso, 'implanted-md5', verified=md5,
+                  digest=implanted and not implanted.failed and
+                         implanted.md5.hexdigest() or None)
+        sha = None
+        if release and not (implanted and implanted.failed):
+            sha = checksum.hexdigest() == release[1]
+            cache.set(self.iso, release[0], checksum.hexdigest(), sha)
+        elif release:
+            sha = False
+        cache.save()
+        self._verified = True
+        return md5, sha
+
+    def verify_iso_md5(self):
+        """ Verify the MD5 checksum implanted in the ISO """
+        md5 = self._verify_iso_checksums()[0]
+        if md5 is False:
+            self.log.info(_('ISO MD5 checksum verification failed'))
+            return False
+        if md5:
+            self.log.info(_('ISO MD5 checksum passed'))
+        return True
+
+    def verify_iso_sha1(self, progress=None):
+        """ Verify the SHA1 checksum of our ISO if it is in our release list """
+        sha = self._verify_iso_checksums(progress)[1]
+        if sha is False:
+            self.log.info(_("Error: The SHA1 of your Live CD is "
+                            "invalid.  You can run this program with "
+                            "the --noverify argument to bypass this "
+                            "verification check."))
+        return sha
 
     def check_free_space(self):
         """ Make sure there is enough space for the LiveOS and overlay """
-        freebytes = self.get_free_bytes()
-        self.log.debug('freebytes = %d' % freebytes)
+        free = self.get_free_space()
+        if free is None:
+            # not mounted where we'd know it, so ask wherever we'll write
+            free = self.get_free_bytes() / 1024**2
+        self.log.debug('free = %d MB' % free)
         self.log.debug('isosize = %d' % self.isosize)
         overlaysize = self.overlay * 1024**2
         self.log.debug('overlaysize = %d' % overlaysize)
         self.totalsize = overlaysize + self.isosize
-        if self.totalsize > freebytes:
+        required = -(-self.isosize // 1024**2) + self.overlay
+        if required > free:
             raise LiveUSBError(_("There is not enough free space on the selected device.\nRequired: %s. Free: %s." %
-                                 (str(self.isosize/1024**2 + self.overlay) + "MB",
-                                  str(freebytes/1024**2) + "MB")))
+                                 (str(required) + "MB", str(free) + "MB")))
 
-    def create_persistent_overlay(self):
+    def create_persistent_overlay(self, progress=None):
         if self.overlay:
             self.log.info(_("Creating") + " %sMB " % self.overlay +
                           _("persistent overlay"))
-            if self.fstype == 'vfat':
-                # vfat apparently can't handle sparse files
-                self.popen('dd if=/dev/zero of="%s" count=%d bs=1M'
-                           % (self.get_overlay(), self.overlay))
-            else:
-                self.popen('dd if=/dev/zero of="%s" count=1 bs=1M seek=%d'
-                           % (self.get_overlay(), self.overlay))
+            if not progress:
+                class DummyProgress:
+                    def set_max_progress(self, value): pass
+                    def update_progress(self, value): pass
+                progress = DummyProgress()
+            zeros = '\0' * 1024**2
+            try:
+                overlay = open(self.get_overlay(), 'wb')
+                try:
+                    if self.fstype == 'vfat':
+                        # vfat apparently can't handle sparse files
+                        progress.set_max_progress(self.overlay * 1024)
+                        for i in range(self.overlay):
+                            overlay.write(zeros)
+                            progress.update_progress((i + 1) * 1024)
+                    else:
+                        overlay.seek(self.overlay * 1024**2)
+                        overlay.write(zeros)
+                    overlay.flush()
+                    os.fsync(overlay.fileno())
+                finally:
+                    overlay.close()
+            except EnvironmentError, e:
+                raise LiveUSBError(_("Unable to create the persistent "
+                                     "overlay: %r") % e)
+            finally:
+                self.invalidate_free_space(self.drive['mount'])
 
     def _update_configs(self, infile, outfile):
         infile = file(infile, 'r')
@@ -361,12 +615,16 @@ class LiveUSBCreator(object):
                     raise LiveUSBError(_("Unable to remove previous LiveOS: "
                                          "%r" % e))
 
-    def write_log(self):
-        """ Write out our subprocess stdout/stderr to a log file """
+    def write_log(self, job=None):
+        """ Append the tail of a job's output to our log file
+
+        @param job: The liveusb.cmdlog.Job that failed, or None for the
+                    last few jobs we ran.
+        """
         tmpdir = os.getenv('TEMP', '/tmp')
         filename = os.path.join(tmpdir, 'liveusb-creator.log')
         out = file(filename, 'a')
-        out.write(self.output.getvalue())
+        out.write(job and job.tail() or self.output.getvalue())
         out.close()
         return filename
 
@@ -386,6 +644,25 @@ class LiveUSBCreator(object):
         return os.path.join(self.get_liveos(),
                             'overlay-%s-%s' % (self.label, self.uuid or ''))
 
+    def get_release_checksum(self):
+        """ Return the (algorithm, hexdigest) that our ISO should match.
+
+        Returns None if the ISO is not a known release, or if we don't know
+        its checksum.
+        """
+        release = self.get_release_from_iso()
+        if not release:
+            return None
+        isoname = os.path.basename(self.iso)
+        candidates = [variant for variant in release['variants'].values()
+                      if os.path.basename(variant.get('url', '')) == isoname]
+        candidates.append(release)
+        for data in candidates:
+            for hash in ('sha256', 'sha1'):
+                if data.get(hash):
+                    return hash, data[hash]
+        return None
+
     def get_release_from_iso(self):
         """ If the ISO is for a known release, return it. """
         isoname = os.path.basename(self.iso)
@@ -399,19 +676,20 @@ class LiveUSBCreator(object):
         if drive == None:
             self._drive = None
             return
-        if not self.drives.has_key(drive):
-            found = False
-            for key in self.drives.keys():
-                if self.drives[key]['device'] == drive:
-                    drive = key
-                    found = True
-                    break
-            if not found:
-                raise LiveUSBError(_("Cannot find device %s" % drive))
-        self.log.debug("%s selected: %s" % (drive, self.drives[drive]))
-        self._drive = drive
-        self.uuid = self.drives[drive]['uuid']
-        self.fstype = self.drives[drive]['fstype']
+        with self.drives_lock:
+            if not self.drives.has_key(drive):
+                found = False
+                for key in self.drives.keys():
+                    if self.drives[key]['device'] == drive:
+                        drive = key
+                        found = True
+                        break
+                if not found:
+                    raise LiveUSBError(_("Cannot find device %s" % drive))
+            self.log.debug("%s selected: %s" % (drive, self.drives[drive]))
+            self._drive = drive
+            self.uuid = self.drives[drive]['uuid']
+            self.fstype = self.drives[drive]['fstype']
 
     def get_proxies(self):
         """ Return a dictionary of proxy settings """
@@ -425,6 +703,7 @@ class LiveUSBCreator(object):
         """ Select the given ISO """
         self.iso = os.path.abspath(self._to_unicode(iso))
         self.isosize = os.stat(self.iso)[ST_SIZE]
+        self._verified = False
 
     def _to_unicode(self, obj, encoding='utf-8'):
         if hasattr(obj, 'toUtf8'): # PyQt5.QtCore.QString
@@ -450,6 +729,13 @@ class LiveUSBCreator(object):
     def reset_mbr(self):
         pass
 
+    def invalidate_mbr(self, device=None):
+        """ Forget what we read from the MBR of a device, or of all of them """
+        if device:
+            self._mbrs.pop(device, None)
+        else:
+            self._mbrs.clear()
+
     def flush_buffers(self):
         """ Flush filesystem buffers """
         pass
@@ -457,75 +743,469 @@ class LiveUSBCreator(object):
     def is_admin(self):
         raise NotImplementedError
 
-    def dd_image(self):
+    def dd_image(self, progress=None, check_progress=None):
+        """ Overwrite the selected device with the raw live image
+
+        @param check_progress: Where the sampled device checksum reports
+                               its progress, if not to progress.
+        """
         self.log.info(_('Overwriting device with live image'))
+        if not progress:
+            class DummyProgress:
+                def set_max_progress(self, value): pass
+                def update_progress(self, value): pass
+            progress = DummyProgress()
         parent = self.drive['parent']
         if parent:
             drive = parent
         else:
             drive = self.drive['device']
-        cmd = 'dd if="%s" of="%s" bs=1M iflag=direct oflag=direct conv=fdatasync' % (self.iso, drive)
-        self.log.debug(_('Running') + ' %s' % cmd)
-        self.popen(cmd)
-
-    def calculate_liveos_checksum(self):
-        """ Calculate the hash of the extracted LiveOS """
-        chunk_size = 1024 # FIXME: optimize this.  we hit bugs when this is *not* 1024
-        checksums = []
+        block_size = getattr(self.opts, 'block_size', None) or 1024
+        sync_interval = getattr(self.opts, 'sync_interval', None) or 0
+
+        # Hash the image as it streams to the device instead of reading it
+        # again beforehand, and read back what we wrote in the same pass
+        expected = None
+        if not self.opts.noverify:
+            expected = self.get_release_checksum()
+        hash = expected and expected[0] or getattr(self.opts, 'hash', 'sha1')
+        device_checksum = getattr(self.opts, 'device_checksum', False)
+        sampled = getattr(self.opts, 'device_checksum_mode', None) == 'sampled'
+        source = readback = None
+        if expected or device_checksum:
+            source = hashlib.new(hash)
+        if device_checksum and not sampled:
+            readback = hashlib.new(hash)
+
+        progress.set_max_progress(self.isosize / 1024)
+        self.copier = ImageWriter(
+                block_size=block_size * 1024,
+                sync_interval=sync_interval * 1024**2,
+                callback=lambda copied: progress.update_progress(copied / 1024))
+        start = datetime.now()
+        try:
+            self.copier.write_image(self.iso, drive,
+                                    hashes=source and [source] or [],
+                                    readback=readback and [readback] or [])
+        except EnvironmentError, e:
+            raise LiveUSBError(_("Unable to write the live image to %s: %r") %
+                               (drive, e))
+        finally:
+            self.copier.close()
+            # whatever filesystems were on the device are gone
+            self.invalidate_free_space()
+            self.invalidate_mbr(drive)
+        delta = datetime.now() - start
+        if delta.seconds:
+            self.mb_per_sec = (self.copier.copied / delta.seconds) / 1024**2
+            if self.mb_per_sec:
+                self.log.info(_("Wrote to device at") + " %d MB/sec" %
+                              self.mb_per_sec)
+
+        if source:
+            self.log.info("%s(%s) = %s" % (hash, self.iso, source.hexdigest()))
+        if expected:
+            self.checksum_cache.set(self.iso, hash, source.hexdigest(),
+                                    source.hexdigest() == expected[1])
+            self.checksum_cache.save()
+        if expected and source.hexdigest() != expected[1]:
+            self.invalidate_image(drive)
+            raise LiveUSBError(_("Error: The %s of your Live CD is invalid.  "
+                                 "The image written to %s has been erased.") %
+                               (hash.upper(), drive))
+        self._check_written_image(drive, hash, source, readback,
+                                  check_progress or progress)
+
+    def _check_written_image(self, drive, hash, source, readback,
+                             progress=None):
+        """ Check what dd_image or fan_out wrote to a drive, erasing it if
+        it doesn't match the image.
+
+        @param source: The hash of the image as it was read.
+        @param readback: The hash of the data read back from the drive as
+                         it was written, if we did.
+        """
+        if readback:
+            self.log.info("%s(%s) = %s" % (hash, drive, readback.hexdigest()))
+            if readback.hexdigest() != source.hexdigest():
+                self.invalidate_image(drive)
+                raise LiveUSBError(_("The data read back from %s does not "
+                                     "match the live image.  The image "
+                                     "written to it has been erased.") % drive)
+        if getattr(self.opts, 'device_checksum', False) and \
+                getattr(self.opts, 'device_checksum_mode', None) == 'sampled':
+            if not self.calculate_device_checksum(progress, mode='sampled'):
+                self.invalidate_image(drive)
+                raise LiveUSBError(_("The data on %s does not match the live "
+                                     "image.  The image written to it has "
+                                     "been erased.") % drive)
+
+    def fan_out(self, drives, progress=None, check_progress=None):
+        """ Overwrite several drives with the raw live image at once.
+
+        The image is read and its checksum verified only once, however many
+        drives there are.  Each drive is written by its own job, so a drive
+        that fails only fails itself, and one that falls behind holds the
+        others up by no more than --fan-out-lag megabytes, or is dropped
+        after --stall-timeout seconds.
+
+        @param drives: The keys or devices of the drives in self.drives.
+        @param progress: A {drive: progress} of the progress objects of the
+                         writes to each drive, as for dd_image.
+        @param check_progress: A {drive: progress} for the sampled device
+                               checksums, if not progress.
+        @return: A {drive: LiveUSBError} of the drives that failed, with
+                 None for the ones that didn't.
+        """
+        class DummyProgress:
+            def set_max_progress(self, value): pass
+            def update_progress(self, value): pass
+        progress = progress or {}
+        check_progress = check_progress or {}
+        block_size = (getattr(self.opts, 'block_size', None) or 1024) * 1024
+        sync_interval = getattr(self.opts, 'sync_interval', None) or 0
+        lag = getattr(self.opts, 'fan_out_lag', None) or 64
+        stall_timeout = getattr(self.opts, 'stall_timeout', None) or None
+
+        expected = None
+        if not self.opts.noverify:
+            expected = self.get_release_checksum()
+        hash = expected and expected[0] or getattr(self.opts, 'hash', 'sha1')
+        device_checksum = getattr(self.opts, 'device_checksum', False)
+        sampled = getattr(self.opts, 'device_checksum_mode', None) == 'sampled'
+        source = None
+        if expected or device_checksum:
+            source = hashlib.new(hash)
+
+        writer = FanOutWriter(block_size=block_size,
+                              lag=max(1, lag * 1024**2 / block_size),
+                              sync_interval=sync_interval * 1024**2,
+                              stall_timeout=stall_timeout)
+        results, jobs, devices = {}, [], {}
+        for drive in drives:
+            job = self.new_job(drive)
+            device = job.drive['parent'] or job.drive['device']
+            if device in devices:
+                # another partition of a disk we're already writing
+                devices[device][0].append(drive)
+                continue
+            job_progress = progress.get(drive) or DummyProgress()
+            job_progress.set_max_progress(self.isosize / 1024)
+            readback = None
+            if device_checksum and not sampled:
+                readback = hashlib.new(hash)
+            target = writer.add_target(device,
+                    callback=lambda copied, p=job_progress:
+                        p.update_progress(copied / 1024),
+                    readback=readback and [readback] or [])
+            job.copier = target.writer
+            devices[device] = ([drive], job, target, readback)
+            jobs.append(device)
+
+        self.log.info(_('Overwriting %d devices with live image') %
+                      len(devices))
+        self.copier = writer
+        start = datetime.now()
+        try:
+            writer.write_image(self.iso, hashes=source and [source] or [])
+        except EnvironmentError, e:
+            raise LiveUSBError(_("Unable to read the live image: %r") % e)
+        finally:
+            self.invalidate_free_space()
+            for device in devices:
+                self.invalidate_mbr(device)
+        delta = datetime.now() - start
+
+        if source:
+            self.log.info("%s(%s) = %s" % (hash, self.iso, source.hexdigest()))
+        if expected:
+            self.checksum_cache.set(self.iso, hash, source.hexdigest(),
+                                    source.hexdigest() == expected[1])
+            self.checksum_cache.save()
+        bad_image = expected and source.hexdigest() != expected[1]
+
+        def check(device):
+            drives, job, target, readback = devices[device]
+            if target.error:
+                error = target.error[1]
+                if target.detached:
+                    # erasing it would only get stuck behind the write
+                    return LiveUSBError(_("Unable to write the live image to "
+                                          "%s: %r.  The device is not "
+                                          "responding, and what was written "
+                                          "to it could not be erased.") %
+                                        (device, error))
+                # a partly written image would still have its boot code
+                job.invalidate_image(device)
+                return LiveUSBError(_("Unable to write the live image to "
+                                      "%s: %r") % (device, error))
+            if bad_image:
+                job.invalidate_image(device)
+                return LiveUSBError(_("Error: The %s of your Live CD is "
+                                      "invalid.  The image written to %s has "
+                                      "been erased.") % (hash.upper(), device))
+            if delta.seconds:
+                job.mb_per_sec = (target.copied / delta.seconds) / 1024**2
+                self.log.info(_("Wrote to %s at") % device +
+                              " %d MB/sec" % job.mb_per_sec)
+            try:
+                job._check_written_image(device, hash, source, readback,
+                        check_progress.get(drives[0]) or
+                        progress.get(drives[0]))
+            except LiveUSBError, e:
+                return e
+
+        # the sampled checksums read from every device at once, too
+        pool = ThreadPool(len(jobs) or 1)
+        try:
+            for device, error in zip(jobs, pool.map(check, jobs)):
+                for drive in devices[device][0]:
+                    results[drive] = error
+                if error:
+                    self.log.error(error.args[0])
+        finally:
+            pool.close()
+        return results
+
+    def invalidate_image(self, drive):
+        """ Make sure a bad image written to drive can't be booted """
+        self.log.warning('Erasing the bad image on %s' % drive)
+        try:
+            invalidate_image(drive)
+        except EnvironmentError, e:
+            self.log.error(_("Unable to erase the image on %s: %r") % (drive, e))
+
+    def record_copied_checksums(self, algorithm, checksums):
+        """ Remember the digests of files hashed as extract_iso copied
+        them, so calculate_liveos_checksum needn't read them back.
+
+        @param checksums: A {path: hexdigest} of the copied files.
+        """
+        for path, digest in checksums.items():
+            # by identity, which survives moving isolinux to syslinux
+            key = tuple(sorted(file_identity(path).items()))
+            self.copied_checksums[key] = (algorithm, digest)
+
+    def _copied_checksum(self, path, algorithm):
+        """ Return the digest recorded for path, if it hasn't changed """
+        try:
+            key = tuple(sorted(file_identity(path).items()))
+        except OSError:
+            return None
+        checksum = self.copied_checksums.get(key)
+        if checksum and checksum[0] == algorithm:
+            return checksum[1]
+
+    def _get_raw_device(self):
+        """ Return the path the whole selected drive is read through """
+        return unicode(self.drive['parent'] or self.drive['device'])
+
+    def calculate_device_checksum(self, progress=None, mode=None,
+                                  samples=None):
+        """ Calculate the checksum of the device.
+
+        @param mode: 'full' hashes the whole device with SHA1.  After a dd
+                     write, 'extent' hashes only the first isosize bytes,
+                     so the result can be compared with the checksum of
+                     the ISO, and 'sampled' checks a number of random
+                     segments of the device against the block manifest of
+                     the ISO.  Defaults to the --device-checksum-mode option.
+        @param samples: How many segments to check in 'sampled' mode.
+        @return: The hex digest in 'full' and 'extent' modes, or whether
+                 every sampled segment matched in 'sampled' mode.
+        """
+        if not progress:
+            class DummyProgress:
+                def set_max_progress(self, value): pass
+                def update_progress(self, value): pass
+            progress = DummyProgress()
+        mode = mode or getattr(self.opts, 'device_checksum_mode', None) or 'full'
+        device_name = self._get_raw_device()
+        if mode == 'sampled':
+            return self._sample_device_checksum(device_name, progress,
+                    samples or getattr(self.opts, 'samples', None) or 8)
+
+        device = file(device_name, 'rb')
+        if mode == 'extent':
+            hash, expected = self.get_release_checksum() or ('sha256', None)
+            checksum = hashlib.new(hash)
+            remaining = self.isosize
+            self.log.info(_("Calculating the %s of the first %d bytes of %s") %
+                          (hash.upper(), remaining, device_name))
+        else:
+            hash, expected = 'sha1', None
+            checksum = hashlib.sha1()
+            device.seek(0, os.SEEK_END)
+            remaining = device.tell()
+            device.seek(0)
+            self.log.info(_("Calculating the SHA1 of %s" % device_name))
+        progress.set_max_progress(remaining / 1024)
+        bytes = 1024**2
+        total = 0
+        try:
+            while bytes:
+                data = device.read(min(1024**2, remaining - total))
+                checksum.update(data)
+                bytes = len(data)
+                total += bytes
+                progress.update_progress(total / 1024)
+        finally:
+            device.close()
+        hexdigest = checksum.hexdigest()
+        self.log.info("%s(%s) = %s" % (hash, device_name, hexdigest))
+        if expected:
+            if hexdigest == expected:
+                self.log.info(_("The image on %s matches the release") %
+                              device_name)
+            else:
+                self.log.error(_("The image on %s does not match the "
+                                 "release") % device_name)
+        return hexdigest
+
+    def _sample_device_checksum(self, device_name, progress, samples):
+        """ Compare random segments of the device with the ISO's manifest """
+        manifest = Manifest.load(self.iso)
+        if not manifest:
+            self.log.info(_('Hashing %s in segments') % self.iso)
+            manifest = make_manifest(self.iso)
+            manifest.save(self.iso)
+        indexes = sorted(random.sample(range(len(manifest.segments)),
+                                       min(samples, len(manifest.segments))))
+        self.log.info(_("Checking %d random segments of %s") %
+                      (len(indexes), device_name))
+        progress.set_max_progress(sum([manifest.segment_range(index)[1]
+                                       for index in indexes]) / 1024)
+        matched = True
+        total = 0
+        for index in indexes:
+            if not manifest.verify_segment(device_name, index):
+                self.log.error(_("Segment %d of %s does not match the image") %
+                               (index, device_name))
+                matched = False
+            total += manifest.segment_range(index)[1]
+            progress.update_progress(total / 1024)
+        return matched
+
+    def calculate_liveos_checksum(self, progress=None):
+        """ Calculate the hash of the extracted LiveOS.
+
+        The files are hashed concurrently, and their checksums, along with
+        a checksum of all of the checksums, are written to LiveOS/CHECKSUM
+        on the device so they can be audited later without recomputing.
+        The files extract_iso hashed while copying them, and that haven't
+        changed since, aren't read again.
+        """
+        if not progress:
+            class DummyProgress:
+                def set_max_progress(self, value): pass
+                def update_progress(self, value): pass
+            progress = DummyProgress()
+        algorithm = getattr(self.opts, 'hash', None) or 'sha1'
         mnt = self.drive['mount']
-        if not os.path.isdir(mnt):
+        if not mnt or not os.path.isdir(mnt):
             dev = self.drive['device']
             if os.path.isdir(dev):
                 mnt = dev  # on Windows
             else:
                 self.log.error('Cannot find mount point for %s', self.drive)
+        images = []
         for img in (os.path.join('LiveOS', 'osmin.img'),
                     os.path.join('LiveOS', 'squashfs.img'),
                     os.path.join('syslinux', 'initrd0.img'),
                     os.path.join('syslinux', 'vmlinuz0'),
                     os.path.join('syslinux', 'isolinux.bin')):
-            hash = getattr(hashlib, self.opts.hash, 'sha1')()
             liveos = os.path.join(mnt, img)
-            device = file(liveos, 'rb')
-            self.log.info("Calculating the %s of %s" % (hash.name, liveos))
-            bytes = 1
-            while bytes:
-                data = device.read(chunk_size)
-                hash.update(data)
-                bytes = len(data)
-            checksum = hash.hexdigest()
-            checksums.append(checksum)
-            self.log.info('%s(%s) = %s' % (hash.name, liveos, checksum))
+            if os.path.exists(liveos):
+                self.log.info("Calculating the %s of %s" % (algorithm, liveos))
+                images.append((img, liveos))
+            else:
+                self.log.debug('%s not found, skipping' % liveos)
+
+        # hashlib releases the GIL on large reads, so threads are enough
+        size = sum([os.path.getsize(path) for name, path in images])
+        progress.set_max_progress(size / 1024)
+        hashed = [0]
+        lock = threading.Lock()
+        def update(count):
+            with lock:
+                hashed[0] += count
+                progress.update_progress(hashed[0] / 1024)
+        def checksum(path):
+            digest = self._copied_checksum(path, algorithm)
+            if digest:
+                update(os.path.getsize(path))
+                return digest
+            return hash_file(path, algorithm, update)
+        pool = ThreadPool(max(1, len(images)))
+        try:
+            checksums = pool.map(lambda image: checksum(image[1]), images)
+        finally:
+            pool.close()
+        for (img, liveos), checksum in zip(images, checksums):
+            self.log.info('%s(%s) = %s' % (algorithm, liveos, checksum))
 
         # Take a checksum of all of the checksums
-        hash = getattr(hashlib, self.opts.hash, 'sha1')()
+        hash = hashlib.new(algorithm)
         map(hash.update, checksums)
         self.log.info("%s = %s" % (hash.name, hash.hexdigest()))
 
+        manifest = [(img.replace(os.path.sep, '/'), checksum)
+                    for (img, liveos), checksum in zip(images, checksums)]
+        manifest.append(('LiveOS', hash.hexdigest()))
+        try:
+            write_checksum_file(os.path.join(mnt, 'LiveOS', 'CHECKSUM'),
+                                algorithm, manifest)
+        except IOError, e:
+            self.log.warning(_("Unable to write the LiveOS checksums: %r") % e)
+        return hash.hexdigest()
+
+    def read_liveos_checksums(self):
+        """ Return the {file: (algorithm, digest)} recorded on the device by
+        calculate_liveos_checksum, or None if there aren't any.
+        """
+        checksums = os.path.join(self.get_liveos(), 'CHECKSUM')
+        if os.path.exists(checksums):
+            return read_checksum_file(checksums)
+
 
 class LinuxLiveUSBCreator(LiveUSBCreator):
 
     bus = None # the dbus.SystemBus
     udisks = None # the org.freedesktop.UDisks2 dbus.Interface
+    sysfs = None # the SysfsDevices, if we're not using UDisks2
+    sysfs_root = '/' # where to find sys, dev and proc for the sysfs backend
+    uevents = None # the UeventMonitor watching for hotplug with sysfs
+    _temp_mount = None # a mount point we made ourselves
+    _syslinux_boot_code = None # the contents of syslinux's mbr.bin
 
     def __init__(self, *args, **kw):
         super(LinuxLiveUSBCreator, self).__init__(*args, **kw)
         extlinux = self.get_extlinux_version()
         if extlinux is None:
-            self.valid_fstypes -= self.ext_fstypes
+            self.valid_fstypes = self.valid_fstypes - self.ext_fstypes
         elif extlinux < 4:
             self.log.debug(_('You are using an old version of syslinux-extlinux '
                     'that does not support the ext4 filesystem'))
-            self.valid_fstypes -= set(['ext4'])
+            self.valid_fstypes = self.valid_fstypes - set(['ext4'])
+
+    def _reset_job(self):
+        super(LinuxLiveUSBCreator, self)._reset_job()
+        self._temp_mount = None
 
     def strify(self, s):
         return bytearray(s).replace(b'\x00', b'').decode('utf-8')
 
     def detect_removable_drives(self, callback=None):
-        """ Detect all removable USB storage devices using UDisks2 via D-Bus """
+        """ Detect all removable USB storage devices using UDisks2 via D-Bus,
+        or by reading sysfs if the sysfs backend was asked for.
+        """
+        if getattr(self.opts, 'backend', None) == 'sysfs':
+            return self._detect_sysfs_drives(callback)
         import dbus
         self.callback = callback
-        self.drives = {}
+        self.drives.clear()
+        self._udisks_objects = {}
+        self._udisks_children = {}
         self.bus = dbus.SystemBus()
         """
         udisks_obj = self.bus.get_object("org.freedesktop.UDisks",
@@ -601,105 +1281,273 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
         self.udisks = dbus.Interface(udisks_obj, 'org.freedesktop.DBus.ObjectManager')
 
 
-        def handleAdded(name, device):
-            if ('org.freedesktop.UDisks2.Block' in device and
-                'org.freedesktop.UDisks2.Filesystem' in device and
-                'org.freedesktop.UDisks2.Partition' in device):
-                self.log.debug('Found block device with filesystem on %s' % name)
-            else:
+        def handleAdded(name, interfaces):
+            self._udisks_objects.setdefault(name, {}).update(interfaces)
+            self._index_udisks_object(name)
+            self._update_udisks_devices(self._get_udisks_dependents(name))
+
+        def handleRemoved(path, interfaces):
+            obj = self._udisks_objects.get(path)
+            if obj is not None:
+                for interface in interfaces:
+                    obj.pop(interface, None)
+                if not obj:
+                    del self._udisks_objects[path]
+            self._update_udisks_devices(self._get_udisks_dependents(path))
+
+        def handleChanged(interface, changed, invalidated, path=None):
+            obj = self._udisks_objects.get(path)
+            if obj is None or interface not in obj:
                 return
+            if invalidated:
+                del obj[interface]
+                self._get_udisks_properties(path, interface)
+            else:
+                properties = dict(obj[interface])
+                properties.update(changed)
+                obj[interface] = properties
+            self._index_udisks_object(path)
+            self._update_udisks_devices(self._get_udisks_dependents(path))
 
-            partition = device['org.freedesktop.UDisks2.Partition']
-            fs = device['org.freedesktop.UDisks2.Filesystem']
-            blk = device['org.freedesktop.UDisks2.Block']
+        if not self.opts.console:
+            self.bus.add_signal_receiver(handleAdded, "InterfacesAdded", "org.freedesktop.DBus.ObjectManager", "org.freedesktop.UDisks2", "/org/freedesktop/UDisks2")
+            self.bus.add_signal_receiver(handleRemoved, "InterfacesRemoved", "org.freedesktop.DBus.ObjectManager", "org.freedesktop.UDisks2", "/org/freedesktop/UDisks2")
+            self.bus.add_signal_receiver(handleChanged, "PropertiesChanged", "org.freedesktop.DBus.Properties", "org.freedesktop.UDisks2", path_keyword="path")
+
+        start = time.time()
+        self._udisks_objects = dict(self.udisks.GetManagedObjects())
+        for name in self._udisks_objects:
+            self._index_udisks_object(name)
+        self._add_udisks_devices()
+        self.log.debug('Found %d drives among %d UDisks2 objects in %.1f ms' % (
+            len(self.drives), len(self._udisks_objects),
+            (time.time() - start) * 1000))
+
+    def _add_udisks_devices(self):
+        """ Add every usable partition in our snapshot of UDisks2 """
+        added = False
+        for name in sorted(self._udisks_objects):
+            if self._add_udisks_device(name):
+                added = True
+        if added and self.callback:
+            self.callback()
+
+    def _detect_sysfs_drives(self, callback=None):
+        """ Detect removable drives from sysfs, without D-Bus """
+        self.callback = callback
+        self.drives.clear()
+        self.sysfs = SysfsDevices(self.sysfs_root)
+        start = time.time()
+        self._update_sysfs_drives()
+        self.log.debug('Found %d drives in sysfs in %.1f ms' % (
+            len(self.drives), (time.time() - start) * 1000))
+        if not self.opts.console and not self.uevents:
+            try:
+                self.uevents = UeventMonitor(self._handle_uevent)
+                self.uevents.start()
+            except socket.error, e:
+                self.log.warning(_('Unable to watch for new drives: %r') % e)
 
-            if blk['Drive'] == '/':
-                self.log.debug('Skipping root drive: %s' % name)
-                return
+    def _handle_uevent(self, action, env):
+        self.log.debug('uevent: %s %s' % (action, env.get('DEVNAME')))
+        if action in ('add', 'remove', 'change'):
+            self._update_sysfs_drives()
 
-            drive_obj = self.bus.get_object("org.freedesktop.UDisks2", blk['Drive'])
-            drive = dbus.Interface(drive_obj, "org.freedesktop.DBus.Properties").GetAll("org.freedesktop.UDisks2.Drive")
+    def _update_sysfs_drives(self):
+        """ Rescan sysfs, and tell our callback which drives changed.
 
-            # this is probably the only check we need, including Drive != "/"
-            if (not drive[u'Removable'] or
-                drive[u'Optical'] or
-                    (drive[u'ConnectionBus'] != 'usb' and
-                     drive[u'ConnectionBus'] != 'sdio')):
-                self.log.debug('Skipping a device that is not removable, connected via USB or is optical: %s' % name)
-                return
+        With hotplug, this runs on the UeventMonitor's thread, so the
+        callback has to hand the news over to its own thread itself.
+        """
+        found = {}
+        for device, data in self.sysfs.scan().items():
+            if self._check_drive(device, data):
+                found[device] = data
+        changed = []
+        with self.drives_lock:
+            for device in sorted(set(found) | set(self.drives)):
+                old, new = self.drives.get(device), found.get(device)
+                if old == new:
+                    continue
+                changed.append(device)
+                if old is not None and old['mount'] != (new and new['mount']):
+                    self.invalidate_free_space(old['mount'])
+                if old is None or new is None:
+                    self.invalidate_mbr((old or new)['parent'])
+                if new is None:
+                    del self.drives[device]
+                elif old is not None:
+                    # Keep the same dict, in case a write is using it
+                    old.update(new)
+                else:
+                    self.drives[device] = new
+                    self._select_new_drive(device)
+        if changed and self.callback:
+            self.callback(changed)
+
+    def _update_udisks_devices(self, paths):
+        """ Re-read the given partitions from our snapshot, and tell our
+        callback about the ones that came, went or changed.
+        """
+        changed = []
+        for path in paths:
+            with self.drives_lock:
+                old = self.drives.pop(path, None)
+                try:
+                    self._add_udisks_device(path)
+                except Exception, e:
+                    # most likely its drive has just gone away
+                    self.log.debug('Unable to read %s: %r' % (path, e))
+                new = self.drives.get(path)
+                if old is not None and new is not None:
+                    # Keep the same dict, in case a write is using it
+                    if any([old.get(key) != value
+                            for key, value in new.items()]):
+                        changed.append(path)
+                    old.update(new)
+                    self.drives[path] = old
+                elif old is not new:
+                    changed.append(path)
+            if old is not None and old['mount'] != (new and new['mount']):
+                self.invalidate_free_space(old['mount'])
+            if (old is None) != (new is None):
+                self.invalidate_mbr((old or new)['parent'])
+        if changed and self.callback:
+            self.callback(changed)
+
+    def _index_udisks_object(self, name):
+        """ Remember which drive and partition table a partition is on """
+        device = self._udisks_objects.get(name, {})
+        blk = device.get('org.freedesktop.UDisks2.Block', {})
+        partition = device.get('org.freedesktop.UDisks2.Partition', {})
+        for parent in (blk.get('Drive'), partition.get('Table')):
+            if parent and parent != '/':
+                self._udisks_children.setdefault(parent, set()).add(name)
+
+    def _get_udisks_dependents(self, path):
+        """ Return the partitions whose entry in self.drives depends on the
+        UDisks2 object at path: itself, and any on the drive or partition
+        table that it is.
+        """
+        return [path] + sorted(self._udisks_children.get(path, ()))
 
-            data = {
-                'udi': str(blk['Drive']),
-                'label': str(blk['IdLabel']),
-                'fstype': str(blk['IdType']),
-                'fsversion': str(blk['IdVersion']),
-                'uuid': str(blk['IdUUID']),
-                'device': self.strify(blk['Device']),
-                'mount': map(self.strify, fs['MountPoints']),
-                'size': int(blk['Size']),
-                'friendlyName': str(drive['Vendor']) + ' ' + str(drive['Model'])
-            }
-            self.log.debug('data = %r' % data)
-
-            if '/boot' in data['mount']:
-                self.log.debug('Skipping boot device: %s' % name)
-                return
+    def _add_udisks_device(self, name):
+        """ Add the partition at object path name to self.drives, if it is
+        one we can write to.  Returns whether it was added.
+        """
+        device = self._udisks_objects.get(name, {})
+        if ('org.freedesktop.UDisks2.Block' in device and
+            'org.freedesktop.UDisks2.Filesystem' in device and
+            'org.freedesktop.UDisks2.Partition' in device):
+            self.log.debug('Found block device with filesystem on %s' % name)
+        else:
+            return
 
-            # Skip things without a size
-            if not data['size'] and not self.opts.force:
-                self.log.debug('Skipping device without size: %s' % device)
-                return
+        partition = device['org.freedesktop.UDisks2.Partition']
+        fs = device['org.freedesktop.UDisks2.Filesystem']
+        blk = device['org.freedesktop.UDisks2.Block']
 
-            # Skip devices with unknown filesystems
-            if data['fstype'] not in self.valid_fstypes and \
-                    self.opts.force != data['device']:
-                self.log.debug('Skipping %s with unknown filesystem: %s' % (
-                    data['device'], data['fstype']))
-                return
+        if blk['Drive'] == '/':
+            self.log.debug('Skipping root drive: %s' % name)
+            return
 
-            mount = data['mount']
-            if mount:
-                if len(mount) > 1:
-                    self.log.warning('Multiple mount points for %s' %
-                            data['device'])
-                mount = data['mount'] = data['mount'][0]
-            else:
-                mount = data['mount'] = None
+        drive = self._get_udisks_properties(blk['Drive'],
+                                            'org.freedesktop.UDisks2.Drive')
 
-            data['free'] = mount and \
-                    self.get_free_bytes(mount) / 1024**2 or None
+        # this is probably the only check we need, including Drive != "/"
+        if (not drive[u'Removable'] or
+            drive[u'Optical'] or
+                (drive[u'ConnectionBus'] != 'usb' and
+                 drive[u'ConnectionBus'] != 'sdio')):
+            self.log.debug('Skipping a device that is not removable, connected via USB or is optical: %s' % name)
+            return
 
+        data = {
+            'udi': str(blk['Drive']),
+            'label': str(blk['IdLabel']),
+            'fstype': str(blk['IdType']),
+            'fsversion': str(blk['IdVersion']),
+            'uuid': str(blk['IdUUID']),
+            'device': self.strify(blk['Device']),
+            'mount': map(self.strify, fs['MountPoints']),
+            'size': int(blk['Size']),
+            'friendlyName': str(drive['Vendor']) + ' ' + str(drive['Model'])
+        }
+        parent = self._get_udisks_properties(partition[u'Table'],
+                'org.freedesktop.UDisks2.Block')['Device']
+        data['parent'] = self.strify(parent)
+        # UDisks2 doesn't say where on the bus the drive is, but sysfs does
+        data['port'] = get_device_port(data['parent'], self.sysfs_root)
+        return self._add_drive(name, data)
+
+    def _add_drive(self, name, data):
+        """ Add a partition found by one of our backends to self.drives,
+        unless it's one we shouldn't touch.  Returns whether it was added.
+        """
+        if not self._check_drive(name, data):
+            return
 
-            parent_obj = self.bus.get_object("org.freedesktop.UDisks2", partition[u'Table'])
-            parent = dbus.Interface(parent_obj, "org.freedesktop.DBus.Properties").Get("org.freedesktop.UDisks2.Block", "Device")
-            data['parent'] = self.strify(parent)
+        self.drives[name] = data
+        self._select_new_drive(name)
+        return True
 
-            self.log.debug(pformat(data))
+    def _select_new_drive(self, name):
+        if not self.drive and self.opts.console and not self.opts.force:
+            self.drive = name
 
-            self.drives[name] = data
+        if self.opts.force == self.drives[name]['device']:
+            self.drive = name
 
-            if not self.drive and self.opts.console and not self.opts.force:
-                self.drive = name
+    def _check_drive(self, name, data):
+        """ Return whether we can use a partition found by one of our
+        backends, replacing its list of mount points with the first one.
+        """
+        self.log.debug('data = %r' % data)
 
-            if self.opts.force == data['device']:
-                self.drive = name
+        if '/boot' in data['mount']:
+            self.log.debug('Skipping boot device: %s' % name)
+            return
 
-            if self.callback:
-                self.callback()
+        # Skip things without a size
+        if not data['size'] and not self.opts.force:
+            self.log.debug('Skipping device without size: %s' % name)
+            return
 
-        def handleRemoved(path, interfaces):
-            if self.drives.has_key(path):
-                del self.drives[path]
+        # Skip devices with unknown filesystems
+        if data['fstype'] not in self.valid_fstypes and \
+                self.opts.force != data['device']:
+            self.log.debug('Skipping %s with unknown filesystem: %s' % (
+                data['device'], data['fstype']))
+            return
 
-            if self.callback:
-                self.callback()
+        mount = data['mount']
+        if mount:
+            if len(mount) > 1:
+                self.log.warning('Multiple mount points for %s' %
+                        data['device'])
+            mount = data['mount'] = data['mount'][0]
+        else:
+            mount = data['mount'] = None
 
-        if not self.opts.console:
-            self.bus.add_signal_receiver(handleAdded, "InterfacesAdded", "org.freedesktop.DBus.ObjectManager", "org.freedesktop.UDisks2", "/org/freedesktop/UDisks2")
-            self.bus.add_signal_receiver(handleRemoved, "InterfacesRemoved", "org.freedesktop.DBus.ObjectManager", "org.freedesktop.UDisks2", "/org/freedesktop/UDisks2")
+        self.log.debug(pformat(data))
+        return True
+
+    def _get_udisks_properties(self, path, interface):
+        """ Return the properties of an interface of a UDisks2 object.
 
-        for name, device in self.udisks.GetManagedObjects().iteritems():
-            handleAdded(name, device)
+        They come from our snapshot of the managed objects if we have them,
+        so that enumerating the drives doesn't cost a bus round-trip for
+        every partition; otherwise we ask UDisks2 and remember the answer.
+        """
+        properties = self._udisks_objects.get(path, {}).get(interface)
+        if properties is None:
+            import dbus
+            self.log.debug('Fetching %s of %s' % (interface, path))
+            obj = self.bus.get_object("org.freedesktop.UDisks2", path)
+            properties = dbus.Interface(obj, "org.freedesktop.DBus.Properties"
+                                        ).GetAll(interface)
+            self._udisks_objects.setdefault(path, {})[interface] = properties
+        return properties
 
     def _storage_bus(self, dev):
         storage_bus = None
@@ -729,7 +1577,6 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
             'uuid'    : str(dev.GetProperty('volume.uuid')),
             'mount'   : mount,
             'udi'     : dev,
-            'free'    : mount and self.get_free_bytes(mount) / 1024**2 or None,
             'device'  : device,
             'parent'  : parent
         }
@@ -745,7 +1592,14 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
                                  self.fstype)
         self.dest = self.drive['mount']
         mnt = None
-        if not self.dest:
+        if not self.dest and self.sysfs:
+            # no UDisks2 to mount it for us
+            mnt = self._temp_mount = tempfile.mkdtemp(prefix='liveusb-')
+            self.popen('mount %s %s' % (self.drive['device'], mnt))
+            self.dest = self.drive['mount'] = mnt
+            self.invalidate_free_space(mnt)
+            self.log.debug("Mounted %s to %s " % (self.drive['device'], mnt))
+        elif not self.dest:
             dev=None
             bd=None
             try:
@@ -781,7 +1635,7 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
                 self.log.error("%s doesn't exist" % mnt)
             else:
                 self.dest = self.drive['mount'] = mnt
-                self.drive['free'] = self.get_free_bytes(self.dest) / 1024**2
+                self.invalidate_free_space(mnt)
                 self.log.debug("Mounted %s to %s " % (self.drive['device'],
                                                       self.dest))
         else:
@@ -791,7 +1645,14 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
         """ Unmount our device """
         self.log.info("Unmounting %s" % self.dest)
         self.popen('umount %s' % self.drive['device'], passive=True)
+        self.invalidate_free_space(self.drive['mount'])
         self.drive['mount'] = None
+        if self.dest and self.dest == self._temp_mount:
+            try:
+                os.rmdir(self.dest)
+                self._temp_mount = None
+            except OSError, e:
+                self.log.error("Unable to remove %s: %r" % (self.dest, e))
         if os.path.exists(self.dest):
             self.log.error("Mount %s exists after unmounting" % self.dest)
         self.dest = None
@@ -809,25 +1670,33 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
             self.log.info(_("Setting %s label to %s") % (self.drive['device'],
                                                          self.label))
             try:
-                if self.fstype in ('vfat', 'msdos'):
-                    try:
-                        self.popen('/sbin/dosfslabel %s %s' % (
-                                   self.drive['device'], self.label))
-                    except LiveUSBError:
-                        # dosfslabel returns an error code even upon success
-                        pass
-                else:
-                    self.popen('/sbin/e2label %s %s' % (self.drive['device'],
-                                                        self.label))
-            except LiveUSBError, e:
+                dev = open(self.drive['device'], 'r+b')
+                try:
+                    set_label(dev, self.fstype, self.label)
+                    os.fsync(dev.fileno())
+                finally:
+                    dev.close()
+                self.drive['label'] = self.label
+            except (LabelError, EnvironmentError), e:
                 self.log.error(_("Unable to change volume label: %r") % e)
 
-    def extract_iso(self):
+    def extract_iso(self, progress=None):
         """ Extract self.iso to self.dest """
         self.log.info(_("Extracting live image to USB device..."))
+        if not progress:
+            class DummyProgress:
+                def set_max_progress(self, value): pass
+                def update_progress(self, value): pass
+            progress = DummyProgress()
         tmpdir = tempfile.mkdtemp()
         self.popen('mount -o loop,ro "%s" %s' % (self.iso, tmpdir))
         tmpliveos = os.path.join(tmpdir, 'LiveOS')
+        algorithm = None
+        if getattr(self.opts, 'liveos_checksum', False):
+            # hash the LiveOS as we copy it, instead of reading it back later
+            algorithm = getattr(self.opts, 'hash', None) or 'sha1'
+        self.copier = StreamCopier(algorithm=algorithm,
+                callback=lambda copied: progress.update_progress(copied / 1024))
         try:
             if not os.path.isdir(tmpliveos):
                 raise LiveUSBError(_("Unable to find LiveOS on ISO"))
@@ -835,36 +1704,44 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
             if not os.path.exists(liveos):
                 os.mkdir(liveos)
 
-            start = datetime.now()
-            self.popen("cp %s '%s'" % (os.path.join(tmpliveos, 'squashfs.img'),
-                                       os.path.join(liveos, 'squashfs.img')))
-            delta = datetime.now() - start
-            if delta.seconds:
-                self.mb_per_sec = (self.isosize / delta.seconds) / 1024**2
-                if self.mb_per_sec:
-                    self.log.info(_("Wrote to device at") + " %d MB/sec" %
-                                  self.mb_per_sec)
+            copies = [(os.path.join(tmpliveos, 'squashfs.img'),
+                       os.path.join(liveos, 'squashfs.img'))]
 
             osmin = os.path.join(tmpliveos, 'osmin.img')
             if os.path.exists(osmin):
-                self.popen("cp %s '%s'" % (osmin,
-                    os.path.join(liveos, 'osmin.img')))
+                copies.append((osmin, os.path.join(liveos, 'osmin.img')))
             else:
                 self.log.debug('No osmin.img found')
 
-            isolinux = os.path.join(self.dest, 'isolinux')
-            if not os.path.exists(isolinux):
-                os.mkdir(isolinux)
-            self.popen("cp %s/* '%s'" % (
-                os.path.join(tmpdir, 'isolinux'), isolinux))
+            copies.append((os.path.join(tmpdir, 'isolinux'),
+                           os.path.join(self.dest, 'isolinux')))
 
             if os.path.exists(os.path.join(tmpdir, 'EFI')):
                 efi = os.path.join(self.dest, 'EFI')
                 if not os.path.exists(efi):
-                    os.mkdir(efi)
-                    self.popen("cp -r %s/* '%s'" % (os.path.join(tmpdir, 'EFI'),
-                                                    efi))
+                    copies.append((os.path.join(tmpdir, 'EFI'), efi))
+
+            progress.set_max_progress(
+                    sum([tree_size(src) for src, dst in copies]) / 1024)
+
+            start = datetime.now()
+            self.copier.copy_file(*copies[0])
+            delta = datetime.now() - start
+            if delta.seconds:
+                self.mb_per_sec = (self.copier.copied / delta.seconds) / 1024**2
+                if self.mb_per_sec:
+                    self.log.info(_("Wrote to device at") + " %d MB/sec" %
+                                  self.mb_per_sec)
+
+            for src, dst in copies[1:]:
+                self.copier.copy(src, dst)
+            if algorithm:
+                self.record_copied_checksums(algorithm, self.copier.checksums)
+        except EnvironmentError, e:
+            raise LiveUSBError(_("Unable to extract the live image: %r") % e)
         finally:
+            self.copier.close()
+            self.invalidate_free_space(self.dest)
             self.popen('umount %s' % tmpdir)
 
     def install_bootloader(self):
@@ -924,6 +1801,9 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
         return dbus.Interface(dev_obj, "org.freedesktop.UDisks2.Filesystem")
 
     def terminate(self):
+        self.terminate_jobs()
+        if self.copier:
+            self.copier.cancel()
         for pid in self.pids:
             try:
                 os.kill(pid, signal.SIGHUP)
@@ -931,22 +1811,6 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
             except OSError, e:
                 self.log.debug(repr(e))
 
-    def verify_iso_md5(self):
-        """ Verify the ISO md5sum.
-
-        At the moment this is Linux specific, until we port checkisomd5
-        to Windows.
-        """
-        self.log.info(_('Verifying ISO MD5 checksum'))
-        try:
-            self.popen('checkisomd5 "%s"' % self.iso)
-        except LiveUSBError, e:
-            self.log.exception(e)
-            self.log.info(_('ISO MD5 checksum verification failed'))
-            return False
-        self.log.info(_('ISO MD5 checksum passed'))
-        return True
-
     def get_proxies(self):
         """ Return the proxy settings.
 
@@ -981,35 +1845,24 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
             self.log.debug('No partitions on device; not attempting to mark '
                            'any paritions as bootable')
             return
-        import parted
-        try:
-            disk, partition = self.get_disk_partition()
-        except LiveUSBError:
-            self.log.exception(_('Unable to get disk partitions'))
-            return
-        if partition.isFlagAvailable(parted.PARTITION_BOOT):
-            if partition.getFlag(parted.PARTITION_BOOT):
-                self.log.debug(_('%s already bootable') % self.drive['device'])
-            else:
-                partition.setFlag(parted.PARTITION_BOOT)
-                try:
-                    disk.commit()
-                    self.log.info('Marked %s as bootable' % self.drive['device'])
-                except Exception, e:
-                    self.log.exception(e)
-        else:
+        number = self._get_partition_number()
+        mbr = self._read_mbr()
+        if mbr is None or not number:
+            self.log.warning(_('Unable to get disk partitions'))
+        elif mbr.gpt or not mbr.get_partition(number):
             self.log.warning('%s does not have boot flag' % self.drive['device'])
+        elif mbr.get_partition(number).active:
+            self.log.debug(_('%s already bootable') % self.drive['device'])
+        else:
+            try:
+                self._write_mbr(mbr.updated(active=number))
+                self.log.info('Marked %s as bootable' % self.drive['device'])
+            except EnvironmentError, e:
+                self.log.exception(e)
 
-    def get_disk_partition(self):
-        """ Return the PedDisk and partition of the selected device """
-        import parted
-        parent = self.drives[self._drive]['parent']
-        dev = parted.Device(path = parent)
-        disk = parted.Disk(device = dev)
-        for part in disk.partitions:
-            if self.drive['device'] == "/dev/%s" %(part.getDeviceNodeName(),):
-                return disk, part
-        raise LiveUSBError(_("Unable to find partition"))
+    def _get_partition_number(self):
+        return get_partition_number(self.drive['device'],
+                                    self.drive['parent'] or '')
 
     def initialize_zip_geometry(self):
         """ This method initializes the selected device in a zip-like fashion.
@@ -1035,24 +1888,43 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
         self.log.info('Formatting %s as FAT32' % self.drive['device'])
         self.popen('mkfs.vfat -F 32 %s' % self.drive['device'])
 
+    def _get_mbr_device(self):
+        return unicode(self.drive.get('parent') or self.drive['device'])
+
+    def _read_mbr(self):
+        """ Return the MBR of our drive, or None if we can't read it.
+
+        We keep it until we write to the device, or the drive goes away,
+        so that looking at a drive doesn't keep opening it.
+        """
+        device = self._get_mbr_device()
+        if device not in self._mbrs:
+            self.log.debug('Reading the MBR of %s' % device)
+            try:
+                self._mbrs[device] = MBR.read(device)
+            except EnvironmentError, e:
+                self.log.debug('Unable to read the MBR of %s: %r' % (device, e))
+                return None
+        return self._mbrs[device]
+
+    def _write_mbr(self, mbr):
+        device = self._get_mbr_device()
+        self._mbrs.pop(device, None)
+        mbr.write(device)
+        self._mbrs[device] = mbr
+
     def get_mbr(self):
-        parent = self.drive.get('parent', self.drive['device'])
-        if parent is None:
-            parent = self.drive['device']
-        parent = unicode(parent)
-        self.log.debug('Checking the MBR of %s' % parent)
-        try:
-            drive = open(parent, 'rb')
-        except IOError:
+        mbr = self._read_mbr()
+        if mbr is None:
             return ''
-        mbr = ''.join(['%02X' % ord(x) for x in drive.read(2)])
-        drive.close()
+        mbr = ''.join(['%02X' % ord(x) for x in mbr.sector[:2]])
         self.log.debug('mbr = %r' % mbr)
         return mbr
 
     def blank_mbr(self):
         """ Return whether the MBR is empty or not """
-        return self.get_mbr() == '0000'
+        mbr = self._read_mbr()
+        return mbr is not None and mbr.blank
 
     def _get_mbr_bin(self):
         mbr = None
@@ -1064,53 +1936,52 @@ class LinuxLiveUSBCreator(LiveUSBCreator):
                 mbr = mbr_bin
         return mbr
 
+    def _get_syslinux_boot_code(self):
+        """ Return the contents of syslinux's mbr.bin, or None """
+        if self._syslinux_boot_code is None:
+            mbr_bin = self._get_mbr_bin()
+            if mbr_bin:
+                with open(mbr_bin, 'rb') as boot_code:
+                    self._syslinux_boot_code = boot_code.read()
+        return self._syslinux_boot_code
+
     def mbr_matches_syslinux_bin(self):
         """
         Return whether or not the MBR on the drive matches the system's
         syslinux mbr.bin
         """
-        mbr_bin = open(self._get_mbr_bin(), 'rb')
-        mbr = ''.join(['%02X' % ord(x) for x in mbr_bin.read(2)])
-        return mbr == self.get_mbr()
+        boot_code = self._get_syslinux_boot_code()
+        mbr = self._read_mbr()
+        return bool(boot_code and mbr and mbr.has_boot_code(boot_code))
 
     def reset_mbr(self):
-        parent = unicode(self.drive.get('parent', self.drive['device']))
-        if '/dev/loop' not in self.drive:
-            mbr = self._get_mbr_bin()
-            if mbr:
-                self.log.info(_('Resetting Master Boot Record') + ' of %s' % parent)
-                self.popen('cat %s > %s' % (mbr, parent))
-            else:
+        """ Write syslinux's boot code to our drive.
+
+        The selected partition is marked active in the same write, which
+        is what bootable_partition would do afterwards anyway.
+        """
+        parent = self._get_mbr_device()
+        if not parent.startswith('/dev/loop'):
+            boot_code = self._get_syslinux_boot_code()
+            mbr = self._read_mbr()
+            if not boot_code:
                 self.log.info(_('Unable to reset MBR.  You may not have the '
                                 '`syslinux` package installed'))
+            elif mbr is None:
+                raise LiveUSBError(_('Unable to read the MBR of %s') % parent)
+            else:
+                self.log.info(_('Resetting Master Boot Record') + ' of %s' % parent)
+                number = self._get_partition_number()
+                if mbr.gpt or not mbr.get_partition(number):
+                    number = None
+                try:
+                    self._write_mbr(mbr.updated(boot_code, active=number))
+                except EnvironmentError, e:
+                    raise LiveUSBError(_('Unable to reset the MBR of %s: %r') %
+                                       (parent, e))
         else:
             self.log.info(_('Drive is a loopback, skipping MBR reset'))
 
-    def calculate_device_checksum(self, progress=None):
-        """ Calculate the SHA1 checksum of the device """
-        self.log.info(_("Calculating the SHA1 of %s" % self.drive['device']))
-        if not progress:
-            class DummyProgress:
-                def set_max_progress(self, value): pass
-                def update_progress(self, value): pass
-            progress = DummyProgress()
-        # Get size of drive
-        #progress.set_max_progress(self.isosize / 1024)
-        checksum = hashlib.sha1()
-        device_name = unicode(self.drive['parent'])
-        device = file(device_name, 'rb')
-        bytes = 1024**2
-        total = 0
-        while bytes:
-            data = device.read(bytes)
-            checksum.update(data)
-            bytes = len(data)
-            total += bytes
-            progress.update_progress(total / 1024)
-        hexdigest = checksum.hexdigest()
-        self.log.info("sha1(%s) = %s" % (device_name, hexdigest))
-        return hexdigest
-
     def flush_buffers(self):
         self.popen('sync', passive=True)
 
@@ -1156,7 +2027,7 @@ class MacOsLiveUSBCreator(LiveUSBCreator):
         """
         pass
 
-    def extract_iso(self):
+    def extract_iso(self, progress=None):
         """ Extract the LiveCD ISO to the USB drive """
         pass
 
@@ -1205,7 +2076,7 @@ class WindowsLiveUSBCreator(LiveUSBCreator):
 
     def detect_removable_drives(self, callback=None):
         import win32file, win32api, pywintypes
-        self.drives = {}
+        self.drives.clear()
         self.callback = callback
 
         def detect():
@@ -1224,7 +2095,6 @@ class WindowsLiveUSBCreator(LiveUSBCreator):
                             'label': vol[0],
                             'mount': drive,
                             'uuid': self._get_device_uuid(drive),
-                            'free': self.get_free_bytes(drive) / 1024**2,
                             'fstype': 'vfat',
                             'device': drive,
                             'fsversion': vol[-1],
@@ -1233,7 +2103,8 @@ class WindowsLiveUSBCreator(LiveUSBCreator):
                 except Exception, e:
                     self.log.exception(e)
                     self.log.error(_("Error probing device"))
-            self.drives = d
+            self.drives.clear()
+            self.drives.update(d)
             #if callback:
             #    callback()
 
@@ -1299,11 +2170,12 @@ class WindowsLiveUSBCreator(LiveUSBCreator):
             return 0
         return fc * (spc * bps) # free-clusters * bytes per-cluster
 
-    def extract_iso(self):
+    def extract_iso(self, progress=None):
         """ Extract our ISO with 7-zip directly to the USB key """
         self.log.info(_("Extracting live image to USB device..."))
         start = datetime.now()
         self.popen('7z x "%s" -x![BOOT] -y -o%s' % (self.iso, self.drive['device']))
+        self.invalidate_free_space(self.drive['mount'])
         delta = datetime.now() - start
         if delta.seconds:
             self.mb_per_sec = (self.isosize / delta.seconds) / 1024**2
@@ -1414,9 +2286,53 @@ class WindowsLiveUSBCreator(LiveUSBCreator):
                                     creationflags=win32process.CREATE_NO_WINDOW,
                                     **kwargs)
 
+    def dd_image(self, progress=None, check_progress=None):
+        """ Overwrite the selected device with the raw live image using
+        tools/dd.exe.
+
+        ImageWriter needs fdatasync, O_DIRECT and the block device ioctls
+        of Linux, so here the image is verified in a pass of its own before
+        dd writes it, and the device is read back afterwards if asked to.
+        """
+        self.log.info(_('Overwriting device with live image'))
+        if not self.opts.noverify and not self.verify_iso(progress):
+            raise LiveUSBError(_("Error: The checksum of your Live CD is "
+                                 "invalid.  You can run this program with "
+                                 "the --noverify argument to bypass this "
+                                 "verification check."))
+        drive = self._get_raw_device()
+        start = datetime.now()
+        try:
+            self.popen('dd if="%s" of="%s" bs=1M iflag=direct oflag=direct '
+                       'conv=fdatasync' % (self.iso, drive))
+        finally:
+            self.invalidate_free_space()
+            self.invalidate_mbr(drive)
+        delta = datetime.now() - start
+        if delta.seconds:
+            self.mb_per_sec = (self.isosize / delta.seconds) / 1024**2
+            if self.mb_per_sec:
+                self.log.info(_("Wrote to device at") + " %d MB/sec" %
+                              self.mb_per_sec)
+
+        if not getattr(self.opts, 'device_checksum', False):
+            return
+        if getattr(self.opts, 'device_checksum_mode', None) == 'sampled':
+            self._check_written_image(drive, None, None, None,
+                                      check_progress or progress)
+            return
+        expected = self.get_release_checksum()
+        if expected and self.calculate_device_checksum(
+                check_progress or progress, mode='extent') != expected[1]:
+            self.invalidate_image(drive)
+            raise LiveUSBError(_("The data on %s does not match the live "
+                                 "image.  The image written to it has "
+                                 "been erased.") % drive)
+
     def terminate(self):
         """ Terminate any subprocesses that we have spawned """
         import win32api, win32con, pywintypes
+        self.terminate_jobs()
         for pid in self.pids:
             try:
                 handle = win32api.OpenProcess(win32con.PROCESS_TERMINATE,
@@ -1456,15 +2372,21 @@ class WindowsLiveUSBCreator(LiveUSBCreator):
         self.log.debug(_('Using proxies: %r') % proxies)
         return proxies
 
-    def verify_iso_md5(self):
-        """ Verify the ISO md5sum.
+    def _get_raw_device(self):
+        return r'\\.\%s' % self.drive['device']
 
-        At the moment this is Linux-only, until we port checkisomd5 to Windows.
-        """
-        return True
+    def calculate_device_checksum(self, progress=None, mode=None,
+                                  samples=None):
+        """ Calculate the checksum of the device.
 
-    def calculate_device_checksum(self, progress=None):
-        """ Calculate the SHA1 checksum of the device """
+        The 'extent' and 'sampled' modes only read as much of the device as
+        the image covers, so they're left to LiveUSBCreator.  A raw volume
+        can't be seeked to its end here, so 'full' goes by the drive's size.
+        """
+        mode = mode or getattr(self.opts, 'device_checksum_mode', None) or 'full'
+        if mode != 'full':
+            return super(WindowsLiveUSBCreator, self).calculate_device_checksum(
+                    progress, mode, samples)
         self.log.info(_("Calculating the SHA1 of %s" % self._drive))
         time.sleep(3)
         if not progress:
@@ -1474,8 +2396,7 @@ class WindowsLiveUSBCreator(LiveUSBCreator):
             progress = DummyProgress()
         progress.set_max_progress(self.drive['size'])
         checksum = hashlib.sha1()
-        device_name = r'\\.\%s' % self.drive['device']
-        device = file(device_name, 'rb')
+        device = file(self._get_raw_device(), 'rb')
         bytes = 1
         total = 0
         while bytes:
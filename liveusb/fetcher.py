@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Concurrent page fetching for crawling the release catalog.
+
+The pages of the catalog link to each other: the products link to their
+download pages, which link to the images, whose directories hold the
+CHECKSUM files.  Rather than fetching them one after another, the crawl
+runs each level of links in its own threads through a shared Fetcher,
+which:
+
+ - keeps a few keep-alive connections open to each host, and never runs
+   more than `per_host` requests to a host at once,
+ - fetches every URL only once, however many pages link to it and
+   however many threads ask for it at the same time,
+ - records how long every request took, for finding the slow ones,
+ - and the ETag and Last-Modified of every page, for refreshing it later.
+
+A whole crawl then takes about as long as its longest chain of links.
+"""
+
+import threading
+import urlparse
+import httplib
+import logging
+import urllib
+import socket
+import time
+
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger(__name__)
+
+DEFAULT_PER_HOST = 4
+DEFAULT_THREADS = 8
+DEFAULT_TIMEOUT = 30
+MAX_REDIRECTS = 5
+REDIRECTS = (301, 302, 303, 307, 308)
+USER_AGENT = 'liveusb-creator'
+
+Timing = namedtuple('Timing', ['url', 'status', 'size', 'seconds'])
+Response = namedtuple('Response', ['url', 'status', 'headers', 'body'])
+
+
+class FetchError(IOError):
+    """ A URL couldn't be fetched """
+
+    def __init__(self, url, reason, status=None):
+        IOError.__init__(self, '%s: %s' % (url, reason))
+        self.url = url
+        self.status = status
+
+
+class _Pending(object):
+    """ A fetch in progress, that other threads can wait for """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.body = None
+        self.error = None
+
+
+class Fetcher(object):
+    """ Fetch URLs from many threads, with shared keep-alive connections.
+
+    @param per_host: The most requests to run at once to each host.
+    @param threads: The most threads each call to map runs at once.
+    @param timeout: Seconds to wait for a host before giving up on it.
+    @param proxies: A {scheme: proxy URL}, or None for the environment's.
+    """
+
+    def __init__(self, per_host=DEFAULT_PER_HOST, timeout=DEFAULT_TIMEOUT,
+                 proxies=None, threads=DEFAULT_THREADS):
+        self.per_host = per_host
+        self.threads = threads
+        self.timeout = timeout
+        if proxies is None:
+            proxies = urllib.getproxies()
+        self.proxies = proxies
+        self.timings = []
+        self.validators = {}    # {url: {'etag': ..., 'modified': ...}}
+        self._lock = threading.Lock()
+        self._slots = {}        # {(scheme, host): BoundedSemaphore}
+        self._idle = {}         # {(scheme, host): [idle connections]}
+        self._fetched = {}      # {url: _Pending}
+
+    def _get_slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.per_host)
+            return self._slots[key]
+
+    def _connect(self, scheme, host):
+        """ Return a new connection to host, through our proxy if any """
+        proxy = self.proxies.get(scheme)
+        if proxy and not urllib.proxy_bypass(host.split(':')[0]):
+            proxy_host = urlparse.urlsplit(proxy).netloc or proxy
+            if scheme == 'https':
+                conn = httplib.HTTPSConnection(proxy_host,
+                                               timeout=self.timeout)
+                conn.set_tunnel(host)
+            else:
+                conn = httplib.HTTPConnection(proxy_host, timeout=self.timeout)
+            conn.proxied = scheme == 'http'
+            return conn
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, timeout=self.timeout)
+        conn.proxied = False
+        return conn
+
+    def _get_connection(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(*key), False
+
+    def _put_connection(self, key, conn):
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def _get(self, url, headers=None):
+        """ GET url over a pooled connection, returning the response's
+        status, headers and body.
+        """
+        parts = urlparse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise FetchError(url, 'unsupported scheme')
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        headers = dict(headers or {})
+        headers.update({'User-Agent': USER_AGENT,
+                        'Accept-Encoding': 'identity'})
+        with self._get_slot(key):
+            while True:
+                conn, reused = self._get_connection(key)
+                try:
+                    conn.request('GET', conn.proxied and url or path,
+                                 headers=headers)
+                    response = conn.getresponse()
+                    body = response.read()
+                except (httplib.HTTPException, socket.error), e:
+                    conn.close()
+                    if reused:
+                        # the server closed the idle connection, try anew
+                        continue
+                    raise FetchError(url, e)
+                if response.will_close:
+                    conn.close()
+                else:
+                    self._put_connection(key, conn)
+                return response.status, response.msg, body
+
+    def request(self, url, etag=None, modified=None):
+        """ GET url, following redirects, and return its Response.
+
+        Unlike fetch, this always goes to the server.  With the ETag or
+        Last-Modified of a copy we have, the server answers 304 with no
+        body if that copy is still current.
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        for i in range(MAX_REDIRECTS + 1):
+            start = time.time()
+            status, msg, body = self._get(url, headers)
+            elapsed = time.time() - start
+            with self._lock:
+                self.timings.append(Timing(url, status, len(body), elapsed))
+            log.debug('GET %s: %d, %d bytes in %.0f ms' % (
+                      url, status, len(body), elapsed * 1000))
+            if status in REDIRECTS and msg.get('location'):
+                url = urlparse.urljoin(url, msg['location'])
+                continue
+            if status >= 400:
+                raise FetchError(url, 'HTTP %d' % status, status)
+            return Response(url, status, msg, body)
+        raise FetchError(url, 'too many redirects')
+
+    def _remember(self, url, response):
+        self.validators[url] = {'etag': response.headers.get('etag'),
+                                'modified': response.headers.get('last-modified')}
+
+    def prime(self, url, response):
+        """ Take a Response we got for url as its fetched page """
+        pending = _Pending()
+        pending.body = response.body
+        pending.done.set()
+        with self._lock:
+            self._fetched[url] = pending
+            self._remember(url, response)
+
+    def fetch(self, url):
+        """ Return the body of url, fetching it only if nobody has yet """
+        with self._lock:
+            pending = self._fetched.get(url)
+            owner = pending is None
+            if owner:
+                pending = self._fetched[url] = _Pending()
+        if owner:
+            try:
+                response = self.request(url)
+                pending.body = response.body
+                with self._lock:
+                    self._remember(url, response)
+            except Exception, e:
+                pending.error = e
+            pending.done.set()
+        else:
+            pending.done.wait()
+        if pending.error:
+            raise pending.error
+        return pending.body
+
+    def map(self, func, items):
+        """ Return [func(item) for item in items], calling them all at once.
+
+        Every call to map gets a pool of its own, of no more than `threads`
+        threads, so the calls of a crawl that map over the links of their
+        own pages can't starve each other's pool; the requests themselves
+        are still limited by per_host.
+        """
+        items = list(items)
+        if len(items) < 2:
+            return map(func, items)
+        pool = ThreadPool(min(len(items), self.threads))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def close(self):
+        """ Close our idle connections, and log the slowest requests """
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+            timings = sorted(self.timings, key=lambda t: t.seconds)
+        if timings:
+            log.debug('Fetched %d URLs, %d bytes; the slowest were:\n%s' % (
+                      len(timings), sum([t.size for t in timings]),
+                      '\n'.join(['  %.0f ms %s' % (t.seconds * 1000, t.url)
+                                 for t in reversed(timings[-5:])])))
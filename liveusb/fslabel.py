@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Setting the volume label of FAT and ext2/3/4 filesystems, in place of
+dosfslabel and e2label.
+
+A FAT label lives in two places: the extended boot record of the boot
+sector (and of its backup on FAT32), and a volume label entry in the root
+directory, which is the one most systems actually read.  An ext label is
+the s_volume_name of the primary superblock, whose checksum has to be
+updated on filesystems with the metadata_csum feature.
+
+The functions work on an open file, so the caller can share one handle to
+the device with the rest of its work.
+"""
+
+import struct
+
+SECTOR_SIZE = 512
+DIR_ENTRY_SIZE = 32
+ATTR_VOLUME_ID = 0x08
+ATTR_LONG_NAME = 0x0f
+FAT_LABEL_SIZE = 11
+FAT_NO_NAME = 'NO NAME'
+FAT32_EOC = 0x0ffffff8
+FAT32_MASK = 0x0fffffff
+
+EXT_SUPERBLOCK = 1024
+EXT_SUPERBLOCK_SIZE = 1024
+EXT_MAGIC = 0xef53
+EXT_VOLUME_NAME = 120
+EXT_LABEL_SIZE = 16
+EXT_RO_COMPAT = 100
+EXT4_FEATURE_RO_COMPAT_METADATA_CSUM = 0x0400
+EXT_CHECKSUM = 1020
+
+
+class LabelError(Exception):
+    """ The filesystem isn't one we can label """
+    pass
+
+
+def _crc32c_table():
+    table = []
+    for i in range(256):
+        crc = i
+        for j in range(8):
+            crc = crc >> 1 ^ (0x82f63b78 if crc & 1 else 0)
+        table.append(crc)
+    return table
+
+CRC32C_TABLE = _crc32c_table()
+
+
+def crc32c(data, crc=0):
+    """ The CRC32C (Castagnoli) of data, continuing from crc """
+    crc ^= 0xffffffff
+    for byte in bytearray(data):
+        crc = CRC32C_TABLE[(crc ^ byte) & 0xff] ^ crc >> 8
+    return crc ^ 0xffffffff
+
+
+def _read_at(dev, offset, size):
+    dev.seek(offset)
+    data = dev.read(size)
+    if len(data) != size:
+        raise LabelError('Short read at offset %d' % offset)
+    return data
+
+
+def _write_at(dev, offset, data):
+    dev.seek(offset)
+    dev.write(data)
+
+
+class FATVolume(object):
+    """ The geometry of a FAT12, FAT16 or FAT32 filesystem """
+
+    def __init__(self, dev):
+        self.dev = dev
+        boot = _read_at(dev, 0, SECTOR_SIZE)
+        if boot[510:512] != '\x55\xaa':
+            raise LabelError('No FAT boot sector signature')
+        (self.bytes_per_sector, self.sectors_per_cluster, self.reserved,
+         self.fat_count, self.root_entries, total16, media, fat_size16) = \
+                struct.unpack('<HBHBHHBH', boot[11:24])
+        if not self.bytes_per_sector or not self.sectors_per_cluster or \
+                not self.fat_count:
+            raise LabelError('Not a FAT filesystem')
+        self.fat32 = fat_size16 == 0
+        if self.fat32:
+            self.fat_size, = struct.unpack('<I', boot[36:40])
+            self.root_cluster, = struct.unpack('<I', boot[44:48])
+            self.backup_boot, = struct.unpack('<H', boot[50:52])
+            self.ebr = 64
+        else:
+            self.fat_size = fat_size16
+            self.ebr = 36
+        self.fat_offset = self.reserved * self.bytes_per_sector
+        root = self.reserved + self.fat_count * self.fat_size
+        self.root_offset = root * self.bytes_per_sector
+        self.data_offset = self.root_offset + \
+                self.root_entries * DIR_ENTRY_SIZE
+        self.cluster_size = self.sectors_per_cluster * self.bytes_per_sector
+
+    def _cluster_offset(self, cluster):
+        return self.data_offset + (cluster - 2) * self.cluster_size
+
+    def _next_cluster(self, cluster):
+        entry = _read_at(self.dev, self.fat_offset + cluster * 4, 4)
+        return struct.unpack('<I', entry)[0] & FAT32_MASK
+
+    def root_directory(self):
+        """ Yield the (offset, size) of the extents of the root directory """
+        if not self.fat32:
+            yield self.root_offset, self.root_entries * DIR_ENTRY_SIZE
+            return
+        cluster, seen = self.root_cluster, set()
+        while 2 <= cluster < FAT32_EOC and cluster not in seen:
+            seen.add(cluster)
+            yield self._cluster_offset(cluster), self.cluster_size
+            cluster = self._next_cluster(cluster)
+
+    def find_label_entry(self):
+        """ Return the offset of the volume label entry in the root
+        directory, and whether it exists yet; or (None, False) if there is
+        neither one nor a free entry for it.
+        """
+        free = None
+        for offset, size in self.root_directory():
+            entries = _read_at(self.dev, offset, size)
+            for i in range(0, size, DIR_ENTRY_SIZE):
+                first, attr = entries[i], ord(entries[i + 11])
+                if first == '\0':
+                    return (free if free is not None else offset + i), False
+                if first == '\xe5':
+                    if free is None:
+                        free = offset + i
+                elif attr & ATTR_VOLUME_ID and attr != ATTR_LONG_NAME:
+                    return offset + i, True
+        return free, False
+
+    def get_label(self):
+        offset, exists = self.find_label_entry()
+        if exists:
+            label = _read_at(self.dev, offset, FAT_LABEL_SIZE)
+        else:
+            label = _read_at(self.dev, self.ebr + 7, FAT_LABEL_SIZE)
+        label = label.rstrip(' ')
+        return label != FAT_NO_NAME and label or ''
+
+    def set_label(self, label):
+        try:
+            field = (label or FAT_NO_NAME).encode('ascii')[:FAT_LABEL_SIZE]
+        except UnicodeError:
+            # the label is in the OEM code page, which we don't know
+            raise LabelError('A FAT label can only have ASCII characters, '
+                             'not %r' % label)
+        field = field.ljust(FAT_LABEL_SIZE)
+        boots = [0]
+        if self.fat32 and self.backup_boot:
+            boots.append(self.backup_boot * self.bytes_per_sector)
+        for boot in boots:
+            # only if the extended boot signature says the field is there
+            if _read_at(self.dev, boot + self.ebr + 2, 1) == '\x29':
+                _write_at(self.dev, boot + self.ebr + 7, field)
+        offset, exists = self.find_label_entry()
+        if offset is None:
+            raise LabelError('No room for a label in the root directory')
+        if exists and not label:
+            _write_at(self.dev, offset, '\xe5')
+        elif exists:
+            _write_at(self.dev, offset, field)
+        elif label:
+            entry = field + chr(ATTR_VOLUME_ID) + '\0' * 20
+            _write_at(self.dev, offset, entry)
+
+
+def get_ext_superblock(dev):
+    superblock = _read_at(dev, EXT_SUPERBLOCK, EXT_SUPERBLOCK_SIZE)
+    if struct.unpack('<H', superblock[56:58])[0] != EXT_MAGIC:
+        raise LabelError('Not an ext2/3/4 filesystem')
+    return bytearray(superblock)
+
+
+def get_ext_label(dev):
+    superblock = get_ext_superblock(dev)
+    name = superblock[EXT_VOLUME_NAME:EXT_VOLUME_NAME + EXT_LABEL_SIZE]
+    return str(name).rstrip('\0')
+
+
+def set_ext_label(dev, label):
+    superblock = get_ext_superblock(dev)
+    if isinstance(label, unicode):
+        label = label.encode('utf-8')
+    field = label[:EXT_LABEL_SIZE].ljust(EXT_LABEL_SIZE, '\0')
+    superblock[EXT_VOLUME_NAME:EXT_VOLUME_NAME + EXT_LABEL_SIZE] = field
+    ro_compat, = struct.unpack('<I', str(superblock[EXT_RO_COMPAT:
+                                                   EXT_RO_COMPAT + 4]))
+    if ro_compat & EXT4_FEATURE_RO_COMPAT_METADATA_CSUM:
+        # the kernel's crc32c without the final inversion
+        checksum = crc32c(superblock[:EXT_CHECKSUM]) ^ 0xffffffff
+        superblock[EXT_CHECKSUM:] = struct.pack('<I', checksum)
+    _write_at(dev, EXT_SUPERBLOCK, str(superblock))
+
+
+def set_label(dev, fstype, label):
+    """ Set the label of the filesystem in an open file or device """
+    if fstype in ('vfat', 'msdos'):
+        FATVolume(dev).set_label(label)
+    elif fstype in ('ext2', 'ext3', 'ext4'):
+        set_ext_label(dev, label)
+    else:
+        raise LabelError('Unable to label a %s filesystem' % fstype)
+    dev.flush()
+
+
+def get_label(dev, fstype):
+    """ Return the label of the filesystem in an open file or device """
+    if fstype in ('vfat', 'msdos'):
+        return FATVolume(dev).get_label()
+    elif fstype in ('ext2', 'ext3', 'ext4'):
+        return get_ext_label(dev)
+    raise LabelError('Unable to read the label of a %s filesystem' % fstype)
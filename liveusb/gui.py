@@ -36,21 +36,23 @@ property of the backend.
 import os
 import sys
 import logging
+import difflib
 import urlparse
 
 
-from time import sleep
 from datetime import datetime
 from PyQt5.QtCore import pyqtProperty, pyqtSlot, QObject, QUrl, QDateTime, pyqtSignal, QThread, QAbstractListModel, QSortFilterProxyModel, QModelIndex, Qt, QTranslator, QLocale, QTimer
 from PyQt5.QtGui import QGuiApplication
-from PyQt5.QtQml import qmlRegisterType, qmlRegisterUncreatableType, QQmlComponent, QQmlApplicationEngine, QQmlListProperty, QQmlEngine
+from PyQt5.QtQml import qmlRegisterType, qmlRegisterUncreatableType, QQmlComponent, QQmlApplicationEngine, QQmlEngine
 from PyQt5 import QtQuick
 
 import resources_rc
 import qml_rc
 
 from liveusb import LiveUSBCreator, LiveUSBError, _
-from liveusb.releases import releases
+from liveusb.releases import releases, refresh_releases
+from liveusb.progress import ProgressBus
+from liveusb.manifest import SEGMENT_SIZE
 
 if sys.platform == 'win32':
     from liveusb.urlgrabber.grabber import URLGrabber, URLGrabError
@@ -69,6 +71,9 @@ MAX_FAT16 = 2047
 MAX_FAT32 = 3999
 MAX_EXT = 2097152
 
+PROGRESS_INTERVAL = 100 # ms between progress bar updates while writing
+BOOTLOADER_WEIGHT = 16 * 1024**2 # how many bytes installing it is worth
+
 class ReleaseDownloadThread(QThread):
     """ Heavy lifting in the process the iso file download """
     downloadFinished = pyqtSignal(str)
@@ -193,47 +198,23 @@ class ReleaseDownload(QObject, BaseMeter):
             self._live.set_iso(value)
             self.pathChanged.emit()
 
-class ReleaseWriterProgressThread(QThread):
-    """ Periodically checks how the write progresses """
-    alive = True
-    get_free_bytes = None
-    drive = None
-    totalSize = 0
-    orig_free = 0
-
-    def set_data(self, size, drive, freebytes):
-        self.totalSize = size / 1024
-        self.drive = drive
-        self.get_free_bytes = freebytes
-        self.orig_free = self.get_free_bytes()
-        self.parent().maxProgress = self.totalSize
-
-    def run(self):
-        while self.alive:
-            free = self.get_free_bytes()
-            value = (self.orig_free - free) / 1024
-            self.parent().progress = value
-            if (value >= self.totalSize):
-                break
-            sleep(3)
-
-    def stop(self):
-        self.alive = False
-
-    def terminate(self):
-        self.parent().progress = self.totalSize
-        self.terminate()
+def get_dd_stages(live):
+    """ Return the (name, weight in bytes) of the stages of a dd write """
+    opts = live.opts
+    stages = [('write', live.isosize)]
+    if opts.device_checksum and opts.device_checksum_mode == 'sampled':
+        stages.append(('readback', opts.samples * SEGMENT_SIZE))
+    return stages
 
 
 class ReleaseWriterThread(QThread):
     """ The actual write to the portable drive """
 
-    def __init__(self, parent, progressThread):
+    def __init__(self, parent):
         QThread.__init__(self, parent)
 
         self.live = parent.live
         self.parent = parent
-        self.progressThread = progressThread
 
 
     def run(self):
@@ -259,60 +240,84 @@ class ReleaseWriterThread(QThread):
         self.parent.running = False
         #self.live.log.removeHandler(handler)
 
+    def get_stages(self, dd=False):
+        """ Return the (name, weight in bytes) of the stages of this write """
+        opts = self.live.opts
+        isosize = self.live.isosize
+        if dd:
+            return get_dd_stages(self.live)
+        stages = []
+        if not opts.noverify:
+            stages.append(('verify', isosize))
+        stages.append(('copy', isosize))
+        if self.live.overlay and self.live.fstype == 'vfat':
+            stages.append(('overlay', self.live.overlay * 1024**2))
+        else:
+            stages.append(('overlay', 1024**2))
+        stages.append(('bootloader', BOOTLOADER_WEIGHT))
+        if opts.device_checksum:
+            if opts.device_checksum_mode == 'full':
+                stages.append(('readback', self.live.drive['size'] or isosize))
+            elif opts.device_checksum_mode == 'sampled':
+                stages.append(('readback', opts.samples * SEGMENT_SIZE))
+            else:
+                stages.append(('readback', isosize))
+        if opts.liveos_checksum:
+            stages.append(('liveos', isosize))
+        return stages
+
     def ddImage(self, now):
         # TODO move this to the backend
-        self.live.dd_image()
+        bus = self.parent.bus = ProgressBus(self.get_stages(dd=True))
+        self.parent.status = _('Writing the data')
+        readback = None
+        if 'readback' in [stage.name for stage in bus.stages]:
+            readback = bus.stage('readback')
+        self.live.dd_image(progress=bus.stage('write'),
+                           check_progress=readback)
         #self.live.log.removeHandler(handler)
         #duration = str(datetime.now() - now).split('.')[0]
         self.parent.status = 'Finished!'
         self.parent.finished = True
-        self.progressThread.stop()
         return
 
     def copyImage(self, now):
         # TODO move this to the backend
+        bus = self.parent.bus = ProgressBus(self.get_stages())
 
         self.parent.status = _('Checking the source image')
         self.live.check_free_space()
 
         if not self.live.opts.noverify:
-            # Verify the MD5 checksum inside of the ISO image
-            if not self.live.verify_iso_md5():
+            # Verify the MD5 checksum inside of the ISO image, and its SHA1
+            # if we know about this ISO, in a single pass
+            if not self.live.verify_iso(bus.stage('verify')):
                 #self.live.log.removeHandler(handler)
                 return
-
-            # If we know about this ISO, and it's SHA1 -- verify it
-            release = self.live.get_release_from_iso()
-            if release and ('sha1' in release or 'sha256' in release):
-                if not self.live.verify_iso_sha1(self):
-                    #self.live.log.removeHandler(handler)
-                    return
+            bus.stage('verify').finish()
 
         self.parent.status = _('Unpacking the image')
-        # Setup the progress bar
-        self.progressThread.set_data(size=self.live.totalsize,
-                                     drive=self.live.drive['device'],
-                                     freebytes=self.live.get_free_bytes)
-        self.progressThread.start()
-
-        self.live.extract_iso()
+        self.live.extract_iso(progress=bus.stage('copy'))
+        bus.stage('copy').finish()
 
         if self.live.blank_mbr() or self.parent.release.liveUSBData.option('resetMBR'):
             self.live.reset_mbr()
 
         self.parent.status = _('Writing the data')
-        self.live.create_persistent_overlay()
+        self.live.create_persistent_overlay(progress=bus.stage('overlay'))
+        bus.stage('overlay').finish()
         self.live.update_configs()
         self.live.install_bootloader()
         self.live.bootable_partition()
+        bus.stage('bootloader').finish()
 
         self.parent.status = _('Checking the written data')
         if self.live.opts.device_checksum:
-            self.live.calculate_device_checksum(progressThread=self)
+            self.live.calculate_device_checksum(progress=bus.stage('readback'))
+            bus.stage('readback').finish()
         if self.live.opts.liveos_checksum:
-            self.live.calculate_liveos_checksum()
-
-        self.progressThread.stop()
+            self.live.calculate_liveos_checksum(progress=bus.stage('liveos'))
+            bus.stage('liveos').finish()
 
         # Flush all filesystem buffers and unmount
         self.live.flush_buffers()
@@ -323,14 +328,6 @@ class ReleaseWriterThread(QThread):
         duration = str(datetime.now() - now).split('.')[0]
         #self.parent.status = 'Complete! (%s)' % duration
 
-        self.progressThread.stop()
-
-    def set_max_progress(self, maximum):
-        self.parent.maxProgress = maximum
-
-    def update_progress(self, value):
-        self.parent.progress = value
-
 class ReleaseWriter(QObject):
     """ Here we can track the progress of the writing and control it """
     runningChanged = pyqtSignal()
@@ -338,10 +335,13 @@ class ReleaseWriter(QObject):
     maximumChanged = pyqtSignal()
     statusChanged = pyqtSignal()
     finishedChanged = pyqtSignal()
+    rateChanged = pyqtSignal()
 
     _running = False
     _current = -1.0
     _maximum = -1.0
+    _rate = 0.0
+    _eta = -1.0
     _status = ''
     _finished = False
 
@@ -349,16 +349,39 @@ class ReleaseWriter(QObject):
         QObject.__init__(self, parent)
         self.live = parent.live
         self.release = parent
-        self.progressWatcher = ReleaseWriterProgressThread(self)
-        self.worker = ReleaseWriterThread(self, self.progressWatcher)
+        self.bus = None
+        self.worker = ReleaseWriterThread(self)
+        # The worker reports every byte, so only look at it ten times a second
+        self.progressTimer = QTimer(self)
+        self.progressTimer.setInterval(PROGRESS_INTERVAL)
+        self.progressTimer.timeout.connect(self.updateProgress)
+        self.worker.finished.connect(self.updateProgress)
+        self.worker.finished.connect(self.progressTimer.stop)
 
     def reset(self):
         self._running = False
         self._current = -1.0
         self._maximum = -1.0
+        self._rate = 0.0
+        self._eta = -1.0
         self.runningChanged.emit()
         self.currentChanged.emit()
         self.maximumChanged.emit()
+        self.rateChanged.emit()
+
+    @pyqtSlot()
+    def updateProgress(self):
+        if not self.bus:
+            return
+        event = self.bus.snapshot()
+        self.maxProgress = event.total / 1024
+        self.progress = event.done / 1024
+        rate = event.rate or 0.0
+        eta = event.eta if event.eta is not None else -1.0
+        if rate != self._rate or eta != self._eta:
+            self._rate = rate
+            self._eta = eta
+            self.rateChanged.emit()
 
     @pyqtSlot()
     def run(self):
@@ -369,11 +392,14 @@ class ReleaseWriter(QObject):
         self.currentChanged.emit()
         self.maximumChanged.emit()
         self.status = 'Writing'
+        self.bus = None
         self.worker.start()
+        self.progressTimer.start()
 
     @pyqtSlot()
     def cancel(self):
-        self.progressWatcher.stop()
+        self.progressTimer.stop()
+        self.live.terminate()
         self.worker.terminate()
         self.reset()
 
@@ -407,6 +433,16 @@ class ReleaseWriter(QObject):
             self._current = value
             self.currentChanged.emit()
 
+    @pyqtProperty(float, notify=rateChanged)
+    def rate(self):
+        """ Bytes written per second, smoothed """
+        return self._rate
+
+    @pyqtProperty(float, notify=rateChanged)
+    def eta(self):
+        """ Seconds until the whole write is done, or -1 if unknown """
+        return self._eta
+
     @pyqtProperty(str, notify=statusChanged)
     def status(self):
         return self._status
@@ -428,6 +464,160 @@ class ReleaseWriter(QObject):
             self.finishedChanged.emit()
 
 
+class DriveWriter(QObject):
+    """ The progress of one of the drives of a MultiWriter """
+    progressChanged = pyqtSignal()
+    errorChanged = pyqtSignal()
+
+    def __init__(self, parent, path, stages):
+        QObject.__init__(self, parent)
+        self._path = path
+        self._progress = 0.0
+        self._rate = 0.0
+        self._error = ''
+        self.bus = ProgressBus(stages)
+
+    def update(self):
+        event = self.bus.snapshot()
+        progress = event.total and float(event.done) / event.total or 0.0
+        rate = event.rate or 0.0
+        if progress != self._progress or rate != self._rate:
+            self._progress = progress
+            self._rate = rate
+            self.progressChanged.emit()
+
+    @pyqtProperty(str, constant=True)
+    def path(self):
+        return self._path
+
+    @pyqtProperty(float, notify=progressChanged)
+    def progress(self):
+        """ How much of the write is done, from 0 to 1 """
+        return self._progress
+
+    @pyqtProperty(float, notify=progressChanged)
+    def rate(self):
+        """ Bytes written to this drive per second, smoothed """
+        return self._rate
+
+    @pyqtProperty(str, notify=errorChanged)
+    def error(self):
+        return self._error
+
+    @error.setter
+    def error(self, value):
+        if self._error != value:
+            self._error = value
+            self.errorChanged.emit()
+
+
+class MultiWriterThread(QThread):
+    """ Write the image to every drive of a MultiWriter at once """
+
+    def __init__(self, parent):
+        QThread.__init__(self, parent)
+        self.live = parent.live
+        self.parent = parent
+
+    def run(self):
+        writers = self.parent.writers
+        progress, check_progress = {}, {}
+        for writer in writers:
+            progress[writer.path] = writer.bus.stage('write')
+            if 'readback' in [stage.name for stage in writer.bus.stages]:
+                check_progress[writer.path] = writer.bus.stage('readback')
+        try:
+            results = self.live.fan_out([w.path for w in writers],
+                                        progress=progress,
+                                        check_progress=check_progress)
+            for writer in writers:
+                if results.get(writer.path):
+                    writer.error = results[writer.path].args[0]
+            failed = len(filter(None, results.values()))
+            if failed:
+                self.parent.status = _('Failed to write %d of %d drives') % (
+                                       failed, len(writers))
+            else:
+                self.parent.status = _('Finished!')
+        except Exception, e:
+            self.parent.status = e.args[0]
+            self.live.log.exception(e)
+        self.parent.running = False
+
+
+class MultiWriter(QObject):
+    """ Writes the current image to all of the drives at once with dd,
+    reading it only once.  Each drive has its own progress and error.
+    """
+    runningChanged = pyqtSignal()
+    statusChanged = pyqtSignal()
+    writersChanged = pyqtSignal()
+
+    _running = False
+    _status = ''
+
+    def __init__(self, parent):
+        QObject.__init__(self, parent)
+        self.live = parent.live
+        self.data = parent
+        self.writers = []
+        self.worker = MultiWriterThread(self)
+        self.progressTimer = QTimer(self)
+        self.progressTimer.setInterval(PROGRESS_INTERVAL)
+        self.progressTimer.timeout.connect(self.updateProgress)
+        self.worker.finished.connect(self.updateProgress)
+        self.worker.finished.connect(self.progressTimer.stop)
+
+    @pyqtSlot()
+    def updateProgress(self):
+        for writer in self.writers:
+            writer.update()
+
+    @pyqtSlot()
+    def run(self):
+        if self._running or not self.live.iso:
+            return
+        stages = get_dd_stages(self.live)
+        self.writers = [DriveWriter(self, drive.drive['device'], stages)
+                        for drive in self.data.usbDriveModel]
+        self.writersChanged.emit()
+        if not self.writers:
+            return
+        self.running = True
+        self.status = _('Writing the data')
+        self.worker.start()
+        self.progressTimer.start()
+
+    @pyqtSlot()
+    def cancel(self):
+        # the fan-out is our creator's copier, so this stops every drive
+        self.live.terminate()
+
+    @pyqtProperty('QVariant', notify=writersChanged)
+    def drives(self):
+        return self.writers
+
+    @pyqtProperty(bool, notify=runningChanged)
+    def running(self):
+        return self._running
+
+    @running.setter
+    def running(self, value):
+        if self._running != value:
+            self._running = value
+            self.runningChanged.emit()
+
+    @pyqtProperty(str, notify=statusChanged)
+    def status(self):
+        return self._status
+
+    @status.setter
+    def status(self, s):
+        if self._status != s:
+            self._status = s
+            self.statusChanged.emit()
+
+
 class Release(QObject):
     ''' Contains the information about the particular release of Fedora
         I think there should be a cleanup of all the properties - there seem to be more of them than needed
@@ -439,6 +629,8 @@ class Release(QObject):
     statusChanged = pyqtSignal()
     pathChanged = pyqtSignal()
     sizeChanged = pyqtSignal()
+    indexChanged = pyqtSignal()
+    detailsChanged = pyqtSignal()
 
     _path = ''
 
@@ -474,6 +666,26 @@ class Release(QObject):
         parent.releaseProxyModel.archChanged.connect(self.sizeChanged)
         parent.releaseProxyModel.archChanged.connect(self.pathChanged)
 
+    @property
+    def key(self):
+        return release_key(self._data)
+
+    def update(self, data):
+        """ Take in refreshed data about the release, returning whether
+        anything changed.
+        """
+        if data == self._data:
+            return False
+        self._data = data
+        self.detailsChanged.emit()
+        self.sizeChanged.emit()
+        self.screenshotsChanged.emit()
+        return True
+
+    @property
+    def busy(self):
+        return self._download.running or self._writer.running
+
 
     @pyqtSlot()
     def get(self):
@@ -521,10 +733,16 @@ class Release(QObject):
         if self.live.existing_liveos() and not self.parent().option('dd'):
             self.addWarning(_('Your device already contains a live OS. If you continue, it will be overwritten.'))
 
-    @pyqtProperty(int, constant=True)
+    @pyqtProperty(int, notify=indexChanged)
     def index(self):
         return self._index
 
+    @index.setter
+    def index(self, value):
+        if self._index != value:
+            self._index = value
+            self.indexChanged.emit()
+
     @pyqtProperty(bool, constant=True)
     def isSeparator(self):
         return self._data['source'] == ''
@@ -533,7 +751,7 @@ class Release(QObject):
     def name(self):
         return self._data['name']
 
-    @pyqtProperty(str, constant=True)
+    @pyqtProperty(str, notify=detailsChanged)
     def logo(self):
         return self._data['logo']
 
@@ -564,15 +782,15 @@ class Release(QObject):
     def version(self):
         return self._data['version']
 
-    @pyqtProperty(QDateTime, constant=True)
+    @pyqtProperty(QDateTime, notify=detailsChanged)
     def releaseDate(self):
         return QDateTime.fromString(self._data['releaseDate'], Qt.ISODate)
 
-    @pyqtProperty(str, constant=True)
+    @pyqtProperty(str, notify=detailsChanged)
     def summary(self):
         return self._data['summary']
 
-    @pyqtProperty(str, constant=True)
+    @pyqtProperty(str, notify=detailsChanged)
     def description(self):
         return self._data['description']
 
@@ -584,7 +802,7 @@ class Release(QObject):
     def screenshots(self):
         return self._data['screenshots']
 
-    @pyqtProperty(str, constant=True)
+    @pyqtProperty(str, notify=detailsChanged)
     def url(self):
         if not self.isLocal:
             for arch in self._data['variants'].keys():
@@ -661,12 +879,90 @@ class Release(QObject):
             self._error.append(str(value))
             self.errorChanged.emit()
 
+class ReleaseRefreshThread(QThread):
+    """ Bring the release catalog up to date in the background """
+    refreshed = pyqtSignal(object)
+
+    def __init__(self, parent):
+        QThread.__init__(self, parent)
+        self.live = parent.live
+
+    def run(self):
+        try:
+            flavors = refresh_releases()
+        except Exception, e:
+            self.live.log.debug('Unable to refresh the release list: %r' % e)
+            return
+        if flavors:
+            self.refreshed.emit(flavors)
+
+
+def release_key(data):
+    """ Return what tells one release in the catalog from another """
+    return (data['name'], data['version'], tuple(sorted(data['variants'])))
+
+
 class ReleaseListModel(QAbstractListModel):
     """ An abstraction over the list of releases to have them nicely exposed to QML and ready to be filtered
     """
     def __init__(self, parent):
         QAbstractListModel.__init__(self, parent)
 
+    def update(self, flavors):
+        """ Bring the releases in line with a refreshed catalog.
+
+        Only the rows of the releases that were added, removed or changed
+        are touched.  Releases that are still in the catalog, even if they
+        moved, keep their Release, with its download and writer.
+
+        @return: The Releases that are no longer in the catalog.
+        """
+        parent = self.parent()
+        releaseData = parent.releaseData
+        matcher = difflib.SequenceMatcher(None,
+                                          [r.key for r in releaseData],
+                                          [release_key(d) for d in flavors],
+                                          autojunk=False)
+        opcodes = matcher.get_opcodes()
+
+        # the releases being removed, so the ones that only moved are reused
+        removed = {}
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag in ('delete', 'replace'):
+                for release in releaseData[i1:i2]:
+                    removed.setdefault(release.key, []).append(release)
+
+        # from the bottom up, so the rows above stay where they are
+        for tag, i1, i2, j1, j2 in reversed(opcodes):
+            if tag == 'equal':
+                for row, data in zip(range(i1, i2), flavors[j1:j2]):
+                    if releaseData[row].update(data):
+                        index = self.index(row)
+                        self.dataChanged.emit(index, index)
+                continue
+            if tag in ('delete', 'replace'):
+                self.beginRemoveRows(QModelIndex(), i1, i2 - 1)
+                del releaseData[i1:i2]
+                self.endRemoveRows()
+            if tag in ('insert', 'replace'):
+                self.beginInsertRows(QModelIndex(), i1, i1 + j2 - j1 - 1)
+                for row, data in zip(range(i1, i1 + j2 - j1), flavors[j1:j2]):
+                    reused = removed.get(release_key(data))
+                    if reused:
+                        release = reused.pop(0)
+                        release.update(data)
+                    else:
+                        release = Release(parent, row, parent.live, data)
+                    releaseData.insert(row, release)
+                self.endInsertRows()
+
+        for row, release in enumerate(releaseData):
+            release.index = row
+        gone = []
+        for left in removed.values():
+            gone.extend(left)
+        return gone
+
     def rowCount(self, parent=QModelIndex()):
         return len(self.parent().releaseData)
 
@@ -759,21 +1055,129 @@ class LiveUSBLogHandler(logging.Handler):
         if record.levelname in ('INFO', 'ERROR', 'WARN'):
             self.cb(record.msg)
 
+def format_size(size):
+    """ Return a human readable size in base 10 units """
+    gb = 1000.0 # if it's decided to use base 2 values, change this
+    for power, unit in enumerate(('B', 'KB', 'MB', 'GB')):
+        if size < gb ** (power + 1):
+            return '%.1f %s' % (size / (gb ** power), unit)
+    return '%.1f TB' % (size / (gb ** 4))
+
+
 class USBDrive(QObject):
+    textChanged = pyqtSignal()
 
-    def __init__(self, parent, name, drive):
+    def __init__(self, parent, path, drive):
         QObject.__init__(self, parent)
-        self._name = name
+        self._path = path
+        self._name = ''
+        self._drive = None
+        self.update(drive)
+
+    def update(self, drive):
+        """ Take in new data about the drive, returning whether our text
+        changed.
+        """
         self._drive = drive
+        if 'friendlyName' in drive:
+            name = drive['friendlyName']
+        elif 'label' in drive:
+            name = drive['device'] + ' - ' + drive['label']
+        else:
+            name = drive['device']
+        name += ' (%s)' % format_size(drive.get('fullSize', drive['size']))
+        if name != self._name:
+            self._name = name
+            self.textChanged.emit()
+            return True
+        return False
 
-    @pyqtProperty(str, constant=True)
+    @pyqtProperty(str, notify=textChanged)
     def text(self):
         return self._name
 
     @pyqtProperty(str, constant=True)
+    def path(self):
+        return self._path
+
+    @property
     def drive(self):
         return self._drive
 
+
+class USBDriveListModel(QAbstractListModel):
+    """ The portable drives we know about, keyed by their path in the backend.
+
+    The backend tells us which drives were added, removed or changed, and
+    only those rows are touched, so QML only redraws what changed.
+    """
+    countChanged = pyqtSignal()
+
+    def __init__(self, parent):
+        QAbstractListModel.__init__(self, parent)
+        self._paths = []
+        self._drives = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return len(self._paths)
+
+    def roleNames(self):
+        return {Qt.DisplayRole: 'text', Qt.UserRole + 1: 'drive'}
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and index.row() < len(self._paths):
+            drive = self._drives[self._paths[index.row()]]
+            if role == Qt.DisplayRole:
+                return drive.text
+            if role == Qt.UserRole + 1:
+                return drive
+        return None
+
+    @pyqtProperty(int, notify=countChanged)
+    def count(self):
+        return len(self._paths)
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __getitem__(self, row):
+        return self._drives[self._paths[row]]
+
+    def indexOf(self, path):
+        """ Return the row of the drive at path, or -1 """
+        if path in self._drives:
+            return self._paths.index(path)
+        return -1
+
+    def update(self, drives, paths=None):
+        """ Bring the model in line with drives.
+
+        @param paths: The keys of drives that changed, or None to compare
+                      everything.
+        """
+        if paths is None:
+            paths = set(self._paths) | set(drives)
+        for path in paths:
+            row = self.indexOf(path)
+            if path not in drives:
+                if row >= 0:
+                    self.beginRemoveRows(QModelIndex(), row, row)
+                    del self._paths[row]
+                    self._drives.pop(path).deleteLater()
+                    self.endRemoveRows()
+                    self.countChanged.emit()
+            elif row < 0:
+                row = len(self._paths)
+                self.beginInsertRows(QModelIndex(), row, row)
+                self._paths.append(path)
+                self._drives[path] = USBDrive(self, path, drives[path])
+                self.endInsertRows()
+                self.countChanged.emit()
+            elif self._drives[path].update(drives[path]):
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+
+
 class LiveUSBData(QObject):
     """ An entry point to all the exposed properties.
         There is a list of images and USB drives
@@ -782,6 +1186,7 @@ class LiveUSBData(QObject):
     currentImageChanged = pyqtSignal()
     usbDrivesChanged = pyqtSignal()
     currentDriveChanged = pyqtSignal()
+    drivesUpdated = pyqtSignal(object)  # the paths that changed, or None
     optionsChanged = pyqtSignal()
 
     _currentIndex = 0
@@ -811,54 +1216,58 @@ class LiveUSBData(QObject):
                                             self.live,
                                             release
                                     ))
-        self._usbDrives = []
+        self._usbDrives = USBDriveListModel(self)
+        self._multiWriter = MultiWriter(self)
         self.currentDriveChanged.connect(self.currentImage.inspectDestination)
 
-        self.live.detect_removable_drives(callback=self.USBDeviceCallback)
-
-
-    def USBDeviceCallback(self):
-        tmpDrives = []
-        previouslySelected = ''
-        if len(self._usbDrives) > 0:
-            previouslySelected = self._usbDrives[self._currentDrive].drive['device']
-        for drive, info in self.live.drives.items():
-            name = ''
-            if 'friendlyName' in info:
-                name = info['friendlyName']
-            elif 'label' in info:
-                name = info['device'] + ' - ' + info['label']
-            else:
-                name = info['device']
-
-            gb = 1000.0 # if it's decided to use base 2 values, change this
-
-            if 'fullSize' in info:
-                usedSize = info['fullSize']
-            else:
-                usedSize = info['size']
-
-            if usedSize < gb ** 1:
-                name += ' (%.1f B)'  % (usedSize / (gb ** 0))
-            elif usedSize < gb ** 2:
-                name += ' (%.1f KB)' % (usedSize / (gb ** 1))
-            elif usedSize < gb ** 3:
-                name += ' (%.1f MB)' % (usedSize / (gb ** 2))
-            elif usedSize < gb ** 4:
-                name += ' (%.1f GB)' % (usedSize / (gb ** 3))
-            else:
-                name += ' (%.1f TB)' % (usedSize / (gb ** 4))
-
-            tmpDrives.append(USBDrive(self, name, info))
-
-        if tmpDrives != self._usbDrives:
-            self._usbDrives = tmpDrives
+        # the backends may tell us about drives from their own threads, so
+        # the model is only ever updated from ours
+        self.drivesUpdated.connect(self.USBDeviceCallback, Qt.QueuedConnection)
+        self.live.detect_removable_drives(
+                callback=lambda paths=None: self.drivesUpdated.emit(paths))
+
+        self._releaseRefresh = ReleaseRefreshThread(self)
+        self._releaseRefresh.refreshed.connect(self.updateReleases)
+        self._releaseRefresh.start()
+
+    def updateReleases(self, flavors):
+        """ Apply a refreshed release catalog to the release list """
+        current = self.currentImage
+        gone = self._releaseModel.update(flavors)
+        releases[:] = flavors
+
+        if current in self.releaseData:
+            if current.index != self._currentIndex:
+                self._currentIndex = current.index
+                self.currentImageChanged.emit()
+        else:
+            self.currentDriveChanged.disconnect(current.inspectDestination)
+            self._currentIndex = 0
+            self.currentImageChanged.emit()
+            self.currentDriveChanged.connect(self.currentImage.inspectDestination)
+        for release in gone:
+            # a release being downloaded or written keeps going on its own
+            if not release.busy:
+                release.deleteLater()
+
+
+    def USBDeviceCallback(self, paths=None):
+        previouslySelected = None
+        if 0 <= self._currentDrive < len(self._usbDrives):
+            previouslySelected = self._usbDrives[self._currentDrive].path
+        count = len(self._usbDrives)
+        with self.live.drives_lock:
+            self._usbDrives.update(self.live.drives, paths)
+        if len(self._usbDrives) != count:
             self.usbDrivesChanged.emit()
 
-            self.currentDrive = -1
-            for i, drive in enumerate(self._usbDrives):
-                if drive.drive['device'] == previouslySelected:
-                    self.currentDrive = i
+        current = self._usbDrives.indexOf(previouslySelected)
+        if current < 0:
+            self._currentDrive = -1
+            self.currentDrive = 0
+        elif current != self._currentDrive:
+            # only the row moved, the drive is the same one
+            self._currentDrive = current
             self.currentDriveChanged.emit()
 
     @pyqtProperty(ReleaseListModel, notify=releasesChanged)
@@ -885,13 +1294,14 @@ class LiveUSBData(QObject):
     def currentImage(self):
         return self.releaseData[self._currentIndex]
 
-    @pyqtProperty(QQmlListProperty, notify=usbDrivesChanged)
-    def usbDrives(self):
-        return QQmlListProperty(USBDrive, self, self._usbDrives)
+    @pyqtProperty(USBDriveListModel, constant=True)
+    def usbDriveModel(self):
+        return self._usbDrives
 
-    @pyqtProperty('QStringList', notify=usbDrivesChanged)
-    def usbDriveNames(self):
-        return list(i.text for i in self._usbDrives)
+    @pyqtProperty(MultiWriter, constant=True)
+    def multiWriter(self):
+        """ Writes the current image to every drive at once """
+        return self._multiWriter
 
     @pyqtProperty(int, notify=currentDriveChanged)
     def currentDrive(self):
@@ -958,6 +1368,9 @@ class LiveUSBApp(QGuiApplication):
         qmlRegisterUncreatableType(ReleaseListModel, 'LiveUSB', 1, 0, 'ReleaseModel', 'Not creatable directly, use the liveUSBData instance instead')
         qmlRegisterUncreatableType(Release, 'LiveUSB', 1, 0, 'Release', 'Not creatable directly, use the liveUSBData instance instead')
         qmlRegisterUncreatableType(USBDrive, 'LiveUSB', 1, 0, 'Drive', 'Not creatable directly, use the liveUSBData instance instead')
+        qmlRegisterUncreatableType(MultiWriter, 'LiveUSB', 1, 0, 'MultiWriter', 'Not creatable directly, use the liveUSBData instance instead')
+        qmlRegisterUncreatableType(DriveWriter, 'LiveUSB', 1, 0, 'DriveWriter', 'Not creatable directly, use the liveUSBData instance instead')
+        qmlRegisterUncreatableType(USBDriveListModel, 'LiveUSB', 1, 0, 'DriveModel', 'Not creatable directly, use the liveUSBData instance instead')
         qmlRegisterUncreatableType(LiveUSBData, 'LiveUSB', 1, 0, 'Data', 'Use the liveUSBData root instance')
 
         engine = QQmlApplicationEngine()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+A persistent cache of the checksums we have calculated for ISO images.
+
+Verifying a multi-gigabyte image takes a while, and people tend to write the
+same image over and over.  Each entry is keyed on the absolute path of the
+image and remembers its size, mtime, inode and device, so an entry is thrown
+away as soon as the file is replaced or modified.
+"""
+
+import threading
+import logging
+import json
+import time
+import os
+
+log = logging.getLogger(__name__)
+
+MAX_ENTRIES = 64
+
+
+def get_cache_dir():
+    """ Return the directory we keep our caches in """
+    if os.getenv('XDG_CACHE_HOME'):
+        base = os.getenv('XDG_CACHE_HOME')
+    elif os.getenv('LOCALAPPDATA'):
+        base = os.getenv('LOCALAPPDATA')
+    else:
+        base = os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'liveusb-creator')
+
+
+def file_identity(path):
+    """ Return what we need to know to tell whether a file has changed """
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime': st.st_mtime,
+            'inode': st.st_ino, 'device': st.st_dev}
+
+
+class ChecksumCache(object):
+    """ Checksums and verdicts of the images we have verified.
+
+    Entries look like::
+
+        {'size': ..., 'mtime': ..., 'inode': ..., 'device': ..., 'used': ...,
+         'checksums': {'sha256': {'digest': '...', 'verified': True}}}
+
+    Once there are more than max_entries, the least recently used entries
+    are evicted.  The jobs writing to several drives at once share a cache,
+    so it may be used from any thread.
+    """
+
+    def __init__(self, filename=None, max_entries=MAX_ENTRIES):
+        self.filename = filename or os.path.join(get_cache_dir(),
+                                                 'checksums.json')
+        self.max_entries = max_entries
+        self._entries = None
+        self._lock = threading.RLock()
+
+    @property
+    def entries(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = {}
+                if os.path.exists(self.filename):
+                    try:
+                        with open(self.filename) as cache:
+                            self._entries = json.load(cache)
+                    except (IOError, ValueError), e:
+                        log.warning('Ignoring unreadable checksum cache '
+                                    '%s: %r' % (self.filename, e))
+            return self._entries
+
+    def _entry(self, path, create=False):
+        """ Return the entry for path, if it is still valid """
+        path = os.path.abspath(path)
+        identity = file_identity(path)
+        entry = self.entries.get(path)
+        if entry and any([entry.get(key) != value
+                          for key, value in identity.items()]):
+            log.debug('%s has changed, forgetting its checksums' % path)
+            del self.entries[path]
+            entry = None
+        if entry is None and create:
+            entry = dict(identity, checksums={})
+            self.entries[path] = entry
+        return entry
+
+    def get(self, path, algorithm):
+        """ Return the cached {'digest': ..., 'verified': ...} or None """
+        with self._lock:
+            entry = self._entry(path)
+            if entry:
+                return entry['checksums'].get(algorithm)
+
+    def set(self, path, algorithm, digest=None, verified=None):
+        with self._lock:
+            entry = self._entry(path, create=True)
+            entry['checksums'][algorithm] = {'digest': digest,
+                                             'verified': verified}
+            entry['used'] = time.time()
+
+    def touch(self, path):
+        with self._lock:
+            entry = self._entry(path)
+            if entry:
+                entry['used'] = time.time()
+
+    def forget(self, path):
+        with self._lock:
+            self.entries.pop(os.path.abspath(path), None)
+
+    def save(self):
+        """ Evict old entries and write the cache out """
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        entries = self.entries
+        if len(entries) > self.max_entries:
+            by_age = sorted(entries, key=lambda path: entries[path].get('used', 0))
+            for path in by_age[:len(entries) - self.max_entries]:
+                del entries[path]
+        dirname = os.path.dirname(self.filename)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w') as cache:
+                json.dump(entries, cache)
+            if os.path.exists(self.filename) and os.name == 'nt':
+                os.unlink(self.filename)
+            os.rename(tmp, self.filename)
+        except (IOError, OSError), e:
+            log.warning('Unable to save checksum cache %s: %r' %
+                        (self.filename, e))
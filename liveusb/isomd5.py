@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Verification of the MD5 checksum implanted in an ISO by implantisomd5.
+
+This does the same job as checkisomd5, but it is fed the image a chunk at a
+time, so that it can share a single read of the ISO with our other checksums.
+
+implantisomd5 stores the checksum as text in the application use area of
+the primary volume descriptor, for example::
+
+    ISO MD5SUM = 9b5c...;SKIPSECTORS = 15;RHLISOSTATUS=1;
+    FRAGMENT SUMS = 3d8e...;FRAGMENT COUNT = 20;
+
+The MD5 covers the whole volume except the last SKIPSECTORS sectors, with
+the application use area itself read as spaces.  The fragment sums are the
+first hex digit of the first few bytes of the running MD5 at evenly spaced
+points, which let us give up early on a corrupt image.
+"""
+
+import hashlib
+import struct
+import re
+
+SECTOR_SIZE = 2048
+PVD_SECTOR = 16             # the first volume descriptor
+VOLUME_SIZE_OFFSET = 80     # little-endian sector count in the PVD
+APPDATA_OFFSET = 883        # application use area in the PVD
+APPDATA_SIZE = 512
+READ_SIZE = 16 * SECTOR_SIZE # checkisomd5's read size; fragments follow it
+FRAGMENT_SUM_SIZE = 60
+
+
+def parse_appdata(appdata):
+    """ Return a dict of the KEY = value fields in an application use area """
+    fields = {}
+    for field in appdata.split(';'):
+        if '=' in field:
+            key, value = field.split('=', 1)
+            fields[key.strip()] = value.strip().strip('\0')
+    return fields
+
+
+def find_primary_volume_descriptor(isofile):
+    """ Return the offset of the primary volume descriptor, or None """
+    sector = PVD_SECTOR
+    while True:
+        isofile.seek(sector * SECTOR_SIZE)
+        descriptor = isofile.read(SECTOR_SIZE)
+        if len(descriptor) < SECTOR_SIZE or descriptor[1:6] != 'CD001':
+            return None
+        if descriptor[0] == '\x01':
+            return sector * SECTOR_SIZE
+        if descriptor[0] == '\xff': # volume descriptor set terminator
+            return None
+        sector += 1
+
+
+class ImplantedMD5(object):
+    """ An incremental checker for an implanted MD5.
+
+    Feed it the image from the start with update(), then call verify().
+    """
+
+    def __init__(self, pvd_offset, volume_size, checksum, skipsectors=0,
+                 fragment_sums='', fragment_count=0):
+        self.appdata_offset = pvd_offset + APPDATA_OFFSET
+        self.checksum = checksum.lower()
+        self.total = volume_size - skipsectors * SECTOR_SIZE
+        self.fragment_sums = fragment_sums.lower()
+        self.fragment_count = fragment_count
+        self.offset = 0
+        self.failed = False
+        self.md5 = hashlib.md5()
+        self.checkpoints = self._get_checkpoints()
+
+    @classmethod
+    def from_file(cls, isofile):
+        """ Read the implanted checksum from an open ISO.
+
+        Returns None if the image doesn't have one.  Either way, isofile is
+        left at the start of the image.
+        """
+        try:
+            pvd_offset = find_primary_volume_descriptor(isofile)
+            if pvd_offset is None:
+                return None
+            isofile.seek(pvd_offset + VOLUME_SIZE_OFFSET)
+            volume_size = struct.unpack('<I', isofile.read(4))[0] * SECTOR_SIZE
+            isofile.seek(pvd_offset + APPDATA_OFFSET)
+            fields = parse_appdata(isofile.read(APPDATA_SIZE))
+        finally:
+            isofile.seek(0)
+        checksum = fields.get('ISO MD5SUM', '')
+        if not re.match('^[0-9a-fA-F]{32}$', checksum):
+            return None
+        try:
+            skipsectors = int(fields.get('SKIPSECTORS', 0))
+            fragment_count = int(fields.get('FRAGMENT COUNT', 0))
+        except ValueError:
+            return None
+        return cls(pvd_offset, volume_size, checksum, skipsectors,
+                   fields.get('FRAGMENT SUMS', ''), fragment_count)
+
+    def _get_checkpoints(self):
+        """ Return {offset: fragment} of where the fragment sums are checked.
+
+        This follows checkmd5sum() in libcheckisomd5.c of isomd5sum 1.2.3,
+        which implantisomd5 mirrors: the image is read in blocks of
+        min(fragment size, READ_SIZE), where the fragment size is
+        total // (fragment count + 1), and after each block that starts in
+        a new fragment, offset // fragment size, that fragment is checked.
+        On images too small for READ_SIZE, the remainder after the last
+        whole fragment makes for one fragment more than the count, and we
+        check that one too.
+        """
+        checkpoints = {}
+        count = self.fragment_count
+        if not count or self.total <= 0 or \
+                len(self.fragment_sums) < FRAGMENT_SUM_SIZE:
+            return checkpoints
+        fragment_size = self.total // (count + 1)
+        if not fragment_size: # where checkisomd5 would divide by zero
+            return checkpoints
+        step = min(fragment_size, READ_SIZE)
+        for fragment in range(1, self.total // fragment_size + 1):
+            start = -(-fragment * fragment_size // step) * step
+            if start < self.total:
+                checkpoints[min(start + step, self.total)] = fragment
+        return checkpoints
+
+    def _check_fragment(self, fragment):
+        size = FRAGMENT_SUM_SIZE // self.fragment_count
+        digest = bytearray(self.md5.copy().digest())
+        found = ''.join([('%x' % byte)[0] for byte in digest[:size]])
+        start = (fragment - 1) * size
+        if found != self.fragment_sums[start:start + size]:
+            self.failed = True
+
+    def _next_boundary(self, offset):
+        """ The next offset at which we have to stop and do something """
+        boundaries = [self.total]
+        for boundary in (self.appdata_offset,
+                         self.appdata_offset + APPDATA_SIZE):
+            if boundary > offset:
+                boundaries.append(boundary)
+        boundaries.extend([c for c in self.checkpoints if c > offset])
+        return min(boundaries)
+
+    def update(self, data):
+        """ Hash the next chunk of the image """
+        pos = 0
+        end = min(len(data), self.total - self.offset)
+        while pos < end and not self.failed:
+            size = min(self._next_boundary(self.offset) - self.offset,
+                       end - pos)
+            if self.appdata_offset <= self.offset < \
+                    self.appdata_offset + APPDATA_SIZE:
+                self.md5.update(' ' * size)
+            else:
+                self.md5.update(buffer(data, pos, size))
+            pos += size
+            self.offset += size
+            fragment = self.checkpoints.get(self.offset)
+            if fragment:
+                self._check_fragment(fragment)
+
+    def verify(self):
+        """ Return whether the image matched its implanted checksum """
+        if self.failed or self.offset < self.total:
+            return False
+        return self.md5.hexdigest() == self.checksum
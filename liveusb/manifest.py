@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Block manifests of ISO images, and checksum files of written sticks.
+
+A manifest splits an image into fixed-size segments and records the digest
+of each one, the Merkle root of those digests and the digest of the whole
+image.  The segments are hashed from the data of the pass we already make
+over the image to verify it, and the manifest is saved in our cache
+directory, so that a stick or a partially downloaded image can later be
+checked one segment at a time.
+
+The checksums of the files we extract to a stick are kept in a CHECKSUM
+file on the stick itself, in the same format Fedora publishes.
+"""
+
+import logging
+import hashlib
+import json
+import os
+import re
+
+from liveusb.hashcache import file_identity, get_cache_dir
+
+log = logging.getLogger(__name__)
+
+ALGORITHM = 'sha256'
+SEGMENT_SIZE = 32 * 1024**2
+READ_SIZE = 1024**2
+MANIFEST_VERSION = 1
+
+
+def hash_segment(args, callback=None):
+    """ Return the digest of one segment of a file.
+
+    @param args: A (path, offset, size, algorithm) tuple.
+    @param callback: Called with the number of bytes of each read.
+    """
+    path, offset, size, algorithm = args
+    checksum = hashlib.new(algorithm)
+    segment = open(path, 'rb')
+    try:
+        segment.seek(offset)
+        while size > 0:
+            data = segment.read(min(READ_SIZE, size))
+            if not data:
+                break
+            checksum.update(data)
+            size -= len(data)
+            if callback:
+                callback(len(data))
+    finally:
+        segment.close()
+    return checksum.hexdigest()
+
+
+def hash_file(path, algorithm=ALGORITHM, callback=None):
+    """ Return the digest of a whole file, calling callback with the
+    number of bytes of each read.
+    """
+    return hash_segment((path, 0, os.path.getsize(path), algorithm), callback)
+
+
+def write_checksum_file(path, algorithm, checksums):
+    """ Write a list of (name, digest) in the format of Fedora's CHECKSUM
+    files, like `SHA256 (name) = digest`.
+    """
+    out = open(path, 'w')
+    try:
+        for name, digest in checksums:
+            out.write('%s (%s) = %s\n' % (algorithm.upper(), name, digest))
+    finally:
+        out.close()
+
+
+def read_checksum_file(path):
+    """ Return {name: (algorithm, digest)} from a CHECKSUM file """
+    checksums = {}
+    checksum = open(path)
+    try:
+        for line in checksum:
+            match = re.match(r'^(\w+) \(([^)]+)\) = ([a-f0-9]+)$', line.strip())
+            if match:
+                checksums[match.group(2)] = (match.group(1).lower(),
+                                             match.group(3))
+    finally:
+        checksum.close()
+    return checksums
+
+
+def merkle_root(digests, algorithm=ALGORITHM):
+    """ Return the Merkle root of a list of hex digests.
+
+    Pairs of digests are hashed together level by level; an odd digest out
+    is carried up to the next level unchanged.
+    """
+    level = [digest.decode('hex') for digest in digests]
+    if not level:
+        return hashlib.new(algorithm).hexdigest()
+    while len(level) > 1:
+        paired = []
+        for i in range(0, len(level) - 1, 2):
+            paired.append(hashlib.new(algorithm,
+                                      level[i] + level[i + 1]).digest())
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0].encode('hex')
+
+
+def get_manifest_paths(iso):
+    """ Return the places we look for the manifest of an image, in order:
+    our cache directory, where we save them, and next to the image, where
+    one may have been published with it.
+    """
+    key = hashlib.sha1(os.path.abspath(iso)).hexdigest()[:8]
+    return [os.path.join(get_cache_dir(), 'manifests', '%s-%s.manifest' %
+                         (os.path.basename(iso), key)),
+            iso + '.manifest']
+
+
+class Manifest(object):
+    """ The segment digests, Merkle root and whole digest of an image """
+
+    def __init__(self, size, segments, digest=None, algorithm=ALGORITHM,
+                 segment_size=SEGMENT_SIZE, identity=None):
+        self.size = size
+        self.segments = segments
+        self.digest = digest
+        self.algorithm = algorithm
+        self.segment_size = segment_size
+        self.identity = identity or {}
+        self.root = merkle_root(segments, algorithm)
+
+    def segment_range(self, index):
+        """ Return the (offset, size) of a segment """
+        offset = index * self.segment_size
+        return offset, min(self.segment_size, self.size - offset)
+
+    def verify_segment(self, path, index, offset=0):
+        """ Check one segment of the image as found in path.
+
+        @param offset: Where the image starts within path, for checking a
+                       device that the image was written to.
+        """
+        start, size = self.segment_range(index)
+        digest = hash_segment((path, offset + start, size, self.algorithm))
+        return digest == self.segments[index]
+
+    def matches(self, iso):
+        """ Whether this manifest was made from the image as it is now """
+        try:
+            identity = file_identity(iso)
+        except OSError:
+            return False
+        return self.identity.get('size') == identity['size'] and \
+               self.identity.get('mtime') == identity['mtime']
+
+    def to_dict(self):
+        return {'version': MANIFEST_VERSION, 'algorithm': self.algorithm,
+                'segment_size': self.segment_size, 'size': self.size,
+                'digest': self.digest, 'root': self.root,
+                'segments': self.segments, 'identity': self.identity}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get('version') != MANIFEST_VERSION:
+            raise ValueError('Unknown manifest version %r' %
+                             data.get('version'))
+        manifest = cls(data['size'], data['segments'], data['digest'],
+                       data['algorithm'], data['segment_size'],
+                       data.get('identity'))
+        if manifest.root != data['root']:
+            raise ValueError('Manifest root does not match its segments')
+        return manifest
+
+    def save(self, iso):
+        """ Save the manifest of the image in our cache directory.
+        Returns the path written, or None.
+        """
+        path = get_manifest_paths(iso)[0]
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as out:
+                json.dump(self.to_dict(), out, indent=1)
+        except (IOError, OSError), e:
+            log.warning('Unable to save the block manifest of %s: %r' %
+                        (iso, e))
+            return None
+        log.debug('Wrote block manifest %s' % path)
+        return path
+
+    @classmethod
+    def load(cls, iso):
+        """ Return the saved manifest of the image, if it is still valid """
+        for path in get_manifest_paths(iso):
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path) as manifest:
+                    manifest = cls.from_dict(json.load(manifest))
+            except (IOError, ValueError, KeyError), e:
+                log.warning('Ignoring bad manifest %s: %r' % (path, e))
+                continue
+            if manifest.matches(iso):
+                return manifest
+            log.debug('Ignoring stale manifest %s' % path)
+
+
+class SegmentHasher(object):
+    """ Hash the segments of an image from the data of a pass over it.
+
+    Everything read from the image is fed to update() in order, and each
+    segment's digest is finished as the data crosses its end, so the
+    manifest costs no reads of its own.  The digest of the whole image,
+    which the caller is usually calculating anyway, is given to manifest().
+    """
+
+    def __init__(self, iso, algorithm=ALGORITHM, segment_size=SEGMENT_SIZE):
+        self.iso = iso
+        self.algorithm = algorithm
+        self.segment_size = segment_size
+        self.identity = file_identity(iso)
+        self.size = self.identity['size']
+        self.segments = []
+        self.hashed = 0
+        self._segment = hashlib.new(algorithm)
+        self._filled = 0
+
+    def update(self, data):
+        self.hashed += len(data)
+        while data:
+            room = self.segment_size - self._filled
+            if len(data) < room:
+                self._segment.update(data)
+                self._filled += len(data)
+                return
+            self._segment.update(data[:room])
+            self.segments.append(self._segment.hexdigest())
+            self._segment = hashlib.new(self.algorithm)
+            self._filled = 0
+            data = data[room:]
+
+    def manifest(self, digest=None):
+        """ Return the Manifest of the image, once all of it was hashed """
+        if self.hashed != self.size:
+            raise ValueError('Hashed %d of the %d bytes of %s' %
+                             (self.hashed, self.size, self.iso))
+        segments = list(self.segments)
+        if self._filled or not segments:
+            segments.append(self._segment.hexdigest())
+        return Manifest(self.size, segments, digest, self.algorithm,
+                        self.segment_size, self.identity)
+
+
+def make_manifest(iso, algorithm=ALGORITHM, segment_size=SEGMENT_SIZE,
+                  callback=None):
+    """ Read an image just to make its Manifest, for when we have no pass
+    over it to share.
+
+    @param callback: Called with the number of bytes of each read.
+    """
+    segments = SegmentHasher(iso, algorithm, segment_size)
+    whole = hashlib.new(algorithm)
+    image = open(iso, 'rb')
+    try:
+        while True:
+            data = image.read(READ_SIZE)
+            if not data:
+                break
+            segments.update(data)
+            whole.update(data)
+            if callback:
+                callback(len(data))
+    finally:
+        image.close()
+    return segments.manifest(whole.hexdigest())
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Reading and writing the Master Boot Record of a device.
+
+The MBR is the first sector of the device: 440 bytes of boot code, the disk
+signature, four 16 byte partition entries from offset 446, and the 0x55AA
+signature.  syslinux's mbr.bin is a replacement for the boot code only, so
+writing it leaves the partition table alone.
+"""
+
+import struct
+import os
+import re
+
+from collections import namedtuple
+
+SECTOR_SIZE = 512
+BOOT_CODE_SIZE = 440
+PARTITION_TABLE_OFFSET = 446
+PARTITION_ENTRY_SIZE = 16
+PARTITION_COUNT = 4
+SIGNATURE = '\x55\xaa'
+ACTIVE = 0x80
+GPT_PROTECTIVE = 0xee
+
+Partition = namedtuple('Partition', ['number', 'active', 'type', 'start',
+                                     'sectors'])
+
+
+def get_partition_number(device, parent):
+    """ Return the number of a partition device on its parent, like 1 for
+    /dev/sdb1 on /dev/sdb or /dev/mmcblk0p1 on /dev/mmcblk0, or None.
+    """
+    if not device.startswith(parent):
+        return None
+    match = re.match(r'^p?(\d+)$', device[len(parent):])
+    return match and int(match.group(1)) or None
+
+
+class MBR(object):
+    """ A parsed copy of the first sector of a device """
+
+    def __init__(self, sector):
+        if len(sector) < SECTOR_SIZE:
+            sector = sector + '\0' * (SECTOR_SIZE - len(sector))
+        self.sector = sector[:SECTOR_SIZE]
+
+    @classmethod
+    def read(cls, device):
+        dev = open(device, 'rb')
+        try:
+            return cls(dev.read(SECTOR_SIZE))
+        finally:
+            dev.close()
+
+    @property
+    def boot_code(self):
+        return self.sector[:BOOT_CODE_SIZE]
+
+    @property
+    def valid(self):
+        return self.sector[510:512] == SIGNATURE
+
+    @property
+    def blank(self):
+        """ Whether there is no boot code at all """
+        return self.sector[:2] == '\0\0'
+
+    @property
+    def gpt(self):
+        """ Whether this is the protective MBR of a GPT disk """
+        return any([p.type == GPT_PROTECTIVE for p in self.partitions])
+
+    @property
+    def partitions(self):
+        """ The partitions in the table, numbered from 1, without the
+        unused entries.
+        """
+        partitions = []
+        for i in range(PARTITION_COUNT):
+            offset = PARTITION_TABLE_OFFSET + i * PARTITION_ENTRY_SIZE
+            entry = self.sector[offset:offset + PARTITION_ENTRY_SIZE]
+            status, type = ord(entry[0]), ord(entry[4])
+            start, sectors = struct.unpack('<II', entry[8:16])
+            if type:
+                partitions.append(Partition(i + 1, status == ACTIVE, type,
+                                            start, sectors))
+        return partitions
+
+    def get_partition(self, number):
+        for partition in self.partitions:
+            if partition.number == number:
+                return partition
+
+    def has_boot_code(self, boot_code):
+        """ Whether our boot code starts with the given boot code """
+        boot_code = boot_code[:BOOT_CODE_SIZE]
+        return self.sector[:len(boot_code)] == boot_code
+
+    def updated(self, boot_code=None, active=None):
+        """ Return a copy with new boot code and/or the given partition
+        number as the only active one.
+        """
+        sector = bytearray(self.sector)
+        if boot_code is not None:
+            boot_code = boot_code[:BOOT_CODE_SIZE]
+            sector[:len(boot_code)] = boot_code
+        if active is not None:
+            for i in range(PARTITION_COUNT):
+                offset = PARTITION_TABLE_OFFSET + i * PARTITION_ENTRY_SIZE
+                sector[offset] = i + 1 == active and ACTIVE or 0
+        return MBR(str(sector))
+
+    def write(self, device):
+        """ Write the sector back to the device, in one aligned write """
+        fd = os.open(device, os.O_WRONLY)
+        try:
+            if os.write(fd, self.sector) != SECTOR_SIZE:
+                raise IOError('Short write of the MBR of %s' % device)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Progress reporting for the stages of writing an image.
+
+Instead of guessing from the free space left on the device, each stage of
+the write (verifying the image, copying it, creating the overlay, installing
+the bootloader, reading it back) reports the bytes it has actually handled.
+The stages are weighted by how much work they are expected to be, so a
+single overall progress, rate and ETA can be given for the whole write.
+
+Each stage is an object with the set_max_progress/update_progress methods
+the creator already takes as its `progress` argument.  The work happens on
+another thread than the GUI, so the GUI samples snapshot() on a timer rather
+than redrawing on every update.
+"""
+
+import threading
+import sys
+
+from collections import namedtuple
+
+if sys.platform == 'win32':
+    from liveusb.urlgrabber.progress import RateEstimator
+else:
+    from urlgrabber.progress import RateEstimator
+
+ProgressEvent = namedtuple('ProgressEvent', ['stage', 'value', 'maximum',
+                                             'done', 'total', 'rate', 'eta'])
+
+
+class Stage(object):
+    """ The progress of one stage, in the units of its caller """
+
+    def __init__(self, bus, name, weight):
+        self.bus = bus
+        self.name = name
+        self.weight = weight
+        self.value = 0
+        self.maximum = 0
+
+    @property
+    def fraction(self):
+        if not self.maximum:
+            return 0.0
+        return min(1.0, float(self.value) / self.maximum)
+
+    def set_max_progress(self, maximum):
+        self.bus._update(self, maximum=maximum)
+
+    def update_progress(self, value):
+        self.bus._update(self, value=value)
+
+    def finish(self):
+        """ Mark the stage as done, even if it didn't report everything """
+        maximum = self.maximum or 1
+        self.bus._update(self, value=maximum, maximum=maximum)
+
+
+class ProgressBus(object):
+    """ The overall progress of a list of weighted stages.
+
+    Weights are in bytes, so the rate is in bytes per second, and stages
+    that are skipped can simply be left out.  Listeners are called from
+    whichever thread is doing the work, with a ProgressEvent, on every
+    update.
+    """
+
+    def __init__(self, stages, timescale=5.0):
+        self.lock = threading.Lock()
+        self.stages = [Stage(self, name, weight) for name, weight in stages]
+        self.total = sum([stage.weight for stage in self.stages])
+        self.current = None
+        self.listeners = []
+        self.rate = RateEstimator(timescale)
+        self.rate.start(self.total)
+
+    def stage(self, name):
+        """ Return the stage called name, to be passed as `progress` """
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(name)
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    @property
+    def done(self):
+        return sum([stage.weight * stage.fraction for stage in self.stages])
+
+    def _update(self, stage, value=None, maximum=None):
+        with self.lock:
+            if maximum is not None:
+                stage.maximum = maximum
+            if value is not None:
+                stage.value = value
+            self.current = stage
+            done = self.done
+            self.rate.update(done)
+            event = ProgressEvent(stage.name, stage.value, stage.maximum,
+                                  done, self.total, self.rate.average_rate(),
+                                  self.rate.remaining_time())
+        for listener in self.listeners:
+            listener(event)
+
+    def snapshot(self):
+        """ Return a ProgressEvent of where we are now """
+        with self.lock:
+            stage = self.current
+            return ProgressEvent(stage and stage.name, stage and stage.value,
+                                 stage and stage.maximum, self.done,
+                                 self.total, self.rate.average_rate(),
+                                 self.rate.remaining_time())
+
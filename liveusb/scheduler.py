@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Scheduling writes to many drives by where they are plugged in.
+
+Every stick behind the same USB hub, and every hub on the same root
+controller, shares that hub's or controller's bandwidth, so writing to all
+of them at once only makes each of them slower.  The WriteScheduler groups
+the drives by the USB port they hang off, like `2-1.4`: port 4 of the hub on
+port 1 of bus 2.  That one is in the group of controller `2` and of hub
+`2-1`.  Each group runs at most `cap` writes at once, and the next queued
+write starts as soon as a slot is free.
+
+The caps start low and follow the throughput we measure: when a group's
+total rate was best at its current cap, one more write is tried at once,
+and when it was better with fewer, the cap comes back down.
+"""
+
+import threading
+import logging
+import time
+
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+DEFAULT_HUB_CAP = 2
+DEFAULT_CONTROLLER_CAP = 4
+MAX_CAP = 16
+SAMPLES = 4         # rates to remember for each concurrency of a group
+
+
+def get_port_groups(port):
+    """ Return the groups a USB port belongs to, the controller first and
+    then the hub, if it is on one.  `2-1.4` is in ['2', '2-1'], while `2-3`
+    is straight on the root hub of controller 2, so only in ['2'].
+    """
+    if not port or '-' not in port:
+        return []
+    bus, path = port.split('-', 1)
+    groups = [bus]
+    if '.' in path:
+        groups.append('%s-%s' % (bus, path.rsplit('.', 1)[0]))
+    return groups
+
+
+class WriteCancelled(Exception):
+    """ The scheduler was cancelled before this write could start """
+    pass
+
+
+class Group(object):
+    """ The drives behind one controller or hub """
+
+    def __init__(self, name, cap):
+        self.name = name
+        self.cap = cap
+        self.running = 0
+        self.rates = {}     # {concurrency: deque of total bytes per second}
+
+    def record(self, concurrency, rate):
+        """ Remember how fast a write went, with how many running at once,
+        and move the cap towards the concurrency that did best.
+        """
+        samples = self.rates.setdefault(concurrency, deque(maxlen=SAMPLES))
+        samples.append(rate * concurrency)
+        totals = dict([(level, sum(rates) / len(rates))
+                       for level, rates in self.rates.items()])
+        best = max(totals, key=totals.get)
+        if self.cap in totals and best < self.cap:
+            self.cap = best
+        elif best >= self.cap and len(self.rates[best]) > 1 and \
+                self.cap + 1 not in totals and self.cap < MAX_CAP:
+            # try one more at once, once we're sure this many is our best
+            self.cap += 1
+        log.debug('%s: %.1f MB/s at %d at once, cap now %d' % (
+                  self.name, totals[concurrency] / 1024**2, concurrency,
+                  self.cap))
+
+
+class Job(object):
+
+    def __init__(self, key, port, func):
+        self.key = key
+        self.port = port
+        self.func = func
+        self.groups = []
+        self.concurrency = {}   # {group name: writes running at the start}
+        self.error = None
+        self.result = None
+
+
+class WriteScheduler(object):
+    """ Run a write for each drive, as many at once as their controllers
+    and hubs can take.
+
+    @param hub_cap: How many writes to start with behind a hub.
+    @param controller_cap: How many writes to start with on a controller.
+    @param adaptive: Whether to adjust the caps to the rates we measure.
+    """
+
+    def __init__(self, hub_cap=DEFAULT_HUB_CAP,
+                 controller_cap=DEFAULT_CONTROLLER_CAP, adaptive=True):
+        self.hub_cap = hub_cap
+        self.controller_cap = controller_cap
+        self.adaptive = adaptive
+        self.groups = {}
+        self.queue = deque()
+        self.jobs = []
+        self.cancelled = False
+        self._running = 0
+        self._cond = threading.Condition()
+
+    def _get_group(self, name):
+        if name not in self.groups:
+            cap = '-' in name and self.hub_cap or self.controller_cap
+            self.groups[name] = Group(name, cap)
+        return self.groups[name]
+
+    def submit(self, key, port, func):
+        """ Queue func() to be run for the drive key on the given USB port.
+
+        func should return the number of bytes it wrote, so we can tell how
+        fast it went.  Drives we don't know the port of aren't held back.
+        """
+        job = Job(key, port, func)
+        job.groups = [self._get_group(name) for name in get_port_groups(port)]
+        with self._cond:
+            self.queue.append(job)
+            self.jobs.append(job)
+            self._cond.notify_all()
+        return job
+
+    def cancel(self):
+        """ Drop the writes that haven't started yet """
+        with self._cond:
+            self.cancelled = True
+            for job in self.queue:
+                job.error = WriteCancelled(job.key)
+            self.queue.clear()
+            self._cond.notify_all()
+
+    def _can_start(self, job):
+        return all([group.running < group.cap for group in job.groups])
+
+    def _start_ready(self):
+        """ Start every queued job that has a free slot, in order """
+        for job in list(self.queue):
+            if not self._can_start(job):
+                continue
+            self.queue.remove(job)
+            for group in job.groups:
+                group.running += 1
+                job.concurrency[group.name] = group.running
+            thread = threading.Thread(target=self._run, args=(job,),
+                                      name='write-%s' % job.key)
+            thread.daemon = True
+            self._running += 1
+            thread.start()
+
+    def _run(self, job):
+        start = time.time()
+        try:
+            job.result = job.func()
+        except Exception, e:
+            log.debug('Writing to %s failed: %r' % (job.key, e))
+            job.error = e
+        elapsed = time.time() - start
+        with self._cond:
+            for group in job.groups:
+                group.running -= 1
+                if self.adaptive and not job.error and job.result and \
+                        elapsed > 0:
+                    group.record(job.concurrency[group.name],
+                                 job.result / elapsed)
+            self._running -= 1
+            self._cond.notify_all()
+
+    def run(self):
+        """ Run every queued write, returning once they have all finished """
+        with self._cond:
+            while self.queue or self._running:
+                self._start_ready()
+                self._cond.wait(1)
+        return dict([(job.key, job.error) for job in self.jobs])
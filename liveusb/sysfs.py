@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+Removable drive detection straight from sysfs, for hosts without UDisks2.
+
+The disks come from /sys/block, their partitions from the subdirectories
+that have a `partition` file, and the filesystem on each partition from its
+superblock, much like blkid does it.  Only the filesystems we can write to
+are probed: FAT and ext2/3/4.  Hotplug is watched with a netlink socket
+listening for the kernel's uevents, so udevd doesn't need to be running.
+
+Everything is read relative to a root directory, so a fake sysfs tree can
+stand in for the real one.
+"""
+
+import threading
+import logging
+import struct
+import socket
+import errno
+import uuid
+import os
+import re
+
+log = logging.getLogger(__name__)
+
+SECTOR_SIZE = 512           # the unit of the size files in sysfs
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_BUFFER_SIZE = 64 * 1024
+
+EXT_SUPERBLOCK = 1024
+EXT_MAGIC = 0xEF53
+EXT3_FEATURE_COMPAT_HAS_JOURNAL = 0x0004
+EXT4_FEATURE_INCOMPAT = 0x0040 | 0x0080 | 0x0200 # extents, 64bit, flex_bg
+
+
+def read_attribute(path, default=None):
+    """ Return the stripped contents of a sysfs attribute """
+    try:
+        with open(path) as attribute:
+            return attribute.read().strip()
+    except (IOError, OSError):
+        return default
+
+
+def probe_fat(boot):
+    """ Return (fstype, version, label, uuid) from a FAT boot sector """
+    if len(boot) < 512 or boot[510:512] != '\x55\xaa':
+        return None
+    if boot[82:87] == 'FAT32':
+        version = 'FAT32'
+        serial, label = boot[67:71], boot[71:82]
+    elif boot[54:59] in ('FAT12', 'FAT16'):
+        version = boot[54:59]
+        serial, label = boot[39:43], boot[43:54]
+    else:
+        return None
+    serial = '%08X' % struct.unpack('<I', serial)[0]
+    label = label.rstrip(' \0')
+    if label == 'NO NAME':
+        label = ''
+    return 'vfat', version, label, '%s-%s' % (serial[:4], serial[4:])
+
+
+def probe_ext(superblock):
+    """ Return (fstype, version, label, uuid) from an ext2/3/4 superblock """
+    if len(superblock) < 136 or \
+            struct.unpack('<H', superblock[56:58])[0] != EXT_MAGIC:
+        return None
+    rev_level = struct.unpack('<I', superblock[76:80])[0]
+    compat, incompat = struct.unpack('<II', superblock[92:100])
+    if incompat & EXT4_FEATURE_INCOMPAT:
+        fstype = 'ext4'
+    elif compat & EXT3_FEATURE_COMPAT_HAS_JOURNAL:
+        fstype = 'ext3'
+    else:
+        fstype = 'ext2'
+    return (fstype, '1.0' if rev_level else '0.0',
+            superblock[120:136].rstrip('\0'),
+            str(uuid.UUID(bytes=superblock[104:120])))
+
+
+def probe_filesystem(device):
+    """ Return (fstype, version, label, uuid) of the filesystem on a device,
+    or None if it isn't one we know.
+    """
+    try:
+        with open(device, 'rb') as dev:
+            head = dev.read(EXT_SUPERBLOCK + 1024)
+    except (IOError, OSError), e:
+        log.debug('Unable to probe %s: %r' % (device, e))
+        return None
+    return probe_fat(head[:512]) or probe_ext(head[EXT_SUPERBLOCK:])
+
+
+def read_mounts(path='/proc/mounts'):
+    """ Return {device: [mount points]} """
+    mounts = {}
+    for line in (read_attribute(path) or '').splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        unescape = lambda s: re.sub(r'\\([0-7]{3})',
+                                    lambda m: chr(int(m.group(1), 8)), s)
+        mounts.setdefault(unescape(fields[0]), []).append(unescape(fields[1]))
+    return mounts
+
+
+def get_usb_port(syspath):
+    """ Return the USB port a device hangs off, like `2-1.4`, or None.
+
+    It is the last bus-port component of the device's resolved sysfs path,
+    e.g. .../usb2/2-1/2-1.4/2-1.4:1.0/host6/... gives 2-1.4.
+    """
+    ports = re.findall(r'/(\d+-[\d.]+)(?=/)', syspath)
+    return ports and ports[-1] or None
+
+
+def get_device_port(device, root='/'):
+    """ Return the USB port of a block device like /dev/sdb, or None """
+    syspath = os.path.join(root, 'sys', 'class', 'block',
+                           os.path.basename(device))
+    return get_usb_port(os.path.realpath(syspath))
+
+
+class SysfsDevices(object):
+    """ The removable disks and partitions in a sysfs tree """
+
+    def __init__(self, root='/', mounts=None):
+        self.root = root
+        self.mounts = mounts or os.path.join(root, 'proc', 'mounts')
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def get_disks(self):
+        """ Return the names of the removable USB and SD card disks """
+        disks = []
+        block = self._path('sys', 'block')
+        for disk in sorted(os.listdir(block)):
+            if read_attribute(os.path.join(block, disk, 'removable')) != '1':
+                continue
+            syspath = os.path.realpath(os.path.join(block, disk))
+            if '/usb' not in syspath and '/mmc' not in syspath:
+                log.debug('Skipping %s, which is not on USB or SDIO' % disk)
+                continue
+            disks.append(disk)
+        return disks
+
+    def get_partitions(self, disk):
+        diskpath = self._path('sys', 'block', disk)
+        return [name for name in sorted(os.listdir(diskpath))
+                if os.path.exists(os.path.join(diskpath, name, 'partition'))]
+
+    def scan(self):
+        """ Return {device: record} of the partitions on removable disks.
+
+        The records have the same keys as the ones the UDisks2 backend
+        puts in LiveUSBCreator.drives, with the mount points as a list.
+        """
+        mounts = read_mounts(self.mounts)
+        drives = {}
+        for disk in self.get_disks():
+            diskpath = self._path('sys', 'block', disk)
+            vendor = read_attribute(os.path.join(diskpath, 'device', 'vendor'), '')
+            model = read_attribute(os.path.join(diskpath, 'device', 'model'), '')
+            port = get_usb_port(os.path.realpath(diskpath))
+            for part in self.get_partitions(disk):
+                device = '/dev/' + part
+                fs = probe_filesystem(self._path('dev', part))
+                fstype, fsversion, label, fsuuid = fs or ('', '', '', '')
+                size = read_attribute(os.path.join(diskpath, part, 'size'), 0)
+                drives[device] = {
+                    'udi': diskpath,
+                    'label': label,
+                    'fstype': fstype,
+                    'fsversion': fsversion,
+                    'uuid': fsuuid,
+                    'device': device,
+                    'mount': mounts.get(device, []),
+                    'size': int(size) * SECTOR_SIZE,
+                    'friendlyName': (vendor + ' ' + model).strip(),
+                    'parent': '/dev/' + disk,
+                    'port': port,
+                }
+        return drives
+
+
+def parse_uevent(message):
+    """ Return (action, {key: value}) from a kernel uevent message """
+    fields = message.split('\0')
+    header = fields[0]
+    if '@' not in header:
+        return None, {}
+    env = {}
+    for field in fields[1:]:
+        if '=' in field:
+            key, value = field.split('=', 1)
+            env[key] = value
+    return header.split('@', 1)[0], env
+
+
+class UeventMonitor(threading.Thread):
+    """ Call a function for every block device the kernel adds, changes or
+    removes, with the action and the uevent's environment.
+    """
+
+    def __init__(self, callback):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.callback = callback
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                                    NETLINK_KOBJECT_UEVENT)
+        # group 1 is the kernel's own broadcasts, not udevd's
+        self.socket.bind((0, 1))
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                message = self.socket.recv(UEVENT_BUFFER_SIZE)
+            except socket.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                if self.running:
+                    log.error('Lost the uevent socket: %r' % e)
+                break
+            action, env = parse_uevent(message)
+            if action and env.get('SUBSYSTEM') == 'block':
+                try:
+                    self.callback(action, env)
+                except Exception, e:
+                    log.exception(e)
+
+    def stop(self):
+        self.running = False
+        self.socket.close()
@@ -0,0 +1,904 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2008-2015  Red Hat, Inc. All rights reserved.
+#
+# This copyrighted material is made available to anyone wishing to use, modify,
+# copy, or redistribute it subject to the terms and conditions of the GNU
+# General Public License v.2.  This program is distributed in the hope that it
+# will be useful, but WITHOUT ANY WARRANTY expressed or implied, including the
+# implied warranties of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.  You should have
+# received a copy of the GNU General Public License along with this program; if
+# not, write to the Free Software Foundation, Inc., 51 Franklin Street, Fifth
+# Floor, Boston, MA 02110-1301, USA. Any Red Hat trademarks that are
+# incorporated in the source code or documentation are not subject to the GNU
+# General Public License and may only be used or replicated with the express
+# permission of Red Hat, Inc.
+
+"""
+An in-process copy engine.
+
+This replaces the `cp` subprocesses we used to spawn while extracting the
+live image.  Data is moved through a small pool of large, page-aligned
+buffers: a reader thread fills them from the source while a writer thread
+drains them to the destination, so reads and writes overlap.  Every write is
+reported to a callback with the exact number of bytes copied so far, and a
+transfer can be cancelled at any time from another thread.
+
+When copying between two files on Linux, the kernel can move the data
+itself without it ever passing through our buffers.  The copier tries
+copy_file_range(2) first, then sendfile(2), then splice(2) through a pipe,
+and remembers which of them works for each pair of filesystems, falling back
+to the buffered threads if none do.
+
+The ImageWriter does the job of `dd ... oflag=direct conv=fdatasync` for
+destructive installs, writing a raw image straight to a block device.  The
+FanOutWriter does the same for many devices at once, from a single read of
+the image.
+"""
+
+import ctypes.util
+import threading
+import hashlib
+import logging
+import ctypes
+import errno
+import Queue
+import struct
+import stat
+import time
+import mmap
+import sys
+import io
+import os
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+ALIGNMENT = mmap.PAGESIZE
+DEFAULT_BUFFER_SIZE = 4 * 1024**2
+DEFAULT_BUFFER_COUNT = 2
+DEFAULT_BLOCK_SIZE = 1024**2
+DEFAULT_FANOUT_LAG = 64     # blocks the targets of a fan-out may drift apart
+SECTOR_SIZE = 4096          # the largest in use, when a device won't say
+O_DIRECT = getattr(os, 'O_DIRECT', 0)
+ZEROCOPY = sys.platform.startswith('linux') # whether to try the kernel paths
+ZEROCOPY_CHUNK = 16 * 1024**2
+
+MODE_AUTO = 'auto'
+MODE_COPY_FILE_RANGE = 'copy_file_range'
+MODE_SENDFILE = 'sendfile'
+MODE_SPLICE = 'splice'
+MODE_BUFFERED = 'buffered'
+KERNEL_MODES = (MODE_COPY_FILE_RANGE, MODE_SENDFILE, MODE_SPLICE)
+
+# Errors that mean a kernel copy path can't handle this pair of files
+UNSUPPORTED_ERRNOS = set([errno.ENOSYS, errno.EXDEV, errno.EINVAL,
+                          errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF])
+
+SPLICE_F_MOVE = 1
+SPLICE_F_MORE = 4
+F_SETPIPE_SZ = 1031
+BLKSSZGET = 0x1268
+
+
+class TransferCancelled(Exception):
+    """ Raised when a transfer is cancelled before it has completed """
+    def __init__(self, message="Transfer cancelled"):
+        Exception.__init__(self, message)
+
+
+def align(size, alignment=ALIGNMENT):
+    """ Round size up to the next multiple of alignment """
+    return max(alignment, (size + alignment - 1) // alignment * alignment)
+
+
+def window(buf, size):
+    """ Return a writable view of the first size bytes of buf """
+    return (ctypes.c_char * size).from_buffer(buf)
+
+
+def get_sector_size(fd):
+    """ Return the logical block size of the device open as fd, which
+    O_DIRECT reads and writes must be a multiple of.
+    """
+    if fcntl and stat.S_ISBLK(os.fstat(fd).st_mode):
+        try:
+            return struct.unpack('i', fcntl.ioctl(fd, BLKSSZGET,
+                                                  struct.pack('i', 0)))[0]
+        except IOError, e:
+            log.debug('Unable to get the logical block size: %r' % e)
+    return SECTOR_SIZE
+
+
+class ZeroCopyUnsupported(Exception):
+    """ Raised when a kernel copy path cannot be used for a pair of files """
+
+
+_libc = None
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        for name, argtypes in (
+                ('copy_file_range', [ctypes.c_int, ctypes.c_void_p,
+                                     ctypes.c_int, ctypes.c_void_p,
+                                     ctypes.c_size_t, ctypes.c_uint]),
+                ('sendfile', [ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+                              ctypes.c_size_t]),
+                ('splice', [ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                            ctypes.c_void_p, ctypes.c_size_t,
+                            ctypes.c_uint])):
+            func = getattr(_libc, name, None)
+            if func is not None:
+                func.argtypes = argtypes
+                func.restype = ctypes.c_ssize_t
+    return _libc
+
+
+def _syscall(name, *args):
+    """ Call a libc function, raising OSError on failure """
+    func = getattr(_get_libc(), name, None)
+    if func is None:
+        raise OSError(errno.ENOSYS, '%s is not available' % name)
+    result = func(*args)
+    if result < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return result
+
+
+def copy_file_range(src_fd, dst_fd, count, pipe=None):
+    if hasattr(os, 'copy_file_range'):
+        return os.copy_file_range(src_fd, dst_fd, count)
+    return _syscall('copy_file_range', src_fd, None, dst_fd, None, count, 0)
+
+
+def sendfile(src_fd, dst_fd, count, pipe=None):
+    if hasattr(os, 'sendfile'):
+        return os.sendfile(dst_fd, src_fd, None, count)
+    return _syscall('sendfile', dst_fd, src_fd, None, count)
+
+
+def splice(src_fd, dst_fd, count, pipe):
+    """ Move up to count bytes from src_fd to dst_fd through a pipe """
+    read_end, write_end = pipe
+    flags = SPLICE_F_MOVE | SPLICE_F_MORE
+    count = _syscall('splice', src_fd, None, write_end, None, count, flags)
+    moved = 0
+    while moved < count:
+        moved += _syscall('splice', read_end, None, dst_fd, None,
+                          count - moved, flags)
+    return count
+
+
+TRANSFER_FUNCS = {
+    MODE_COPY_FILE_RANGE: copy_file_range,
+    MODE_SENDFILE: sendfile,
+    MODE_SPLICE: splice,
+}
+
+
+class BufferPool(object):
+    """ A fixed set of reusable, page-aligned buffers.
+
+    Anonymous memory maps are always page-aligned, which is what O_DIRECT
+    needs, and they are allocated once per pool instead of once per read.
+    """
+
+    def __init__(self, count=DEFAULT_BUFFER_COUNT, size=DEFAULT_BUFFER_SIZE):
+        self.size = align(size)
+        self.buffers = [mmap.mmap(-1, self.size) for i in range(count)]
+        self.free = Queue.Queue()
+        for buf in self.buffers:
+            self.free.put(buf)
+
+    def get(self, timeout=None):
+        return self.free.get(timeout=timeout)
+
+    def put(self, buf):
+        self.free.put(buf)
+
+    def close(self):
+        for buf in self.buffers:
+            buf.close()
+        self.buffers = []
+
+
+class StreamCopier(object):
+    """ Copy files with double-buffered reads and writes.
+
+    @param buffer_size: The size of each buffer, rounded up to the page size.
+    @param buffers: How many buffers may be in flight at once.
+    @param callback: Called with the total number of bytes copied by this
+                     copier after every write.
+    @param mode: MODE_AUTO to try the kernel copy paths before falling back
+                 to our own buffers, or one of the MODE_* constants to force
+                 a particular path.
+    @param algorithm: If set, every file copied is hashed with it as it is
+                      read, and the digests kept in self.checksums by
+                      destination path.  The kernel copy paths never show
+                      us the data, so those copies always use our buffers.
+    """
+
+    poll_interval = 0.5 # how often blocked threads check for cancellation
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE,
+                 buffers=DEFAULT_BUFFER_COUNT, callback=None, mode=MODE_AUTO,
+                 algorithm=None):
+        self.buffer_size = align(buffer_size)
+        self.buffer_count = max(2, buffers)
+        self.callback = callback
+        self.mode = mode
+        self.modes = {} # {(src st_dev, dst st_dev): mode that works}
+        self.algorithm = algorithm
+        self.checksums = {} # {dst: hexdigest}, if we have an algorithm
+        self.copied = 0
+        self._pool = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """ Abort the transfer in progress, and any that follow """
+        self._cancelled.set()
+
+    def close(self):
+        """ Release our buffers """
+        if self._pool:
+            self._pool.close()
+            self._pool = None
+
+    def _get_pool(self):
+        if not self._pool:
+            self._pool = BufferPool(self.buffer_count, self.buffer_size)
+        return self._pool
+
+    def _wait(self, get):
+        """ Block on get() until it succeeds, or until we are cancelled """
+        while not self.cancelled:
+            try:
+                return get(timeout=self.poll_interval)
+            except Queue.Empty:
+                continue
+        raise TransferCancelled()
+
+    def _report(self, count):
+        self.copied += count
+        if self.callback:
+            self.callback(self.copied)
+
+    def _write_buffer(self, dst, buf, count):
+        """ Write the first count bytes of buf to dst """
+        offset = 0
+        while offset < count:
+            offset += dst.write(buffer(buf, offset, count - offset))
+
+    def copy_stream(self, src, dst, length=None, hashes=()):
+        """ Copy from one open io.FileIO object to another.
+
+        @param length: The maximum number of bytes to copy, or None to copy
+                       until the end of the source.
+        @param hashes: hashlib objects to update with the data as it is read,
+                       so the source never needs a separate checksum pass.
+        @return: The number of bytes copied.
+        """
+        if self.cancelled:
+            raise TransferCancelled()
+        pool = self._get_pool()
+        filled = Queue.Queue()
+        errors = []
+        result = [0]
+
+        def reader():
+            remaining = length
+            try:
+                while remaining is None or remaining > 0:
+                    buf = self._wait(pool.get)
+                    size = pool.size
+                    if remaining is not None:
+                        size = min(size, remaining)
+                    if size == pool.size:
+                        count = src.readinto(buf)
+                    else:
+                        count = src.readinto(window(buf, size))
+                    if not count:
+                        pool.put(buf)
+                        break
+                    for checksum in hashes:
+                        checksum.update(buffer(buf, 0, count))
+                    filled.put((buf, count))
+                    if remaining is not None:
+                        remaining -= count
+            except Exception:
+                errors.append(sys.exc_info())
+                self.cancel()
+            filled.put((None, 0))
+
+        def writer():
+            try:
+                while True:
+                    buf, count = self._wait(filled.get)
+                    if buf is None:
+                        break
+                    self._write_buffer(dst, buf, count)
+                    pool.put(buf)
+                    result[0] += count
+                    self._report(count)
+            except Exception:
+                errors.append(sys.exc_info())
+                self.cancel()
+
+        threads = [threading.Thread(target=reader, name='copy-reader'),
+                   threading.Thread(target=writer, name='copy-writer')]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Return any buffers still held in the queue so the pool stays whole
+        while not filled.empty():
+            buf, count = filled.get_nowait()
+            if buf is not None:
+                pool.put(buf)
+
+        if errors:
+            exc_type, exc_value, exc_tb = errors[0]
+            raise exc_type, exc_value, exc_tb
+        return result[0]
+
+    def _candidate_modes(self, src_fd, dst_fd):
+        """ Return the key for this pair of files and the paths to try """
+        if self.mode == MODE_BUFFERED or not ZEROCOPY:
+            return None, []
+        if self.mode != MODE_AUTO:
+            return None, [self.mode]
+        key = (os.fstat(src_fd).st_dev, os.fstat(dst_fd).st_dev)
+        known = self.modes.get(key)
+        if known == MODE_BUFFERED:
+            return key, []
+        if known:
+            return key, KERNEL_MODES[KERNEL_MODES.index(known):]
+        return key, KERNEL_MODES
+
+    def _tell(self, src_fd, dst_fd):
+        """ Return where the two files are, or None if we can't seek them """
+        try:
+            return (os.lseek(src_fd, 0, os.SEEK_CUR),
+                    os.lseek(dst_fd, 0, os.SEEK_CUR))
+        except OSError:
+            return None
+
+    def _rewind(self, src_fd, dst_fd, start, error):
+        """ Put both files back where a kernel copy that turned out to be
+        unsupported started, so that the next path copies everything.
+
+        A splice can fail moving the data from the pipe to dst_fd after
+        having already taken it from src_fd, and may have written some of it.
+
+        @raise OSError: error, if we can't seek the files back.
+        """
+        if start is None:
+            raise error
+        src_start, dst_start = start
+        if os.lseek(src_fd, 0, os.SEEK_CUR) == src_start and \
+                os.lseek(dst_fd, 0, os.SEEK_CUR) == dst_start:
+            return
+        os.lseek(src_fd, src_start, os.SEEK_SET)
+        os.lseek(dst_fd, dst_start, os.SEEK_SET)
+        if stat.S_ISREG(os.fstat(dst_fd).st_mode):
+            os.ftruncate(dst_fd, dst_start)
+
+    def _kernel_copy(self, mode, src_fd, dst_fd):
+        """ Copy src_fd to dst_fd entirely within the kernel """
+        func = TRANSFER_FUNCS[mode]
+        start = self._tell(src_fd, dst_fd)
+        pipe = None
+        total = 0
+        try:
+            if mode == MODE_SPLICE:
+                pipe = os.pipe()
+                try:
+                    fcntl.fcntl(pipe[1], F_SETPIPE_SZ, 1024**2)
+                except IOError:
+                    pass
+            while True:
+                if self.cancelled:
+                    raise TransferCancelled()
+                try:
+                    count = func(src_fd, dst_fd, ZEROCOPY_CHUNK, pipe)
+                except OSError, e:
+                    if not total and e.errno in UNSUPPORTED_ERRNOS:
+                        self._rewind(src_fd, dst_fd, start, e)
+                        raise ZeroCopyUnsupported(e)
+                    raise
+                if not count:
+                    # Some filesystems return 0 instead of an error
+                    if not total and os.fstat(src_fd).st_size:
+                        raise ZeroCopyUnsupported('no data transferred')
+                    break
+                total += count
+                self._report(count)
+        finally:
+            if pipe:
+                map(os.close, pipe)
+        return total
+
+    def copy_kernel(self, src, dst):
+        """ Try to copy between two open files without using our buffers.
+
+        @return: The number of bytes copied, or None if no kernel copy path
+                 supports this pair of files.
+        """
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        key, modes = self._candidate_modes(src_fd, dst_fd)
+        for mode in modes:
+            try:
+                count = self._kernel_copy(mode, src_fd, dst_fd)
+            except ZeroCopyUnsupported, e:
+                log.debug('Unable to use %s for %s: %s' % (mode, dst.name, e))
+                continue
+            if key and self.modes.get(key) != mode:
+                log.info('Using %s to copy from device %d to device %d' % (
+                         mode, key[0], key[1]))
+                self.modes[key] = mode
+            return count
+        if key and self.modes.get(key) != MODE_BUFFERED:
+            log.info('Using buffered copies from device %d to device %d' % key)
+            self.modes[key] = MODE_BUFFERED
+        return None
+
+    def copy_file(self, src, dst):
+        """ Copy the contents of the file src to dst, like `cp src dst` """
+        if os.path.isdir(dst):
+            dst = os.path.join(dst, os.path.basename(src))
+        log.debug('Copying %s to %s' % (src, dst))
+        with io.FileIO(src, 'rb') as infile:
+            with io.FileIO(dst, 'wb') as outfile:
+                if self.algorithm:
+                    checksum = hashlib.new(self.algorithm)
+                    count = self.copy_stream(infile, outfile,
+                                             hashes=[checksum])
+                    self.checksums[dst] = checksum.hexdigest()
+                    return count
+                count = self.copy_kernel(infile, outfile)
+                if count is None:
+                    count = self.copy_stream(infile, outfile)
+                return count
+
+    def copy_tree(self, src, dst):
+        """ Copy the contents of the directory src into dst, like
+        `cp -r src/* dst`.
+        """
+        total = 0
+        if not os.path.isdir(dst):
+            os.mkdir(dst)
+        for name in sorted(os.listdir(src)):
+            srcpath = os.path.join(src, name)
+            dstpath = os.path.join(dst, name)
+            if os.path.isdir(srcpath):
+                total += self.copy_tree(srcpath, dstpath)
+            else:
+                total += self.copy_file(srcpath, dstpath)
+        return total
+
+    def copy(self, src, dst):
+        """ Copy src to dst, descending into src if it is a directory """
+        if os.path.isdir(src):
+            return self.copy_tree(src, dst)
+        return self.copy_file(src, dst)
+
+
+def tree_size(path):
+    """ Return the total size in bytes of the regular files under path """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class ImageWriter(StreamCopier):
+    """ Write a raw disk image to a block device.
+
+    @param block_size: The size of each read and write.
+    @param sync_interval: If set, fdatasync the device after every
+                          sync_interval bytes, so that a slow device can't
+                          build up gigabytes of dirty pages.
+    @param direct: Bypass the page cache with O_DIRECT where the source and
+                   device support it.
+
+    write_image can also hash the image as it is read, and read every block
+    back from the device right after writing it, so that both the source and
+    the written copy are verified without any extra pass over the data.  The
+    read back only reaches the device itself when O_DIRECT is available.
+    """
+
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE, sync_interval=None,
+                 direct=True, callback=None, buffers=DEFAULT_BUFFER_COUNT):
+        StreamCopier.__init__(self, buffer_size=block_size, buffers=buffers,
+                              callback=callback, mode=MODE_BUFFERED)
+        self.sync_interval = sync_interval
+        self.direct = direct and O_DIRECT
+        self._unsynced = 0
+        self._sector_size = SECTOR_SIZE
+        self._readback = None
+        self._readback_buffer = None
+        self._readback_hashes = ()
+
+    def _open(self, path, flags):
+        """ Open path, trying O_DIRECT first if we were asked to use it """
+        if self.direct:
+            try:
+                return os.open(path, flags | O_DIRECT), True
+            except OSError, e:
+                if e.errno != errno.EINVAL:
+                    raise
+                log.debug('O_DIRECT is not supported for %s' % path)
+        return os.open(path, flags), False
+
+    def _write_buffer(self, dst, buf, count):
+        fd = dst.fileno()
+        if count % self._sector_size and O_DIRECT and \
+                fcntl.fcntl(fd, fcntl.F_GETFL) & O_DIRECT:
+            # O_DIRECT can't write a partial sector at the end of the image
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) & ~O_DIRECT)
+        StreamCopier._write_buffer(self, dst, buf, count)
+        self._unsynced += count
+        if self.sync_interval and self._unsynced >= self.sync_interval:
+            os.fdatasync(fd)
+            self._unsynced = 0
+        if self._readback:
+            self._read_back(count)
+
+    def _read_back(self, count):
+        """ Read the block we just wrote back from the device and hash it """
+        readback = self._readback_buffer
+        while count > 0:
+            # O_DIRECT reads must cover whole sectors, even for the last block
+            size = min(align(count, self._sector_size), len(readback))
+            read = self._readback.readinto(window(readback, size))
+            if not read:
+                raise IOError(errno.EIO, 'Unexpected end of device while '
+                              'reading back the image')
+            used = min(read, count)
+            for checksum in self._readback_hashes:
+                checksum.update(buffer(readback, 0, used))
+            if read > used:
+                # Step back over the padding we read past the image
+                self._readback.seek(used - read, os.SEEK_CUR)
+            count -= used
+
+    def _open_device(self, device, readback=()):
+        """ Open the device for writing, and for reading back if we have
+        hashes to update with what we wrote, returning the io.FileIO to
+        write to.
+        """
+        dst_fd, dst_direct = self._open(device, os.O_WRONLY)
+        outfile = io.FileIO(dst_fd, 'wb')
+        log.debug('Writing to %s in %d byte blocks%s' % (
+                  device, self.buffer_size,
+                  dst_direct and ' with O_DIRECT' or ''))
+        self._unsynced = 0
+        self._sector_size = get_sector_size(dst_fd)
+        if readback:
+            self._readback_hashes = readback
+            self._readback_buffer = mmap.mmap(-1, self.buffer_size)
+            self._readback = io.FileIO(self._open(device, os.O_RDONLY)[0], 'rb')
+        return outfile
+
+    def _close_device(self, outfile, sync=True):
+        """ Flush the device unless the write failed, and close it """
+        try:
+            if sync:
+                os.fdatasync(outfile.fileno())
+        finally:
+            outfile.close()
+            if self._readback:
+                self._readback.close()
+                self._readback_buffer.close()
+                self._readback = self._readback_buffer = None
+                self._readback_hashes = ()
+
+    def write_image(self, image, device, hashes=(), readback=()):
+        """ Write the image file to the device, returning the bytes written
+
+        @param hashes: hashlib objects to update with the image data.
+        @param readback: hashlib objects to update with the data read back
+                         from the device after each block is written.
+        """
+        src_fd = self._open(image, os.O_RDONLY)[0]
+        with io.FileIO(src_fd, 'rb') as infile:
+            outfile = self._open_device(device, readback)
+            try:
+                count = self.copy_stream(infile, outfile, hashes=hashes)
+            except:
+                self._close_device(outfile, sync=False)
+                raise
+            self._close_device(outfile)
+        return count
+
+
+class TransferStalled(Exception):
+    """ A target of a FanOutWriter stopped taking data """
+    pass
+
+
+class FanOutTarget(object):
+    """ One of the devices a FanOutWriter is writing to.
+
+    The writes go through the target's own ImageWriter, which counts the
+    bytes written for its callback and can be cancelled on its own.  A
+    target that was dropped but is still stuck writing to its device once
+    the others are done is left behind, and marked detached.
+    """
+
+    def __init__(self, device, writer, readback=()):
+        self.device = device
+        self.writer = writer
+        self.readback = readback
+        self.position = 0       # the number of blocks written
+        self.updated = time.time()
+        self.error = None       # the exc_info of what went wrong
+        self.done = False
+        self.detached = False
+        self.thread = None
+
+    @property
+    def copied(self):
+        return self.writer.copied
+
+    @property
+    def active(self):
+        return not self.done and self.error is None
+
+    def cancel(self):
+        self.writer.cancel()
+
+
+class FanOutWriter(object):
+    """ Write one raw image to many devices, reading it only once.
+
+    Blocks are read into a ring of `lag` page-aligned slots, and every
+    target has a thread writing them out in order.  A slot is only read
+    into again once every target has written it, so the fastest target can
+    be at most `lag` blocks ahead of the slowest.  A target that fails, is
+    cancelled, or hasn't written anything in `stall_timeout` seconds while
+    the others wait on it, is dropped without stopping the rest.  Once the
+    image is read, we wait up to `detach_timeout` seconds for the threads
+    of the dropped targets to give up, and leave behind the ones stuck in
+    a write, along with the slots they may still be writing from.
+
+    @param block_size: The size of each read and write.
+    @param lag: How many blocks the targets may drift apart.
+    @param sync_interval: As for ImageWriter.
+    @param direct: As for ImageWriter.
+    @param stall_timeout: Seconds without progress before a target holding
+                          up the others is dropped, or None to wait forever.
+    """
+
+    poll_interval = 0.5
+    detach_timeout = 5.0
+
+    def __init__(self, block_size=DEFAULT_BLOCK_SIZE, lag=DEFAULT_FANOUT_LAG,
+                 sync_interval=None, direct=True, stall_timeout=None):
+        self.block_size = align(block_size)
+        self.lag = max(1, lag)
+        self.sync_interval = sync_interval
+        self.direct = direct
+        self.stall_timeout = stall_timeout
+        self.targets = []
+        self.copied = 0
+        self._cond = threading.Condition()
+        self._slots = []
+        self._sizes = []
+        self._produced = 0
+        self._eof = False
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def add_target(self, device, callback=None, readback=()):
+        """ Add a device to write to, returning its FanOutTarget
+
+        @param callback: Called with the bytes written to this device.
+        @param readback: hashlib objects to update with the data read back
+                         from this device.
+        """
+        writer = ImageWriter(block_size=self.block_size,
+                             sync_interval=self.sync_interval,
+                             direct=self.direct, callback=callback)
+        target = FanOutTarget(device, writer, readback)
+        self.targets.append(target)
+        return target
+
+    def cancel(self):
+        """ Abort the writes to every target """
+        self._cancelled.set()
+        for target in self.targets:
+            target.cancel()
+
+    def _fail(self, target, exc_info):
+        with self._cond:
+            if target.error is None:
+                target.error = exc_info
+            self._cond.notify_all()
+
+    def _next_block(self, target, seq):
+        """ Wait for block seq to be read, returning its slot and size, or
+        None at the end of the image.
+        """
+        with self._cond:
+            while seq >= self._produced and not self._eof:
+                if target.writer.cancelled or target.error:
+                    raise TransferCancelled()
+                self._cond.wait(self.poll_interval)
+            if target.writer.cancelled or target.error:
+                raise TransferCancelled()
+            if seq >= self._produced:
+                return None
+            return self._slots[seq % self.lag], self._sizes[seq % self.lag]
+
+    def _write_target(self, target):
+        writer = target.writer
+        try:
+            outfile = writer._open_device(target.device, target.readback)
+            try:
+                seq = 0
+                while True:
+                    block = self._next_block(target, seq)
+                    if block is None:
+                        break
+                    writer._write_buffer(outfile, *block)
+                    writer._report(block[1])
+                    seq += 1
+                    with self._cond:
+                        target.position = seq
+                        target.updated = time.time()
+                        self._cond.notify_all()
+            except:
+                writer._close_device(outfile, sync=False)
+                raise
+            writer._close_device(outfile)
+        except Exception:
+            self._fail(target, sys.exc_info())
+        finally:
+            with self._cond:
+                target.done = True
+                self._cond.notify_all()
+
+    def _wait_for_slot(self, seq):
+        """ Wait until every active target has written the block that was
+        last in the slot for block seq, returning False if there are no
+        active targets left.
+        """
+        started = time.time()
+        with self._cond:
+            while True:
+                if self.cancelled:
+                    raise TransferCancelled()
+                active = [t for t in self.targets if t.active]
+                if not active:
+                    return False
+                behind = [t for t in active if t.position <= seq - self.lag]
+                if not behind:
+                    return True
+                self._drop_stalled(behind, started)
+                self._cond.wait(self.poll_interval)
+
+    def _wait_for_targets(self):
+        """ Wait until every target that is still writing has finished,
+        dropping the ones that stall on the blocks they have left.
+        """
+        started = time.time()
+        with self._cond:
+            while True:
+                writing = [t for t in self.targets
+                           if t.active and not t.writer.cancelled]
+                if not writing:
+                    return
+                self._drop_stalled([t for t in writing
+                                    if t.position < self._produced], started)
+                self._cond.wait(self.poll_interval)
+
+    def _drop_stalled(self, behind, started):
+        """ Drop the targets holding us up since started that haven't
+        written anything in stall_timeout seconds.  Called with the
+        condition held.
+        """
+        if self.stall_timeout is None:
+            return
+        now = time.time()
+        for target in behind:
+            # only the time it has been holding us up counts
+            if now - max(started, target.updated) > self.stall_timeout:
+                log.warning('Dropping %s, which has stopped writing' %
+                            target.device)
+                target.error = (TransferStalled, TransferStalled(
+                    'No data written to %s in %d seconds' % (
+                    target.device, self.stall_timeout)), None)
+                target.cancel()
+
+    def write_image(self, image, hashes=()):
+        """ Write the image file to every target, returning the number of
+        bytes read from it.  The targets that failed have their error set.
+
+        @param hashes: hashlib objects to update with the image data.
+        """
+        self._slots = [mmap.mmap(-1, self.block_size) for i in range(self.lag)]
+        self._sizes = [0] * self.lag
+        self._produced, self._eof = 0, False
+        for target in self.targets:
+            target.thread = threading.Thread(target=self._write_target,
+                                             args=(target,),
+                                             name='fanout-%s' % target.device)
+            target.thread.daemon = True
+            target.thread.start()
+        try:
+            with io.FileIO(image, 'rb') as infile:
+                seq = 0
+                while self._wait_for_slot(seq):
+                    slot = self._slots[seq % self.lag]
+                    count = infile.readinto(slot)
+                    for checksum in hashes:
+                        checksum.update(buffer(slot, 0, count))
+                    with self._cond:
+                        self._sizes[seq % self.lag] = count
+                        if count:
+                            self._produced = seq + 1
+                        else:
+                            self._eof = True
+                        self._cond.notify_all()
+                    if not count:
+                        break
+                    self.copied += count
+                    seq += 1
+        except:
+            # without the source, none of the targets can be finished
+            self.cancel()
+            raise
+        finally:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+            self._wait_for_targets()
+            for target in self.targets:
+                # the ones left were dropped, and give up at their next block
+                target.thread.join(self.detach_timeout)
+                if target.thread.is_alive():
+                    log.warning('Leaving %s behind, it is not responding' %
+                                target.device)
+                    target.detached = True
+            if not [t for t in self.targets if t.detached]:
+                for slot in self._slots:
+                    slot.close()
+            # otherwise a stuck write may still be using one of them, and
+            # they are unmapped once nothing refers to them
+            self._slots = []
+        return self.copied
+
+
+def invalidate_image(device, size=DEFAULT_BLOCK_SIZE):
+    """ Zero the start of a device, where the boot code, partition tables
+    and ISO9660 descriptors of a hybrid image live, so that a bad image
+    can't be booted or mounted.
+    """
+    fd = os.open(device, os.O_WRONLY)
+    try:
+        os.write(fd, '\0' * size)
+        getattr(os, 'fdatasync', os.fsync)(fd)
+    finally:
+        os.close(fd)
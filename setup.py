@@ -69,6 +69,7 @@ if sys.platform == 'win32':
         zipfile=None,
         data_files = [
             "LICENSE.txt",
+            ("liveusb", ["liveusb/releases.catalog"]),
             ("tools", [
                 "tools/dd.exe",
                 "tools/syslinux.exe",
@@ -86,6 +87,7 @@ else:
         name = 'liveusb-creator',
         version = VERSION,
         packages = ['liveusb'],
+        package_data = {'liveusb': ['releases.catalog']},
         scripts = ['liveusb-creator'],
         license = 'GNU General Public License (GPL)',
         url = 'https://fedorahosted.org/liveusb-creator',
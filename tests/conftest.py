@@ -0,0 +1,91 @@
+import threading
+import time
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import pytest
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    """ Serves self.pages, with an ETag for each, keeping the connections
+    alive and counting the requests.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.pages = {}
+        self.redirects = {}
+        self.delay = 0
+        self.lock = threading.Lock()
+        self.requests = []
+        self.connections = 0
+        self.running = 0
+        self.most_running = 0
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_port
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.running += 1
+            server.most_running = max(server.most_running, server.running)
+        time.sleep(server.delay)
+        with server.lock:
+            server.running -= 1
+        headers = {}
+        body = server.pages.get(self.path)
+        if self.path in server.redirects:
+            status, body = 302, ''
+            headers['Location'] = server.redirects[self.path]
+        elif body is None:
+            status, body = 404, ''
+        else:
+            headers['ETag'] = '"%x"' % (hash(body) & 0xffffffff)
+            if self.headers.get('if-none-match') == headers['ETag']:
+                status, body = 304, ''
+            else:
+                status = 200
+        with server.lock:
+            server.requests.append((self.path, status))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = Server()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def manifest_cache(tmpdir, monkeypatch):
+    """ Keep the block manifests the tests save out of the real cache """
+    from liveusb import manifest
+    cache = tmpdir.join('cache')
+    monkeypatch.setattr(manifest, 'get_cache_dir', lambda: str(cache))
+    return cache
@@ -0,0 +1,152 @@
+import json
+
+import pytest
+
+from liveusb import releases
+from liveusb.catalog import CatalogStore, get_builtin_catalog, read_catalog, \
+                            write_catalog
+
+WORKSTATION = {'name': 'Fedora Workstation', 'version': '23',
+               'description': u'<p>\u2015 Workstation</p>',
+               'variants': {'x86_64': {'url': 'https://.../x.iso',
+                                       'sha256': 'ab', 'size': 1}}}
+SERVER = {'name': 'Fedora Server', 'version': '23', 'description': '',
+          'variants': {}}
+
+
+@pytest.fixture
+def store(tmpdir, monkeypatch):
+    monkeypatch.setattr(releases, 'get_cache_dir', lambda: str(tmpdir))
+    return CatalogStore(str(tmpdir.join('releases.catalog')))
+
+
+@pytest.fixture
+def site(server, monkeypatch):
+    """ A site with one page, from which our fake crawl gets the version """
+    server.pages['/'] = '23'
+
+    def crawl(fetcher, checksums):
+        version = fetcher.fetch(server.url + '/').strip()
+        return [dict(WORKSTATION, version=version)]
+    monkeypatch.setattr(releases, 'get_fedora_flavors', crawl)
+    return server
+
+
+class TestCatalogStore:
+
+    def test_roundtrip(self, store):
+        assert store.load() is None
+        store.save([WORKSTATION, SERVER],
+                   {'https://getfedora.org/': {'etag': '"1"'}})
+        catalog = store.load()
+        assert catalog['releases'] == [WORKSTATION, SERVER]
+        assert catalog['pages']['https://getfedora.org/']['etag'] == '"1"'
+
+    def test_lazy_description(self, store):
+        store.save([WORKSTATION, SERVER], {})
+        workstation, server = store.load()['releases']
+        assert workstation['variants'] == WORKSTATION['variants']
+        assert 'description' not in workstation
+        assert workstation['description'] == WORKSTATION['description']
+        assert 'description' in workstation
+        assert server['description'] == ''
+        # saving what we loaded keeps the descriptions we haven't read
+        workstation, server = store.load()['releases']
+        store.save([workstation, server], {})
+        assert store.load()['releases'] == [WORKSTATION, SERVER]
+
+    def test_replaced(self, store):
+        store.save([WORKSTATION], {})
+        workstation = store.load()['releases'][0]
+        store.save([dict(WORKSTATION, description=u'<p>Changed</p>')], {})
+        # we read it before our own save replaced the file
+        assert workstation['description'] == WORKSTATION['description']
+
+        # but if someone else replaces it, it doesn't read the wrong place
+        workstation = store.load()['releases'][0]
+        with open(store.filename, 'wb') as out:
+            write_catalog(out, [dict(WORKSTATION, description=u'<p>X</p>')])
+        assert workstation['description'] == u''
+
+    def test_unusable(self, store):
+        with open(store.filename, 'w') as out:
+            out.write('liveusb-catalog 2 1\n{"releases": ')
+        assert store.load() is None
+        with open(store.filename, 'w') as out:
+            json.dump({'version': 1, 'releases': [WORKSTATION]}, out)
+        assert store.load() is None
+
+    def test_builtin(self):
+        flavors = read_catalog(get_builtin_catalog())['releases']
+        assert 'Custom OS...' in [release['name'] for release in flavors]
+        for release in flavors:
+            assert release['description'] is not None
+
+
+class TestRefresh:
+
+    def test_first(self, store, site):
+        assert releases.refresh_releases(store) == [WORKSTATION]
+        assert store.load()['releases'] == [WORKSTATION]
+
+    def test_unchanged(self, store, site):
+        releases.refresh_releases(store)
+        header = open(store.filename).readline()
+        del site.requests[:]
+        assert releases.refresh_releases(store) is None
+        assert site.requests == [('/', 304)]
+        # the catalog wasn't rewritten
+        assert open(store.filename).readline() == header
+
+    def test_shown_releases_survive(self, store, site):
+        releases.refresh_releases(store)
+        # what the GUI started from, without having read the descriptions
+        shown = store.load()['releases']
+        # the page changed, but not the releases on it
+        site.pages['/'] = '23\n'
+        assert releases.refresh_releases(store) is None
+        assert shown[0]['description'] == WORKSTATION['description']
+        assert shown == store.load()['releases']
+        # and once there are new ones
+        site.pages['/'] = '24'
+        flavors = releases.refresh_releases(store)
+        assert shown[0]['description'] == WORKSTATION['description']
+        assert [shown[0] == flavor for flavor in flavors] == [False]
+
+    def test_changed(self, store, site):
+        releases.refresh_releases(store)
+        del site.requests[:]
+        site.pages['/'] = '24'
+        flavors = releases.refresh_releases(store)
+        assert flavors[0]['version'] == '24'
+        assert store.load()['releases'] == flavors
+        # the crawl reused the page we got when checking it
+        assert site.requests == [('/', 200)]
+
+    def test_page_gone(self, store, site, monkeypatch):
+        site.pages['/spin'] = 'spin'
+
+        def crawl(fetcher, checksums):
+            version = fetcher.fetch(site.url + '/').strip()
+            if '/spin' in site.pages:
+                fetcher.fetch(site.url + '/spin')
+            return [dict(WORKSTATION, version=version)]
+        monkeypatch.setattr(releases, 'get_fedora_flavors', crawl)
+        releases.refresh_releases(store)
+        assert len(store.load()['pages']) == 2
+
+        # a page we saved is gone: that's a change, not being offline
+        del site.pages['/spin']
+        assert releases.refresh_releases(store) is None
+        assert store.load()['pages'].keys() == [site.url + '/']
+        del site.requests[:]
+        assert releases.refresh_releases(store) is None
+        assert site.requests == [('/', 304)]
+
+    def test_offline(self, store, site):
+        releases.refresh_releases(store)
+        site.shutdown()
+        site.server_close()
+        with pytest.raises(IOError):
+            releases.refresh_releases(store)
+        assert store.load()['releases'] == [WORKSTATION]
@@ -0,0 +1,80 @@
+import pytest
+
+from liveusb.checksumindex import ChecksumIndex, parse_checksums
+from liveusb.fetcher import Fetcher
+
+CHECKSUM = """-----BEGIN PGP SIGNED MESSAGE-----
+Hash: SHA256
+
+# Fedora-Live-Workstation-x86_64-23-10.iso: 1503657984 bytes
+SHA256 (Fedora-Live-Workstation-x86_64-23-10.iso) = %s
+SHA256 (Fedora-Live-Workstation-i686-23-10.iso) = 1f3fe28a51d0
+-----BEGIN PGP SIGNATURE-----
+"""
+
+LISTING = """<html><body>
+<a href="../">../</a>
+<a href="Fedora-Live-Workstation-x86_64-23-10.iso">Fedora-Live-...</a>
+<a href="Fedora-Live-Workstation-23-x86_64-CHECKSUM">Fedora-Live-...</a>
+</body></html>"""
+
+
+@pytest.fixture
+def server(server):
+    server.pages.update({
+        '/iso': LISTING,
+        '/iso/Fedora-Live-Workstation-23-x86_64-CHECKSUM':
+            CHECKSUM % 'a0b1c2d3',
+    })
+    return server
+
+
+class TestChecksumIndex:
+
+    def test_parse(self):
+        assert parse_checksums(CHECKSUM % 'ff') == {
+            'Fedora-Live-Workstation-x86_64-23-10.iso': 'ff',
+            'Fedora-Live-Workstation-i686-23-10.iso': '1f3fe28a51d0'}
+
+    def test_lookup(self, server):
+        index = ChecksumIndex(Fetcher(proxies={}))
+        base = server.url + '/iso/'
+        assert index.lookup(base + 'Fedora-Live-Workstation-x86_64-23-10.iso') \
+            == 'a0b1c2d3'
+        assert index.lookup(base + 'Fedora-Live-Workstation-i686-23-10.iso') \
+            == '1f3fe28a51d0'
+        assert index.lookup(base + 'missing.iso') == ''
+        assert index.lookup(server.url + '/nowhere/x.iso') == ''
+        # each directory is only fetched once
+        assert [path for path, status in server.requests] == [
+            '/iso', '/iso/Fedora-Live-Workstation-23-x86_64-CHECKSUM',
+            '/nowhere']
+
+    def test_persisted(self, server, tmpdir):
+        filename = str(tmpdir.join('index.json'))
+        url = server.url + '/iso/Fedora-Live-Workstation-x86_64-23-10.iso'
+        index = ChecksumIndex(Fetcher(proxies={}), filename)
+        assert index.lookup(url) == 'a0b1c2d3'
+        index.save()
+
+        # unchanged: a single conditional request, without the listing
+        del server.requests[:]
+        index = ChecksumIndex(Fetcher(proxies={}), filename)
+        assert index.lookup(url) == 'a0b1c2d3'
+        assert server.requests == [
+            ('/iso/Fedora-Live-Workstation-23-x86_64-CHECKSUM', 304)]
+
+        # changed
+        server.pages['/iso/Fedora-Live-Workstation-23-x86_64-CHECKSUM'] = \
+            CHECKSUM % 'e4f5'
+        index = ChecksumIndex(Fetcher(proxies={}), filename)
+        assert index.lookup(url) == 'e4f5'
+        index.save()
+
+        # renamed
+        server.pages['/iso/Fedora-Live-Workstation-23-x86_64-CHECKSUM2'] = \
+            server.pages.pop('/iso/Fedora-Live-Workstation-23-x86_64-CHECKSUM')
+        server.pages['/iso'] = LISTING.replace('CHECKSUM', 'CHECKSUM2')
+        index = ChecksumIndex(Fetcher(proxies={}), filename)
+        assert index.lookup(url) == 'e4f5'
+        assert index.entries[server.url + '/iso']['url'].endswith('CHECKSUM2')
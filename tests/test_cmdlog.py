@@ -0,0 +1,61 @@
+import subprocess
+
+from liveusb.cmdlog import RingBuffer, CommandLog
+
+
+class TestRingBuffer:
+
+    def test_small(self):
+        buf = RingBuffer(16)
+        buf.write('abc')
+        buf.write('def')
+        assert buf.getvalue() == 'abcdef'
+        assert buf.dropped == 0
+
+    def test_bounded(self):
+        buf = RingBuffer(16)
+        for i in range(1000):
+            buf.write('%08d' % i)
+        assert buf.getvalue() == '0000099800000999'
+        assert buf.size == 16
+        assert buf.dropped == 8 * 1000 - 16
+        assert len(buf.chunks) <= 3
+
+    def test_large_write(self):
+        buf = RingBuffer(4)
+        buf.write('x' * 10 + 'tail')
+        assert buf.getvalue() == 'tail'
+        assert buf.dropped == 10
+
+
+class TestCommandLog:
+
+    def _run(self, log, cmd):
+        job = log.start(cmd)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, stdin=subprocess.PIPE,
+                                shell=True)
+        job.capture(proc)
+        return job
+
+    def test_capture(self):
+        log = CommandLog()
+        job = self._run(log, 'echo out; echo err >&2; exit 3')
+        assert job.returncode == 3
+        assert 'out\n' in job.output.getvalue()
+        assert 'err\n' in job.output.getvalue()
+        assert job.error == 'err\n'
+        tail = job.tail()
+        assert tail.startswith('$ echo out;')
+        assert '[exit code 3]' in tail
+
+    def test_bounded(self):
+        log = CommandLog(history=2, limit=1024)
+        for i in range(5):
+            job = self._run(log, 'head -c 100000 /dev/zero; echo job%d' % i)
+        assert len(log.jobs) == 2
+        assert log.last is job
+        assert job.output.getvalue().endswith('job4\n')
+        assert len(job.output.getvalue()) == 1024
+        assert '[%d bytes of output dropped]' % (100005 - 1024) in job.tail()
+        assert 'job3' in log.getvalue() and 'job2' not in log.getvalue()
@@ -25,8 +25,10 @@ class TestLiveUSBCreator:
         live.detect_removable_drives()
         assert len(live.drives), "No devices found"
         for drive in live.drives:
-            for key in ('label', 'fstype', 'uuid', 'free'):
+            for key in ('label', 'fstype', 'uuid', 'mount'):
                 assert key in live.drives[drive]
+            free = live.get_free_space(live.drives[drive])
+            assert free is None or free >= 0
 
     def test_releases(self):
         from liveusb.releases import releases
@@ -130,3 +132,346 @@ class TestLiveUSBCreator:
             # Reset the MBR
             live.reset_mbr()
             assert not live.blank_mbr()
+
+
+class TestUDisks2Snapshot:
+
+    def _get_objects(self, count):
+        objects = {}
+        for i in range(count):
+            drive = '/org/freedesktop/UDisks2/drives/Stick_%d' % i
+            disk = '/org/freedesktop/UDisks2/block_devices/sd%s' % chr(98 + i)
+            objects[drive] = {'org.freedesktop.UDisks2.Drive': {
+                'Removable': True, 'Optical': False, 'ConnectionBus': 'usb',
+                'Vendor': 'Generic', 'Model': 'Stick %d' % i}}
+            objects[disk] = {'org.freedesktop.UDisks2.Block': {
+                'Device': bytearray('/dev/sd%s\0' % chr(98 + i))}}
+            objects[disk + '1'] = {
+                'org.freedesktop.UDisks2.Block': {
+                    'Drive': drive, 'IdLabel': 'LIVE', 'IdType': 'vfat',
+                    'IdVersion': 'FAT32', 'IdUUID': '1234-%04d' % i,
+                    'Device': bytearray('/dev/sd%s1\0' % chr(98 + i)),
+                    'Size': 8 * 1024**3},
+                'org.freedesktop.UDisks2.Filesystem': {'MountPoints': []},
+                'org.freedesktop.UDisks2.Partition': {'Table': disk}}
+        return objects
+
+    def _get_creator(self, count):
+        from liveusb import LiveUSBCreator
+        live = LiveUSBCreator(LiveUSBCreatorOptions())
+        live.callback = None
+        live.drives = {}
+        # everything has to come from the snapshot, there is no bus to ask
+        live.bus = None
+        live._udisks_objects = self._get_objects(count)
+        live._udisks_children = {}
+        for name in live._udisks_objects:
+            live._index_udisks_object(name)
+        live._add_udisks_devices()
+        return live
+
+    def test_resolved_from_snapshot(self):
+        live = self._get_creator(16)
+        assert len(live.drives) == 16
+        drive = live.drives['/org/freedesktop/UDisks2/block_devices/sdb1']
+        assert drive['device'] == '/dev/sdb1'
+        assert drive['parent'] == '/dev/sdb'
+        assert drive['friendlyName'] == 'Generic Stick 0'
+
+    def test_deltas(self):
+        live = self._get_creator(4)
+        changes = []
+        live.callback = changes.append
+        sdb1 = '/org/freedesktop/UDisks2/block_devices/sdb1'
+        drive = live.drives[sdb1]
+
+        blk = live._udisks_objects[sdb1]['org.freedesktop.UDisks2.Block']
+        blk['IdLabel'] = 'RENAMED'
+        live._update_udisks_devices(live._get_udisks_dependents(sdb1))
+        assert changes == [[sdb1]]
+        # the entry is updated in place
+        assert live.drives[sdb1] is drive and drive['label'] == 'RENAMED'
+
+        # nothing to report if nothing changed
+        live._update_udisks_devices(live._get_udisks_dependents(sdb1))
+        assert len(changes) == 1
+
+        # changes to a drive reach its partitions
+        stick = '/org/freedesktop/UDisks2/drives/Stick_0'
+        live._udisks_objects[stick]['org.freedesktop.UDisks2.Drive'][
+                'Removable'] = False
+        live._update_udisks_devices(live._get_udisks_dependents(stick))
+        assert changes[-1] == [sdb1]
+        assert sdb1 not in live.drives and len(live.drives) == 3
+
+        sdc1 = '/org/freedesktop/UDisks2/block_devices/sdc1'
+        del live._udisks_objects[sdc1]
+        live._update_udisks_devices(live._get_udisks_dependents(sdc1))
+        assert changes[-1] == [sdc1]
+        assert len(live.drives) == 2
+
+
+class TestFreeSpace:
+
+    def setup_method(self, method):
+        from liveusb import LiveUSBCreator
+        self.live = LiveUSBCreator(LiveUSBCreatorOptions())
+        self.calls = []
+        def get_free_bytes(mount):
+            self.calls.append(mount)
+            return 64 * 1024**2
+        self.live.get_free_bytes = get_free_bytes
+        self.drive = {'device': '/dev/sdb1', 'mount': '/media/LIVE'}
+
+    def test_cached(self):
+        assert self.live.get_free_space(self.drive) == 64
+        assert self.live.get_free_space(self.drive) == 64
+        assert self.calls == ['/media/LIVE']
+
+    def test_expires(self):
+        self.live.free_space_ttl = -1
+        self.live.get_free_space(self.drive)
+        self.live.get_free_space(self.drive)
+        assert len(self.calls) == 2
+
+    def test_invalidated(self):
+        self.live.get_free_space(self.drive)
+        self.live.invalidate_free_space('/media/LIVE')
+        self.live.get_free_space(self.drive)
+        assert len(self.calls) == 2
+
+    def test_unmounted(self):
+        self.drive['mount'] = None
+        assert self.live.get_free_space(self.drive) is None
+        assert not self.calls
+
+    def test_check_free_space(self):
+        from liveusb import LiveUSBError
+        self.live.drives['/dev/sdb1'] = dict(self.drive, uuid=None,
+                                             fstype='vfat')
+        self.live.drive = '/dev/sdb1'
+        self.live.isosize = 60 * 1024**2 + 1
+        self.live.overlay = 3
+        self.live.check_free_space()
+        self.live.check_free_space()
+        assert self.calls == ['/media/LIVE']
+        self.live.overlay = 4
+        try:
+            self.live.check_free_space()
+        except LiveUSBError, e:
+            assert 'Required: 65MB. Free: 64MB.' in e.args[0]
+        else:
+            assert False
+
+
+class TestLiveOSChecksum:
+
+    def setup_method(self, method):
+        import tempfile
+        from liveusb import LiveUSBCreator
+        self.tmpdir = tempfile.mkdtemp()
+        self.live = LiveUSBCreator(LiveUSBCreatorOptions())
+        self.live.drives['/dev/sdb1'] = {'device': '/dev/sdb1', 'uuid': None,
+                                         'fstype': 'vfat',
+                                         'mount': self.tmpdir}
+        self.live.drive = '/dev/sdb1'
+        self.live.dest = self.tmpdir
+        os.mkdir(os.path.join(self.tmpdir, 'LiveOS'))
+        self.squashfs = os.path.join(self.tmpdir, 'LiveOS', 'squashfs.img')
+        with open(self.squashfs, 'wb') as squashfs:
+            squashfs.write('squashfs')
+
+    def teardown_method(self, method):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def _checksums(self):
+        self.live.calculate_liveos_checksum()
+        return self.live.read_liveos_checksums()
+
+    def test_copied_checksums(self):
+        import hashlib
+        # what extract_iso hashed as it copied isn't read back
+        self.live.record_copied_checksums('sha1', {self.squashfs: 'c0ffee'})
+        assert self._checksums()['LiveOS/squashfs.img'] == ('sha1', 'c0ffee')
+        # unless it changed since
+        with open(self.squashfs, 'ab') as squashfs:
+            squashfs.write('!')
+        assert self._checksums()['LiveOS/squashfs.img'] == (
+            'sha1', hashlib.sha1('squashfs!').hexdigest())
+
+
+class TestJobs:
+
+    def setup_method(self, method):
+        from liveusb import LiveUSBCreator
+        self.live = LiveUSBCreator(LiveUSBCreatorOptions())
+        self.live.drives.update({
+            '/dev/sdb1': {'device': '/dev/sdb1', 'uuid': 'b', 'fstype': 'vfat',
+                          'mount': None},
+            '/dev/sdc1': {'device': '/dev/sdc1', 'uuid': 'c', 'fstype': 'ext4',
+                          'mount': None},
+        })
+
+    def test_instances(self):
+        from liveusb import LiveUSBCreator
+        other = LiveUSBCreator(LiveUSBCreatorOptions())
+        assert other.drives == {}
+        assert other.pids is not self.live.pids
+        assert other.output is not self.live.output
+        assert other.log.handlers == self.live.log.handlers
+
+    def test_jobs(self):
+        sdb = self.live.new_job('/dev/sdb1')
+        sdc = self.live.new_job('/dev/sdc1')
+        assert sdb.drive['uuid'] == 'b' and sdb.fstype == 'vfat'
+        assert sdc.drive['uuid'] == 'c' and sdc.fstype == 'ext4'
+        assert self.live.drive is None
+        # the inventory is shared, the job state isn't
+        assert sdb.drives is self.live.drives is sdc.drives
+        assert sdb.pids is not sdc.pids
+        assert sdb.output is not sdc.output
+        sdb.popen('echo sdb')
+        assert [job.cmd for job in sdb.output.jobs] == ['echo sdb']
+        assert not sdc.output.jobs and not self.live.output.jobs
+        self.live.drives['/dev/sdb1']['mount'] = '/media/LIVE'
+        assert sdb.drive['mount'] == '/media/LIVE'
+
+
+class TestVerifyChecksums:
+
+    def setup_method(self, method):
+        import hashlib
+        import tempfile
+        from liveusb import LiveUSBCreator
+        from liveusb.hashcache import ChecksumCache
+        self.tmpdir = tempfile.mkdtemp()
+        opts = LiveUSBCreatorOptions()
+        opts.segmented = True
+        self.live = LiveUSBCreator(opts)
+        self.live.checksum_cache = ChecksumCache(
+                os.path.join(self.tmpdir, 'checksums.json'))
+        self.image = os.path.join(self.tmpdir, 'live.iso')
+        with open(self.image, 'wb') as image:
+            image.write(os.urandom(3 * 65536))
+        self.live.set_iso(self.image)
+        self.sha256 = hashlib.sha256(open(self.image, 'rb').read()).hexdigest()
+
+    def teardown_method(self, method):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def test_no_manifest_of_bad_image(self):
+        from liveusb.manifest import Manifest
+        self.live.get_release_checksum = lambda: ('sha256', '0' * 64)
+        assert self.live._verify_iso_checksums()[1] is False
+        assert Manifest.load(self.image) is None
+        self.live.get_release_checksum = lambda: ('sha256', self.sha256)
+        assert self.live._verify_iso_checksums()[1] is True
+        assert Manifest.load(self.image).digest == self.sha256
+
+
+class TestFanOut:
+
+    def setup_method(self, method):
+        import tempfile
+        from liveusb import LiveUSBCreator
+        self.tmpdir = tempfile.mkdtemp()
+        opts = LiveUSBCreatorOptions()
+        opts.noverify = True
+        opts.block_size = 64
+        self.live = LiveUSBCreator(opts)
+        self.image = os.path.join(self.tmpdir, 'live.iso')
+        with open(self.image, 'wb') as image:
+            image.write(os.urandom(5 * 65536 + 100))
+        self.live.set_iso(self.image)
+        for name in ('sdb', 'sdc'):
+            device = os.path.join(self.tmpdir, name)
+            with open(device, 'wb') as out:
+                out.write('\0' * 8 * 65536)
+            self.live.drives[device + '1'] = {
+                'device': device + '1', 'parent': device, 'uuid': None,
+                'fstype': 'vfat', 'mount': None}
+        self.missing = os.path.join(self.tmpdir, 'gone', 'sdd')
+        self.live.drives[self.missing] = {
+            'device': self.missing, 'parent': None, 'uuid': None,
+            'fstype': 'vfat', 'mount': None}
+
+    def teardown_method(self, method):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def test_fan_out(self):
+        drives = sorted(self.live.drives)
+        results = self.live.fan_out(drives)
+        assert sorted(results) == drives
+        data = open(self.image, 'rb').read()
+        for name in ('sdb', 'sdc'):
+            assert results[os.path.join(self.tmpdir, name + '1')] is None
+            device = open(os.path.join(self.tmpdir, name), 'rb').read()
+            assert device[:len(data)] == data
+        # the missing drive failed on its own
+        assert 'Unable to write' in results[self.missing].args[0]
+
+    def test_schedule_disks_once(self):
+        sdb = os.path.join(self.tmpdir, 'sdb')
+        self.live.drives[sdb + '2'] = dict(self.live.drives[sdb + '1'],
+                                           device=sdb + '2')
+        written = []
+        results = self.live.schedule(sorted(self.live.drives),
+                                     lambda job: written.append(job.drive))
+        assert sorted(results) == sorted(self.live.drives)
+        assert sorted([drive['parent'] or drive['device']
+                       for drive in written]) == \
+            sorted([sdb, os.path.join(self.tmpdir, 'sdc'), self.missing])
+        # the partitions of a disk are written, and fail, together
+        assert results[sdb + '1'] is results[sdb + '2'] is None
+
+    def test_windows_device_checksum_modes(self):
+        import hashlib
+        from liveusb.creator import WindowsLiveUSBCreator
+        live = WindowsLiveUSBCreator(self.live.opts)
+        live.set_iso(self.image)
+        sdb = os.path.join(self.tmpdir, 'sdb')
+        live.drives['E:'] = {'device': 'E:', 'uuid': None, 'fstype': 'vfat',
+                             'mount': 'E:'}
+        live.drive = 'E:'
+        assert live._get_raw_device() == r'\\.\E:'
+        live._get_raw_device = lambda: sdb
+        data = open(self.image, 'rb').read()
+        with open(sdb, 'r+b') as device:
+            device.write(data)
+        live.get_release_checksum = lambda: ('sha256',
+                                             hashlib.sha256(data).hexdigest())
+        assert live.calculate_device_checksum(mode='extent') == \
+            hashlib.sha256(data).hexdigest()
+        assert live.calculate_device_checksum(mode='sampled', samples=2)
+
+    def test_windows_dd_image(self):
+        import hashlib
+        from liveusb import LiveUSBError
+        from liveusb.creator import WindowsLiveUSBCreator
+        live = WindowsLiveUSBCreator(self.live.opts)
+        live.opts.device_checksum = True
+        live.set_iso(self.image)
+        sdb = os.path.join(self.tmpdir, 'sdb')
+        live.drives['E:'] = {'device': 'E:', 'uuid': None, 'fstype': 'vfat',
+                             'mount': 'E:'}
+        live.drive = 'E:'
+        live._get_raw_device = lambda: sdb
+        commands = []
+        live.popen = commands.append
+        data = open(self.image, 'rb').read()
+        live.get_release_checksum = lambda: ('sha256',
+                                             hashlib.sha256(data).hexdigest())
+        # dd.exe never ran, so the device doesn't match and is erased
+        try:
+            live.dd_image()
+        except LiveUSBError, e:
+            assert 'does not match' in e.args[0]
+        else:
+            assert False, 'expected a LiveUSBError'
+        assert commands[0].startswith('dd if="%s" of="%s" ' % (self.image, sdb))
+        with open(sdb, 'r+b') as device:
+            device.write(data)
+        live.dd_image()
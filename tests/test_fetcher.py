@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from liveusb.fetcher import Fetcher, FetchError
+
+
+@pytest.fixture
+def pages(server):
+    server.pages.update(dict([('/page/%d' % i, 'body of /page/%d' % i)
+                              for i in range(10)]))
+    server.redirects['/moved'] = '/page/5'
+    server.delay = 0.05
+    return server
+
+
+class TestFetcher:
+
+    def test_fetch(self, pages):
+        fetcher = Fetcher(proxies={})
+        assert fetcher.fetch(pages.url + '/page/1') == 'body of /page/1'
+        assert fetcher.fetch(pages.url + '/moved') == 'body of /page/5'
+        with pytest.raises(FetchError) as e:
+            fetcher.fetch(pages.url + '/missing')
+        assert e.value.status == 404
+        assert [t.status for t in fetcher.timings] == [200, 302, 200, 404]
+        assert fetcher.validators[pages.url + '/moved']['etag']
+        fetcher.close()
+
+    def test_conditional(self, pages):
+        fetcher = Fetcher(proxies={})
+        url = pages.url + '/page/1'
+        response = fetcher.request(url)
+        assert response.status == 200
+        etag = response.headers['etag']
+        assert fetcher.request(url, etag).status == 304
+        pages.pages['/page/1'] = 'changed'
+        assert fetcher.request(url, etag).body == 'changed'
+
+    def test_dedup(self, pages):
+        fetcher = Fetcher(proxies={})
+        urls = [pages.url + '/page/%d' % (i % 3) for i in range(12)]
+        bodies = fetcher.map(fetcher.fetch, urls)
+        assert bodies == ['body of /page/%d' % (i % 3) for i in range(12)]
+        assert sorted(pages.requests) == [('/page/0', 200), ('/page/1', 200),
+                                          ('/page/2', 200)]
+        fetcher.close()
+
+    def test_per_host(self, pages):
+        fetcher = Fetcher(per_host=2, proxies={})
+        urls = [pages.url + '/page/%d' % i for i in range(10)]
+        pages.delay = 0.1
+        start = time.time()
+        fetcher.map(fetcher.fetch, urls)
+        assert pages.most_running == 2
+        # the connections are kept alive and reused
+        assert pages.connections == 2
+        assert time.time() - start < 10 * 0.1
+        fetcher.close()
+
+    def test_map_threads(self, pages):
+        import threading
+        from multiprocessing.dummy import DummyProcess
+        fetcher = Fetcher(proxies={}, threads=3)
+        running = []
+        most = [0]
+        lock = threading.Lock()
+
+        def fetch(url):
+            with lock:
+                running.append(url)
+                most[0] = max(most[0], len(running))
+            try:
+                return fetcher.fetch(url)
+            finally:
+                with lock:
+                    running.remove(url)
+
+        urls = [pages.url + '/page/%d' % i for i in range(10)]
+        # nested maps each get a bounded pool of their own
+        bodies = fetcher.map(lambda half: fetcher.map(fetch, half),
+                             [urls[:5], urls[5:]])
+        assert bodies == [['body of /page/%d' % i for i in range(5)],
+                          ['body of /page/%d' % i for i in range(5, 10)]]
+        assert most[0] <= 2 * 3
+        # and their threads are gone once map returns
+        assert not [thread for thread in threading.enumerate()
+                    if isinstance(thread, DummyProcess)]
+        fetcher.close()
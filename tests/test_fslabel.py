@@ -0,0 +1,158 @@
+import os
+import struct
+import tempfile
+
+from liveusb.fslabel import set_label, get_label, crc32c, LabelError
+from liveusb.sysfs import probe_fat, probe_ext
+
+
+def make_fat16(label='NO NAME', entries=()):
+    """ 1 reserved sector, 2 FATs of 8 sectors and 512 root entries """
+    image = bytearray(64 * 1024)
+    image[11:24] = struct.pack('<HBHBHHBH', 512, 4, 1, 2, 512, 128,
+                               0xf8, 8)
+    image[38] = 0x29
+    image[39:43] = struct.pack('<I', 0x1234abcd)
+    image[43:54] = label.ljust(11)
+    image[54:62] = 'FAT16   '
+    image[510:512] = '\x55\xaa'
+    root = (1 + 2 * 8) * 512
+    for i, entry in enumerate(entries):
+        image[root + i * 32:root + (i + 1) * 32] = entry
+    return str(image)
+
+
+def make_fat32(label='NO NAME', entries=()):
+    """ 32 reserved sectors, 2 FATs of 1 sector and one sector clusters,
+    with the root directory in clusters 2 and 3.
+    """
+    image = bytearray(64 * 1024)
+    image[11:24] = struct.pack('<HBHBHHBH', 512, 1, 32, 2, 0, 0, 0xf8, 0)
+    image[36:40] = struct.pack('<I', 1)
+    image[44:48] = struct.pack('<I', 2)
+    image[50:52] = struct.pack('<H', 6)
+    image[66] = 0x29
+    image[67:71] = struct.pack('<I', 0x1234abcd)
+    image[71:82] = label.ljust(11)
+    image[82:90] = 'FAT32   '
+    image[510:512] = '\x55\xaa'
+    image[6 * 512:7 * 512] = image[:512]
+    for fat in (32 * 512, 33 * 512):
+        image[fat + 8:fat + 16] = struct.pack('<II', 3, 0x0fffffff)
+    root = (32 + 2) * 512
+    for i, entry in enumerate(entries):
+        image[root + i * 32:root + (i + 1) * 32] = entry
+    return str(image)
+
+
+def make_entry(name, attr):
+    return name.ljust(11) + chr(attr) + '\0' * 20
+
+
+def make_ext(label='', ro_compat=0):
+    superblock = bytearray(1024)
+    superblock[56:58] = struct.pack('<H', 0xef53)
+    superblock[100:104] = struct.pack('<I', ro_compat)
+    superblock[120:136] = label.ljust(16, '\0')
+    return '\0' * 1024 + str(superblock) + '\0' * 2048
+
+
+class TestFSLabel:
+
+    def setup_method(self, method):
+        fd, self.image = tempfile.mkstemp()
+        os.close(fd)
+
+    def teardown_method(self, method):
+        os.unlink(self.image)
+
+    def _write(self, data):
+        with open(self.image, 'wb') as image:
+            image.write(data)
+
+    def _label(self, fstype, label):
+        with open(self.image, 'r+b') as image:
+            set_label(image, fstype, label)
+        with open(self.image, 'rb') as image:
+            label = get_label(image, fstype)
+            image.seek(0)
+            return label, image.read()
+
+    def test_fat16(self):
+        self._write(make_fat16(entries=[make_entry('README  TXT', 0x20)]))
+        label, image = self._label('vfat', 'Fedora-Live')
+        assert label == 'Fedora-Live'
+        assert probe_fat(image[:512])[2] == 'Fedora-Live'
+        root = (1 + 2 * 8) * 512
+        # the file is kept and the label goes in the next free entry
+        assert image[root:root + 11] == 'README  TXT'
+        assert image[root + 32:root + 44] == 'Fedora-Live\x08'
+        assert len(image) == 64 * 1024
+
+    def test_fat16_existing_label(self):
+        self._write(make_fat16('OLD', [make_entry('\xe5ELETED TXT', 0x20),
+                                       make_entry('OLD', 0x08)]))
+        label, image = self._label('vfat', 'LIVE')
+        assert label == 'LIVE'
+        root = (1 + 2 * 8) * 512
+        assert image[root + 32:root + 44] == 'LIVE       \x08'
+        assert image[root + 64] == '\0'
+
+    def test_fat32(self):
+        # fill the first root cluster, with a long file name entry that
+        # must not be taken for the label
+        entries = [make_entry('A' * 11, 0x0f)] + \
+                  [make_entry('FILE%-7d' % i, 0x20) for i in range(15)]
+        self._write(make_fat32(entries=entries))
+        label, image = self._label('vfat', 'LIVE')
+        assert label == 'LIVE'
+        assert probe_fat(image[:512])[2] == 'LIVE'
+        assert probe_fat(image[6 * 512:7 * 512])[2] == 'LIVE'
+        cluster3 = (32 + 2 + 1) * 512
+        assert image[cluster3:cluster3 + 12] == 'LIVE       \x08'
+
+    def test_fat_clear(self):
+        self._write(make_fat16('OLD', [make_entry('OLD', 0x08)]))
+        label, image = self._label('vfat', '')
+        assert label == ''
+        assert image[43:54] == 'NO NAME    '
+        assert image[(1 + 2 * 8) * 512] == '\xe5'
+
+    def test_fat_non_ascii(self):
+        self._write(make_fat16('OLD', [make_entry('OLD', 0x08)]))
+        for label in (u'F\xe9dora', 'F\xc3\xa9dora'):
+            try:
+                self._label('vfat', label)
+            except LabelError:
+                pass
+            else:
+                assert False, label
+        # and nothing was written
+        with open(self.image, 'rb') as image:
+            assert get_label(image, 'vfat') == 'OLD'
+
+    def test_ext(self):
+        self._write(make_ext('old'))
+        label, image = self._label('ext3', 'LIVE')
+        assert label == 'LIVE'
+        assert probe_ext(image[1024:2048])[2] == 'LIVE'
+        assert image[2044:2048] == '\0' * 4
+
+    def test_ext_checksum(self):
+        self._write(make_ext(ro_compat=0x400))
+        label, image = self._label('ext4', 'LIVE')
+        checksum = struct.unpack('<I', image[2044:2048])[0]
+        assert checksum == crc32c(image[1024:2044]) ^ 0xffffffff
+
+    def test_crc32c(self):
+        assert crc32c('123456789') == 0xe3069283
+
+    def test_unknown(self):
+        self._write('\0' * 4096)
+        for fstype in ('vfat', 'ext4', 'ntfs'):
+            try:
+                self._label(fstype, 'LIVE')
+            except LabelError:
+                pass
+            else:
+                assert False, fstype
@@ -0,0 +1,114 @@
+import pytest
+
+QtCore = pytest.importorskip('PyQt5.QtCore')
+gui = pytest.importorskip('liveusb.gui')
+
+
+class Live(object):
+    def get_proxies(self):
+        return None
+
+
+class ReleaseProxy(QtCore.QObject):
+    archChanged = QtCore.pyqtSignal()
+
+
+class LiveUSBData(QtCore.QObject):
+    """ What ReleaseListModel and Release need of the real LiveUSBData """
+
+    def __init__(self):
+        QtCore.QObject.__init__(self)
+        self.live = Live()
+        self.releaseProxyModel = ReleaseProxy(self)
+        self.releaseData = []
+
+
+def flavor(name, description=''):
+    return {'name': name, 'version': '23', 'description': description,
+            'summary': '', 'logo': '', 'screenshots': [], 'source': '',
+            'releaseDate': '',
+            'variants': {'x86_64': {'url': 'https://.../%s.iso' % name,
+                                    'sha256': '', 'size': 1}}}
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+class TestReleaseListModel:
+
+    def setup_method(self, method):
+        self.data = LiveUSBData()
+        self.model = gui.ReleaseListModel(self.data)
+        self.events = []
+        self.model.rowsInserted.connect(lambda parent, first, last:
+                self.events.append(('insert', first, last)))
+        self.model.rowsRemoved.connect(lambda parent, first, last:
+                self.events.append(('remove', first, last)))
+        self.model.dataChanged.connect(lambda first, last:
+                self.events.append(('change', first.row(), last.row())))
+
+    def _update(self, names):
+        """ Update the model with a release for each of names, returning
+        the releases that are gone.
+        """
+        del self.events[:]
+        return self.model.update([flavor(name) for name in names])
+
+    def _names(self):
+        return [release.name for release in self.data.releaseData]
+
+    def _releases(self):
+        return dict([(release.name, release)
+                     for release in self.data.releaseData])
+
+    def test_initial(self, app):
+        assert self._update('ABC') == []
+        assert self._names() == list('ABC')
+        assert self.model.rowCount() == 3
+        assert self.events == [('insert', 0, 2)]
+
+    def test_insert(self, app):
+        self._update('AC')
+        before = self._releases()
+        assert self._update('ABC') == []
+        assert self._names() == list('ABC')
+        assert self.events == [('insert', 1, 1)]
+        after = self._releases()
+        assert after['A'] is before['A'] and after['C'] is before['C']
+        assert [r.index for r in self.data.releaseData] == [0, 1, 2]
+
+    def test_remove(self, app):
+        self._update('ABC')
+        before = self._releases()
+        assert self._update('AC') == [before['B']]
+        assert self._names() == list('AC')
+        assert self.events == [('remove', 1, 1)]
+        assert self._releases()['C'] is before['C']
+        assert before['C'].index == 1
+
+    def test_move(self, app):
+        self._update('ABCD')
+        before = self._releases()
+        assert self._update('DABC') == []
+        assert self._names() == list('DABC')
+        # the release that moved is the same one, in its new row
+        assert self._releases() == before
+        for name, release in before.items():
+            assert self._releases()[name] is release
+        assert [r.index for r in self.data.releaseData] == [0, 1, 2, 3]
+        assert ('change', 0, 0) not in self.events
+
+    def test_change(self, app):
+        self._update('AB')
+        before = self._releases()
+        details = []
+        before['B'].detailsChanged.connect(lambda: details.append(True))
+        del self.events[:]
+        assert self.model.update([flavor('A'),
+                                  flavor('B', '<p>New</p>')]) == []
+        assert self.events == [('change', 1, 1)]
+        assert self._releases()['B'] is before['B']
+        assert before['B'].description == '<p>New</p>'
+        assert details == [True]
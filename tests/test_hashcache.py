@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from liveusb.hashcache import ChecksumCache
+
+
+class TestChecksumCache:
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'cache', 'checksums.json')
+        self.iso = os.path.join(self.tmpdir, 'live.iso')
+        self._write_iso('x' * 100)
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def _write_iso(self, data, path=None):
+        iso = open(path or self.iso, 'wb')
+        iso.write(data)
+        iso.close()
+
+    def test_persisted(self):
+        cache = ChecksumCache(self.filename)
+        cache.set(self.iso, 'sha256', 'abc', True)
+        cache.save()
+        cache = ChecksumCache(self.filename)
+        assert cache.get(self.iso, 'sha256') == {'digest': 'abc',
+                                                 'verified': True}
+        assert cache.get(self.iso, 'sha1') is None
+
+    def test_invalidated_when_file_changes(self):
+        cache = ChecksumCache(self.filename)
+        cache.set(self.iso, 'sha256', 'abc', True)
+        self._write_iso('y' * 101)
+        assert cache.get(self.iso, 'sha256') is None
+
+    def test_eviction(self):
+        cache = ChecksumCache(self.filename, max_entries=2)
+        isos = []
+        for i in range(3):
+            iso = os.path.join(self.tmpdir, '%d.iso' % i)
+            self._write_iso(str(i), iso)
+            cache.set(iso, 'sha256', str(i), True)
+            isos.append(iso)
+        cache.touch(isos[0])
+        cache.save()
+        cache = ChecksumCache(self.filename, max_entries=2)
+        assert cache.get(isos[0], 'sha256')
+        assert cache.get(isos[1], 'sha256') is None
+        assert cache.get(isos[2], 'sha256')
+
+    def test_unreadable_cache(self):
+        os.makedirs(os.path.dirname(self.filename))
+        self._write_iso('not json', self.filename)
+        assert ChecksumCache(self.filename).get(self.iso, 'sha256') is None
+
+    def test_shared_by_jobs(self):
+        cache = ChecksumCache(self.filename)
+        errors = []
+
+        def job(i):
+            iso = os.path.join(self.tmpdir, '%d.iso' % i)
+            self._write_iso(str(i), iso)
+            try:
+                for n in range(20):
+                    cache.set(iso, 'sha256', str(n), True)
+                    cache.save()
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=job, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        cache = ChecksumCache(self.filename)
+        for i in range(8):
+            assert cache.get(os.path.join(self.tmpdir, '%d.iso' % i),
+                             'sha256') == {'digest': '19', 'verified': True}
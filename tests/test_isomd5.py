@@ -0,0 +1,112 @@
+import hashlib
+import random
+import struct
+
+from StringIO import StringIO
+
+from liveusb.isomd5 import ImplantedMD5, parse_appdata
+from liveusb.isomd5 import APPDATA_OFFSET, APPDATA_SIZE, SECTOR_SIZE
+
+
+def make_iso(sectors=600, skipsectors=15, fragment_count=20):
+    """ Build a fake ISO and implant its MD5 the way implantisomd5 does """
+    rand = random.Random(sectors)
+    data = bytearray(rand.getrandbits(8) for i in range(sectors * SECTOR_SIZE))
+    pvd = 16 * SECTOR_SIZE
+    data[pvd:pvd + 6] = '\x01CD001'
+    data[pvd + 80:pvd + 84] = struct.pack('<I', sectors)
+    data[pvd + SECTOR_SIZE:pvd + SECTOR_SIZE + 6] = '\xffCD001'
+    appdata = pvd + APPDATA_OFFSET
+    data[appdata:appdata + APPDATA_SIZE] = ' ' * APPDATA_SIZE
+
+    # The main loop of implantisomd5 in libimplantisomd5.c of isomd5sum
+    # 1.2.3, read by read
+    total = (sectors - skipsectors) * SECTOR_SIZE
+    fragment_size = total // (fragment_count + 1)
+    md5 = hashlib.md5()
+    sums = ''
+    offset = previous = 0
+    while offset < total:
+        nbyte = min(total - offset, min(fragment_size, 16 * SECTOR_SIZE))
+        md5.update(str(data[offset:offset + nbyte]))
+        current = offset // fragment_size
+        if current != previous:
+            digest = bytearray(md5.copy().digest())
+            sums += ''.join([('%x' % b)[0] for b in digest[:60 // fragment_count]])
+            previous = current
+        offset += nbyte
+
+    text = ('ISO MD5SUM = %s;SKIPSECTORS = %d;RHLISOSTATUS=1;'
+            'THIS IS NOT THE SAME AS RUNNING MEDIACHECK;FRAGMENT SUMS = %s;'
+            'FRAGMENT COUNT = %d;' % (md5.hexdigest(), skipsectors, sums,
+                                      fragment_count))
+    data[appdata:appdata + len(text)] = text
+    return str(data)
+
+
+class TestImplantedMD5:
+
+    def _verify(self, iso, chunk=1024**2):
+        checker = ImplantedMD5.from_file(StringIO(iso))
+        for i in range(0, len(iso), chunk):
+            checker.update(iso[i:i + chunk])
+        return checker
+
+    def test_parse_appdata(self):
+        fields = parse_appdata('ISO MD5SUM = abc;SKIPSECTORS = 15;'
+                               'RHLISOSTATUS=1;\0\0\0')
+        assert fields['ISO MD5SUM'] == 'abc'
+        assert fields['SKIPSECTORS'] == '15'
+        assert fields['RHLISOSTATUS'] == '1'
+
+    def test_valid(self):
+        iso = make_iso()
+        for chunk in (1024**2, 4096, 1000):
+            assert self._verify(iso, chunk).verify()
+
+    def test_small_images(self):
+        # the fragments are smaller than a read, so they set the read size
+        for sectors in (40, 100, 300):
+            assert self._verify(make_iso(sectors), 1000).verify()
+
+    def test_checkpoints(self):
+        # 85 sectors make 8289 byte fragments and reads, with 11 bytes left
+        # over; 1.2.3 checks fragment 1 after the read from 8289 to 16578,
+        # where 1.0.x checked it a read later, and checks a 21st fragment
+        checker = ImplantedMD5.from_file(StringIO(make_iso(100)))
+        assert checker.total == 85 * SECTOR_SIZE
+        assert sorted(checker.checkpoints.items())[:2] == [(16578, 1),
+                                                           (24867, 2)]
+        assert checker.checkpoints[checker.total] == 21
+        checker = ImplantedMD5.from_file(StringIO(make_iso()))
+        assert sorted(checker.checkpoints.items())[0] == (98304, 1)
+        assert len(checker.checkpoints) == 20
+
+    def test_corrupt(self):
+        iso = make_iso()
+        offset = 500 * SECTOR_SIZE
+        iso = iso[:offset] + chr(ord(iso[offset]) ^ 1) + iso[offset + 1:]
+        assert not self._verify(iso).verify()
+
+    def test_corrupt_fragment_fails_early(self):
+        iso = make_iso()
+        offset = 100 * SECTOR_SIZE
+        iso = iso[:offset] + chr(ord(iso[offset]) ^ 1) + iso[offset + 1:]
+        checker = ImplantedMD5.from_file(StringIO(iso))
+        checker.update(iso[:200 * SECTOR_SIZE])
+        assert checker.failed
+
+    def test_skipped_sectors_are_ignored(self):
+        iso = make_iso()
+        iso = iso[:-SECTOR_SIZE] + '\0' * SECTOR_SIZE
+        assert self._verify(iso).verify()
+
+    def test_truncated(self):
+        iso = make_iso()
+        assert not self._verify(iso[:300 * SECTOR_SIZE]).verify()
+
+    def test_not_implanted(self):
+        isofile = StringIO('\0' * (20 * SECTOR_SIZE))
+        assert ImplantedMD5.from_file(isofile) is None
+        # the caller hashes the image from where it was left
+        assert isofile.tell() == 0
@@ -0,0 +1,103 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+import pytest
+
+from liveusb.manifest import Manifest, SegmentHasher, merkle_root
+from liveusb.manifest import make_manifest
+from liveusb.manifest import hash_file, read_checksum_file, write_checksum_file
+
+
+class TestManifest:
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+        self.iso = os.path.join(self.tmpdir, 'live.iso')
+        self.data = os.urandom(5 * 4096 + 100)
+        iso = open(self.iso, 'wb')
+        iso.write(self.data)
+        iso.close()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def _build(self):
+        return make_manifest(self.iso, segment_size=4096)
+
+    def test_segments(self):
+        manifest = self._build()
+        assert len(manifest.segments) == 6
+        assert manifest.segments[0] == \
+               hashlib.sha256(self.data[:4096]).hexdigest()
+        assert manifest.segments[-1] == \
+               hashlib.sha256(self.data[5 * 4096:]).hexdigest()
+        assert manifest.root == merkle_root(manifest.segments)
+        assert manifest.digest == hashlib.sha256(self.data).hexdigest()
+
+    def test_segments_from_any_reads(self):
+        # the pass we share hashes the segments whatever its read size
+        for size in (1, 100, 4096, 5000, len(self.data)):
+            hasher = SegmentHasher(self.iso, segment_size=4096)
+            for i in range(0, len(self.data), size):
+                hasher.update(self.data[i:i + size])
+            assert hasher.manifest().segments == self._build().segments
+        hasher = SegmentHasher(self.iso, segment_size=4096)
+        hasher.update(self.data[:4096])
+        with pytest.raises(ValueError):
+            hasher.manifest()
+
+    def test_merkle_root(self):
+        leaves = [hashlib.sha256(c).hexdigest() for c in 'abc']
+        raw = [l.decode('hex') for l in leaves]
+        left = hashlib.sha256(raw[0] + raw[1]).digest()
+        assert merkle_root(leaves) == \
+               hashlib.sha256(left + raw[2]).hexdigest()
+        assert merkle_root(leaves[:1]) == leaves[0]
+
+    def test_save_and_load(self, manifest_cache):
+        manifest = self._build()
+        # in our cache, rather than next to the image
+        path = manifest.save(self.iso)
+        assert os.path.dirname(path) == str(manifest_cache.join('manifests'))
+        assert not os.path.exists(self.iso + '.manifest')
+        loaded = Manifest.load(self.iso)
+        assert loaded.root == manifest.root
+        assert loaded.digest == hashlib.sha256(self.data).hexdigest()
+
+        # The manifest goes stale when the image changes
+        iso = open(self.iso, 'ab')
+        iso.write('more')
+        iso.close()
+        os.utime(self.iso, (0, 0))
+        assert Manifest.load(self.iso) is None
+
+    def test_load_published(self):
+        import json
+        # a manifest shipped next to the image is used too
+        manifest = self._build()
+        with open(self.iso + '.manifest', 'w') as out:
+            json.dump(manifest.to_dict(), out)
+        assert Manifest.load(self.iso).root == manifest.root
+
+    def test_verify_segment(self):
+        manifest = self._build()
+        device = os.path.join(self.tmpdir, 'device')
+        out = open(device, 'wb')
+        out.write('\0' * 512 + self.data[:4096] + 'x' * 4096)
+        out.close()
+        assert manifest.verify_segment(device, 0, offset=512)
+        assert not manifest.verify_segment(device, 1, offset=512)
+
+    def test_checksum_file(self):
+        checksums = os.path.join(self.tmpdir, 'CHECKSUM')
+        reads = []
+        digest = hash_file(self.iso, 'sha1', reads.append)
+        assert digest == hashlib.sha1(self.data).hexdigest()
+        assert sum(reads) == len(self.data)
+        write_checksum_file(checksums, 'sha1', [('LiveOS/squashfs.img', digest),
+                                                ('LiveOS', 'abc123')])
+        assert read_checksum_file(checksums) == {
+            'LiveOS/squashfs.img': ('sha1', digest),
+            'LiveOS': ('sha1', 'abc123')}
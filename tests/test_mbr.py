@@ -0,0 +1,59 @@
+import os
+import struct
+import tempfile
+
+from liveusb.mbr import MBR, get_partition_number
+
+
+def make_mbr(boot_code='', partitions=()):
+    sector = bytearray(512)
+    sector[:len(boot_code)] = boot_code
+    for i, (status, type, start, sectors) in enumerate(partitions):
+        offset = 446 + i * 16
+        sector[offset] = status
+        sector[offset + 4] = type
+        sector[offset + 8:offset + 16] = struct.pack('<II', start, sectors)
+    sector[510:512] = '\x55\xaa'
+    return str(sector)
+
+
+class TestMBR:
+
+    def setup_method(self, method):
+        fd, self.device = tempfile.mkstemp()
+        os.write(fd, make_mbr('\xfa\x31', [(0, 0x0c, 2048, 4096),
+                                            (0x80, 0x83, 6144, 2048)]))
+        os.write(fd, 'x' * 4096)
+        os.close(fd)
+
+    def teardown_method(self, method):
+        os.unlink(self.device)
+
+    def test_parse(self):
+        mbr = MBR.read(self.device)
+        assert mbr.valid and not mbr.blank and not mbr.gpt
+        assert [(p.number, p.active, p.type, p.start, p.sectors)
+                for p in mbr.partitions] == [(1, False, 0x0c, 2048, 4096),
+                                             (2, True, 0x83, 6144, 2048)]
+        assert mbr.has_boot_code('\xfa\x31')
+        assert not mbr.has_boot_code('\xeb\x63')
+
+    def test_blank(self):
+        assert MBR(make_mbr()).blank
+
+    def test_write(self):
+        mbr = MBR.read(self.device)
+        mbr.updated('\xeb\x63\x90' * 200, active=1).write(self.device)
+        mbr = MBR.read(self.device)
+        # the boot code stops short of the disk signature and the table
+        assert mbr.boot_code == ('\xeb\x63\x90' * 200)[:440]
+        assert [p.active for p in mbr.partitions] == [True, False]
+        assert mbr.partitions[1].start == 6144
+        # nothing past the first sector is touched
+        assert os.path.getsize(self.device) == 512 + 4096
+        assert open(self.device, 'rb').read()[512:] == 'x' * 4096
+
+    def test_partition_number(self):
+        assert get_partition_number('/dev/sdb1', '/dev/sdb') == 1
+        assert get_partition_number('/dev/mmcblk0p2', '/dev/mmcblk0') == 2
+        assert get_partition_number('/dev/sdc1', '/dev/sdb') is None
@@ -0,0 +1,40 @@
+from liveusb.progress import ProgressBus
+
+
+class TestProgressBus:
+
+    def setup_method(self, method):
+        self.bus = ProgressBus([('verify', 100), ('copy', 300)])
+
+    def test_weighted(self):
+        verify = self.bus.stage('verify')
+        verify.set_max_progress(10)
+        verify.update_progress(5)
+        assert self.bus.snapshot().done == 50
+        verify.update_progress(10)
+        copy = self.bus.stage('copy')
+        copy.set_max_progress(4)
+        copy.update_progress(1)
+        event = self.bus.snapshot()
+        assert event.stage == 'copy'
+        assert (event.value, event.maximum) == (1, 4)
+        assert (event.done, event.total) == (175, 400)
+
+    def test_finish(self):
+        # stages that never report anything still count once they're done
+        self.bus.stage('verify').finish()
+        assert self.bus.snapshot().done == 100
+        copy = self.bus.stage('copy')
+        copy.set_max_progress(4)
+        copy.update_progress(3)
+        copy.finish()
+        assert self.bus.snapshot().done == 400
+
+    def test_listeners(self):
+        events = []
+        self.bus.subscribe(events.append)
+        self.bus.stage('copy').set_max_progress(3)
+        self.bus.stage('copy').update_progress(3)
+        self.bus.unsubscribe(events.append)
+        self.bus.stage('verify').finish()
+        assert [event.done for event in events] == [0, 300]
@@ -0,0 +1,79 @@
+import threading
+import time
+
+from liveusb.scheduler import WriteScheduler, WriteCancelled, Group
+from liveusb.scheduler import get_port_groups
+
+
+class TestWriteScheduler:
+
+    def setup_method(self, method):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.most = {}
+
+    def _write(self, group):
+        def write():
+            with self.lock:
+                self.running[group] = self.running.get(group, 0) + 1
+                self.most[group] = max(self.most.get(group, 0),
+                                       self.running[group])
+            time.sleep(0.05)
+            with self.lock:
+                self.running[group] -= 1
+            return 1024**2
+        return write
+
+    def test_port_groups(self):
+        assert get_port_groups('2-1.4') == ['2', '2-1']
+        assert get_port_groups('2-1.4.3') == ['2', '2-1.4']
+        assert get_port_groups('3-2') == ['3']
+        assert get_port_groups(None) == []
+
+    def test_caps(self):
+        scheduler = WriteScheduler(hub_cap=2, controller_cap=3,
+                                   adaptive=False)
+        for i in range(1, 5):
+            scheduler.submit('hub%d' % i, '1-1.%d' % i, self._write('1-1'))
+            scheduler.submit('root%d' % i, '2-%d' % i, self._write('2'))
+            scheduler.submit('sd%d' % i, None, self._write(None))
+        results = scheduler.run()
+        assert len(results) == 12 and not any(results.values())
+        assert self.most['1-1'] == 2
+        assert self.most['2'] == 3
+        # drives we know nothing about all go at once
+        assert self.most[None] == 4
+
+    def test_errors(self):
+        def fail():
+            raise IOError('gone')
+        scheduler = WriteScheduler()
+        scheduler.submit('bad', '1-1', fail)
+        scheduler.submit('good', '1-2', self._write('1'))
+        results = scheduler.run()
+        assert isinstance(results['bad'], IOError)
+        assert results['good'] is None
+
+    def test_cancel(self):
+        scheduler = WriteScheduler(controller_cap=1, adaptive=False)
+        scheduler.submit('first', '1-1', lambda: scheduler.cancel())
+        scheduler.submit('second', '1-2', self._write('1'))
+        results = scheduler.run()
+        assert results['first'] is None
+        assert isinstance(results['second'], WriteCancelled)
+        assert '1' not in self.most
+
+
+class TestGroup:
+
+    def test_adapts(self):
+        group = Group('1-1', 2)
+        # two at once do better than one, so try three
+        group.record(1, 20.0)
+        group.record(2, 15.0)
+        assert group.cap == 2
+        group.record(2, 15.0)
+        assert group.cap == 3
+        # three at once share the bus worse than two, so back to two
+        group.record(3, 8.0)
+        assert group.cap == 2
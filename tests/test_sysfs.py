@@ -0,0 +1,153 @@
+import os
+import shutil
+import struct
+import tempfile
+
+from liveusb.sysfs import SysfsDevices, get_usb_port, parse_uevent
+from liveusb.sysfs import get_device_port
+from liveusb.sysfs import probe_fat, probe_ext
+
+USB_PATH = ('devices/pci0000:00/0000:00:14.0/usb2/2-1/2-1.4/2-1.4:1.0/'
+            'host6/target6:0:0/6:0:0:0/block')
+SATA_PATH = 'devices/pci0000:00/0000:00:17.0/ata1/host0/target0:0:0/block'
+
+
+def make_fat32(label, serial):
+    boot = bytearray(512)
+    boot[67:71] = struct.pack('<I', serial)
+    boot[71:82] = label.ljust(11)
+    boot[82:90] = 'FAT32   '
+    boot[510:512] = '\x55\xaa'
+    return str(boot)
+
+
+def make_ext(label, compat=0, incompat=0):
+    superblock = bytearray(1024)
+    superblock[56:58] = struct.pack('<H', 0xEF53)
+    superblock[76:80] = struct.pack('<I', 1)
+    superblock[92:100] = struct.pack('<II', compat, incompat)
+    superblock[104:120] = '\x12' * 16
+    superblock[120:136] = label.ljust(16, '\0')
+    return '\0' * 1024 + str(superblock)
+
+
+class TestSysfsDevices:
+
+    def setup_method(self, method):
+        self.root = tempfile.mkdtemp()
+        for name in ('sys/block', 'sys/class/block', 'dev', 'proc'):
+            os.makedirs(os.path.join(self.root, name))
+        self._add_disk('sdb', USB_PATH, '1', 'SanDisk', 'Cruzer',
+                       {'sdb1': make_fat32('LIVE', 0x1234ABCD)})
+        self._add_disk('sda', SATA_PATH, '0', 'ATA', 'SSD',
+                       {'sda1': make_ext('root', incompat=0x40)})
+        with open(os.path.join(self.root, 'proc', 'mounts'), 'w') as mounts:
+            mounts.write('/dev/sda1 / ext4 rw 0 0\n'
+                         '/dev/sdb1 /run/media/LIVE\\040STICK vfat rw 0 0\n')
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.root)
+
+    def _write(self, path, data):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as out:
+            out.write(data)
+
+    def _add_disk(self, disk, path, removable, vendor, model, partitions):
+        diskpath = os.path.join(self.root, 'sys', path, disk)
+        self._write(os.path.join(diskpath, 'removable'), removable + '\n')
+        self._write(os.path.join(diskpath, 'device', 'vendor'), vendor + '\n')
+        self._write(os.path.join(diskpath, 'device', 'model'), model + '\n')
+        os.symlink(diskpath, os.path.join(self.root, 'sys', 'block', disk))
+        os.symlink(diskpath, os.path.join(self.root, 'sys', 'class', 'block',
+                                          disk))
+        for part, data in partitions.items():
+            self._write(os.path.join(diskpath, part, 'partition'), '1\n')
+            self._write(os.path.join(diskpath, part, 'size'), '16384\n')
+            self._write(os.path.join(self.root, 'dev', part), data)
+
+    def test_scan(self):
+        drives = SysfsDevices(self.root).scan()
+        assert drives.keys() == ['/dev/sdb1']
+        drive = drives['/dev/sdb1']
+        assert drive['fstype'] == 'vfat'
+        assert drive['fsversion'] == 'FAT32'
+        assert drive['label'] == 'LIVE'
+        assert drive['uuid'] == '1234-ABCD'
+        assert drive['size'] == 16384 * 512
+        assert drive['parent'] == '/dev/sdb'
+        assert drive['friendlyName'] == 'SanDisk Cruzer'
+        assert drive['mount'] == ['/run/media/LIVE STICK']
+        assert drive['port'] == '2-1.4'
+
+    def test_device_port(self):
+        assert get_device_port('/dev/sdb', self.root) == '2-1.4'
+        assert get_device_port('/dev/sda', self.root) is None
+        assert get_device_port('/dev/sdz', self.root) is None
+
+    def test_creator(self):
+        from liveusb import LiveUSBCreator
+
+        class Options:
+            console = True
+            force = False
+            verbose = False
+            backend = 'sysfs'
+
+        live = LiveUSBCreator(Options())
+        live.sysfs_root = self.root
+        live.detect_removable_drives()
+        assert live.drives.keys() == ['/dev/sdb1']
+        assert live.drive['mount'] == '/run/media/LIVE STICK'
+
+    def test_hotplug_locked(self):
+        import threading
+        from liveusb import LiveUSBCreator
+
+        class Options:
+            console = True
+            force = False
+            verbose = False
+            backend = 'sysfs'
+
+        live = LiveUSBCreator(Options())
+        live.sysfs_root = self.root
+        changes = []
+        live.detect_removable_drives(callback=changes.append)
+        self._add_disk('sdc', USB_PATH.replace('1.4', '1.3'), '1', 'Kingston',
+                       'DataTraveler', {'sdc1': make_fat32('NEW', 0x5678)})
+        # a uevent on the monitor's thread waits for whoever is reading
+        with live.drives_lock:
+            uevent = threading.Thread(target=live._handle_uevent,
+                                      args=('add', {'DEVNAME': 'sdc1'}))
+            uevent.start()
+            uevent.join(0.2)
+            assert sorted(live.drives) == ['/dev/sdb1']
+        uevent.join()
+        assert sorted(live.drives) == ['/dev/sdb1', '/dev/sdc1']
+        assert changes[-1] == ['/dev/sdc1']
+
+
+class TestProbes:
+
+    def test_fat(self):
+        assert probe_fat(make_fat32('NO NAME', 1)) == \
+                ('vfat', 'FAT32', '', '0000-0001')
+        assert probe_fat('\0' * 512) is None
+
+    def test_ext(self):
+        assert probe_ext(make_ext('LIVE')[1024:])[:3] == ('ext2', '1.0', 'LIVE')
+        assert probe_ext(make_ext('', compat=4)[1024:])[0] == 'ext3'
+        assert probe_ext(make_ext('', incompat=0x40)[1024:])[0] == 'ext4'
+        assert probe_ext('\0' * 1024) is None
+
+    def test_usb_port(self):
+        assert get_usb_port('/sys/' + USB_PATH + '/sdb') == '2-1.4'
+        assert get_usb_port('/sys/' + SATA_PATH + '/sda') is None
+
+    def test_uevent(self):
+        action, env = parse_uevent('add@/devices/.../block/sdc\0ACTION=add\0'
+                                   'SUBSYSTEM=block\0DEVNAME=sdc\0')
+        assert action == 'add'
+        assert env['SUBSYSTEM'] == 'block' and env['DEVNAME'] == 'sdc'
@@ -0,0 +1,266 @@
+import os
+import sys
+import imp
+import time
+import errno
+import hashlib
+import shutil
+import threading
+import tempfile
+
+from liveusb.transfer import ImageWriter, StreamCopier, TransferCancelled
+from liveusb.transfer import FanOutWriter, TransferStalled
+from liveusb.transfer import tree_size, get_sector_size
+from liveusb.transfer import KERNEL_MODES, MODE_AUTO, MODE_BUFFERED
+from liveusb.transfer import MODE_SPLICE
+from liveusb import transfer
+
+
+class TransferTest(object):
+
+    def setup_method(self, method):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown_method(self, method):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, size):
+        path = os.path.join(self.tmpdir, name)
+        out = open(path, 'wb')
+        out.write(os.urandom(size))
+        out.close()
+        return path
+
+    def _read(self, path):
+        f = open(path, 'rb')
+        data = f.read()
+        f.close()
+        return data
+
+
+class TestStreamCopier(TransferTest):
+
+    def test_copy_file(self):
+        # Larger than, and not a multiple of, the buffer size
+        src = self._write('squashfs.img', 3 * 65536 + 123)
+        dst = os.path.join(self.tmpdir, 'copy.img')
+        progress = []
+        copier = StreamCopier(buffer_size=65536, callback=progress.append,
+                              mode=MODE_BUFFERED)
+        assert copier.copy_file(src, dst) == os.path.getsize(src)
+        assert self._read(src) == self._read(dst)
+        assert progress[-1] == os.path.getsize(src)
+        assert progress == sorted(progress)
+
+    def test_kernel_modes(self):
+        src = self._write('squashfs.img', 65536 + 17)
+        for mode in KERNEL_MODES + (MODE_AUTO,):
+            dst = os.path.join(self.tmpdir, mode + '.img')
+            copier = StreamCopier(mode=mode)
+            assert copier.copy_file(src, dst) == os.path.getsize(src)
+            assert copier.copied == os.path.getsize(src)
+            assert self._read(src) == self._read(dst)
+
+    def test_splice_falls_back(self, monkeypatch):
+        # the pipe takes the data, then dst_fd turns out not to support it
+        src = self._write('squashfs.img', 65536 + 17)
+        dst = os.path.join(self.tmpdir, 'copy.img')
+        syscall = transfer._syscall
+        calls = []
+
+        def failing(name, *args):
+            calls.append(name)
+            if name == 'splice' and len(calls) > 1:
+                raise OSError(errno.EINVAL, 'Invalid argument')
+            return syscall(name, *args)
+        monkeypatch.setattr(transfer, '_syscall', failing)
+        copier = StreamCopier(mode=MODE_SPLICE)
+        assert copier.copy_file(src, dst) == os.path.getsize(src)
+        assert calls == ['splice', 'splice']
+        assert self._read(src) == self._read(dst)
+
+    def test_auto_mode_is_remembered(self):
+        src = self._write('squashfs.img', 4096)
+        copier = StreamCopier()
+        copier.copy_file(src, os.path.join(self.tmpdir, 'a.img'))
+        assert len(copier.modes) == 1
+        mode = list(copier.modes.values())[0]
+        copier.copy_file(src, os.path.join(self.tmpdir, 'b.img'))
+        assert list(copier.modes.values()) == [mode]
+
+    def test_copy_tree(self):
+        src = os.path.join(self.tmpdir, 'isolinux')
+        os.makedirs(os.path.join(src, 'sub'))
+        self._write(os.path.join('isolinux', 'vmlinuz0'), 5000)
+        self._write(os.path.join('isolinux', 'sub', 'grub.cfg'), 10)
+        dst = os.path.join(self.tmpdir, 'dest')
+        copier = StreamCopier(buffer_size=4096)
+        assert copier.copy(src, dst) == tree_size(src) == 5010
+        assert self._read(os.path.join(dst, 'sub', 'grub.cfg')) == \
+               self._read(os.path.join(src, 'sub', 'grub.cfg'))
+
+    def test_copy_hashes(self):
+        src = os.path.join(self.tmpdir, 'isolinux')
+        os.makedirs(src)
+        self._write(os.path.join('isolinux', 'vmlinuz0'), 70000)
+        self._write(os.path.join('isolinux', 'initrd0.img'), 100)
+        dst = os.path.join(self.tmpdir, 'dest')
+        copier = StreamCopier(buffer_size=4096, algorithm='sha1')
+        copier.copy(src, dst)
+        for name in ('vmlinuz0', 'initrd0.img'):
+            path = os.path.join(dst, name)
+            assert self._read(path) == self._read(os.path.join(src, name))
+            assert copier.checksums[path] == \
+                hashlib.sha1(self._read(path)).hexdigest()
+
+    def test_without_fcntl(self, monkeypatch):
+        # as on Windows, where importing liveusb must still work
+        monkeypatch.setitem(sys.modules, 'fcntl', None)
+        monkeypatch.setattr(sys, 'platform', 'win32')
+        module = imp.load_source('transfer_without_fcntl',
+                                 os.path.splitext(transfer.__file__)[0] + '.py')
+        assert module.fcntl is None
+        src = self._write('squashfs.img', 65536 + 17)
+        dst = os.path.join(self.tmpdir, 'copy.img')
+        copier = module.StreamCopier()
+        assert copier.copy_file(src, dst) == os.path.getsize(src)
+        assert copier.modes == {}
+        assert self._read(src) == self._read(dst)
+
+    def test_cancel(self):
+        src = self._write('squashfs.img', 65536)
+        copier = StreamCopier(buffer_size=4096, mode=MODE_BUFFERED)
+        copier.callback = lambda copied: copier.cancel()
+        try:
+            copier.copy_file(src, os.path.join(self.tmpdir, 'copy.img'))
+        except TransferCancelled:
+            pass
+        else:
+            raise AssertionError("Transfer was not cancelled")
+        assert copier.copied < 65536
+
+
+class TestImageWriter(TransferTest):
+
+    def test_write_image(self):
+        # Not a whole number of sectors, to exercise the O_DIRECT tail
+        image = self._write('live.iso', 5 * 65536 + 100)
+        device = self._write('device', 8 * 65536)
+        progress = []
+        writer = ImageWriter(block_size=65536, sync_interval=65536,
+                             callback=progress.append)
+        assert writer.write_image(image, device) == os.path.getsize(image)
+        assert progress[-1] == os.path.getsize(image)
+        written = self._read(device)
+        assert len(written) == 8 * 65536
+        assert written[:len(self._read(image))] == self._read(image)
+
+    def test_sector_size(self):
+        # whole 512 byte sectors, but not whole 4096 byte ones
+        image = self._write('live.iso', 3 * 65536 + 1536)
+        device = self._write('device', 4 * 65536)
+        with open(device) as f:
+            assert get_sector_size(f.fileno()) == 4096
+        source, readback = hashlib.sha256(), hashlib.sha256()
+        writer = ImageWriter(block_size=65536)
+        writer.write_image(image, device, hashes=[source], readback=[readback])
+        assert readback.hexdigest() == source.hexdigest()
+        assert self._read(device)[:3 * 65536 + 1536] == self._read(image)
+
+    def test_write_image_hashes(self):
+        image = self._write('live.iso', 3 * 65536 + 100)
+        device = self._write('device', 4 * 65536)
+        source, readback = hashlib.sha256(), hashlib.sha256()
+        writer = ImageWriter(block_size=65536)
+        writer.write_image(image, device, hashes=[source], readback=[readback])
+        expected = hashlib.sha256(self._read(image)).hexdigest()
+        assert source.hexdigest() == expected
+        assert readback.hexdigest() == expected
+
+
+class TestFanOutWriter(TransferTest):
+
+    def test_write_image(self):
+        image = self._write('live.iso', 5 * 65536 + 100)
+        devices = [self._write('device%d' % i, 8 * 65536) for i in range(3)]
+        source = hashlib.sha256()
+        readbacks = [hashlib.sha256() for device in devices]
+        progress = dict([(device, []) for device in devices])
+        # only two blocks of buffer between the fastest and the slowest
+        writer = FanOutWriter(block_size=65536, lag=2)
+        targets = [writer.add_target(device, callback=progress[device].append,
+                                     readback=[readback])
+                   for device, readback in zip(devices, readbacks)]
+        assert writer.write_image(image, hashes=[source]) == \
+               os.path.getsize(image)
+        data = self._read(image)
+        expected = hashlib.sha256(data).hexdigest()
+        assert source.hexdigest() == expected
+        for device, target, readback in zip(devices, targets, readbacks):
+            assert target.error is None
+            assert target.copied == len(data)
+            assert progress[device][-1] == len(data)
+            assert self._read(device)[:len(data)] == data
+            assert readback.hexdigest() == expected
+
+    def test_failed_target(self):
+        image = self._write('live.iso', 4 * 65536)
+        good = self._write('device', 4 * 65536)
+        writer = FanOutWriter(block_size=65536, lag=2)
+        bad = writer.add_target(os.path.join(self.tmpdir, 'gone', 'device'))
+        target = writer.add_target(good)
+        writer.write_image(image)
+        assert isinstance(bad.error[1], EnvironmentError)
+        assert target.error is None
+        assert self._read(good) == self._read(image)
+
+    def test_stalled_target(self):
+        image = self._write('live.iso', 8 * 65536)
+        fast = self._write('fast', 8 * 65536)
+        slow = self._write('slow', 8 * 65536)
+        writer = FanOutWriter(block_size=65536, lag=2, stall_timeout=0.2)
+        writer.poll_interval = 0.05
+        stalled = writer.add_target(slow, callback=lambda c: time.sleep(1))
+        target = writer.add_target(fast)
+        writer.write_image(image)
+        assert stalled.error[0] is TransferStalled
+        assert target.error is None
+        assert self._read(fast) == self._read(image)
+
+    def test_stuck_target(self):
+        image = self._write('live.iso', 4 * 65536)
+        fast = self._write('fast', 4 * 65536)
+        stuck = self._write('stuck', 4 * 65536)
+        release = threading.Event()
+        # the device stops responding on the first block, and on the last
+        for lag, stuck_at in ((2, 65536), (8, 4 * 65536)):
+            writer = FanOutWriter(block_size=65536, lag=lag,
+                                  stall_timeout=0.2)
+            writer.poll_interval = writer.detach_timeout = 0.05
+            stalled = writer.add_target(stuck, callback=lambda copied:
+                                        copied == stuck_at and release.wait())
+            target = writer.add_target(fast)
+            start = time.time()
+            writer.write_image(image)
+            assert time.time() - start < 2
+            assert stalled.error[0] is TransferStalled
+            assert stalled.detached
+            assert target.error is None and not target.detached
+            assert self._read(fast) == self._read(image)
+            release.set()
+            stalled.thread.join(1)
+            assert stalled.done
+            release.clear()
+
+    def test_cancel_target(self):
+        image = self._write('live.iso', 8 * 65536)
+        devices = [self._write('device%d' % i, 8 * 65536) for i in range(2)]
+        writer = FanOutWriter(block_size=65536, lag=2)
+        cancelled = writer.add_target(devices[0])
+        cancelled.writer.callback = lambda copied: cancelled.cancel()
+        target = writer.add_target(devices[1])
+        writer.write_image(image)
+        assert cancelled.error[0] is TransferCancelled
+        assert cancelled.copied == 65536
+        assert target.error is None
+        assert self._read(devices[1]) == self._read(image)